@@ -11,7 +11,15 @@ setup(
     package_dir={'': 'src'},
     
     install_requires=['pytest', 'click', 'td-client', 'tabulate', 'mock'],
+    extras_require={
+        'arrow': ['pyarrow'],
+        'zstd': ['zstandard'],
+        'numpy': ['numpy'],
+        'yaml': ['pyyaml'],
+    },
     entry_points={
-        'console_scripts': ['query = armdata.query_cli:start']
+        'console_scripts': ['query = armdata.query_cli:start',
+                            'query-batch = armdata.batch:main',
+                            'query-daemon = armdata.daemon:main']
     }
 )
\ No newline at end of file
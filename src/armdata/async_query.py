@@ -0,0 +1,95 @@
+"""
+Query the database from asyncio code
+"""
+
+import asyncio
+import functools
+import tdclient
+from armdata.query_util import ArmQuery
+
+
+class AsyncArmQuery:
+    """Coroutine counterpart of query_util.ArmQuery.
+
+    Each HTTP request runs on the event loop's default executor, but waiting
+    for a job is an asyncio sleep between status checks, so one event loop
+    can drive many concurrent jobs without a thread per job. The checks
+    follow the backoff of polling.JobPoller, shared with ArmQuery.
+    Cancelling a task awaiting query() kills the remote job.
+    """
+
+    def __init__(self, apikey, endpoint='https://api.treasuredata.com', **kwargs):
+        """
+        Args:
+            apikey: Treasure Data API key
+            endpoint: Treasure Data API endpoint
+            kwargs: other ArmQuery arguments (metadata_cache, pool_size,
+                job_timeout, ...)
+        """
+        self._arm_query = ArmQuery(apikey, endpoint, **kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Release the shared client and its connections
+        """
+        await self._run(self._arm_query.close)
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    async def checkDbAndTable(self, database, table):
+        """Check that the specified db and table exist, see ArmQuery.checkDbAndTable
+        """
+        return await self._run(self._arm_query.checkDbAndTable, database, table)
+
+    async def checkTableColumns(self, db, table, col_list):
+        """Check that the column list are indeed in the specified table, see
+        ArmQuery.checkTableColumns
+        """
+        return await self._run(self._arm_query.checkTableColumns, db, table, col_list)
+
+    async def _waitJob(self, job):
+        """Wait until the job finishes, see polling.JobPoller.waitAsync
+        Args:
+            job: tdclient job
+        """
+        await self._arm_query.waitAsync(job, self._run)
+
+    async def query(self, db, table, col_list, min_time, max_time, limit, engine):
+        """Query the specified table, see ArmQuery.query
+        Args:
+            db: database name
+            table: table name
+            col_list: list of column names
+            min_time: min time stamp
+            max_time: max time stamp
+            limit: limit of records
+            engine: engine type
+        Return:
+            tuple of column names and List of records that match the query criteria
+        """
+        if not col_list:
+            column_names = await self._run(self._arm_query.tableColumnNames, db, table)
+            col_list = ",".join(column_names)
+        else:
+            column_names = col_list.split(',')
+
+        query = self._arm_query.buildQuery(table, col_list, min_time, max_time, limit, engine=engine)
+        job = await self._run(self._arm_query.submit, db, query, engine)
+        try:
+            await self._waitJob(job)
+        except asyncio.CancelledError:
+            # the kill must reach the server even though this task is cancelled
+            try:
+                await asyncio.shield(self._run(job.kill))
+            except tdclient.errors.APIError:
+                pass
+            raise
+        rows = await self._run(lambda: list(job.result()))
+        return (column_names, rows)
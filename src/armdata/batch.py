@@ -0,0 +1,234 @@
+"""
+Run the queries of a manifest file with a shared job scheduler
+
+    query-batch manifest.yaml
+
+A manifest lists the queries and how many jobs may run at once:
+
+    concurrency: 8           # jobs running at the same time, 4 by default
+    engines:                 # optional per engine limits
+      hive: 2
+    defaults:                # optional values shared by every query
+      db: sample_datasets
+      format: csv
+    queries:
+      - name: access         # defaults to the output file name
+        table: www_access
+        columns: host,path   # or a list, all columns if not given
+        min: 1412377100
+        max: 1412380800
+        limit: 100
+        engine: presto       # presto by default
+        format: parquet      # csv (default), parquet, arrow or msgpack
+        output: access.parquet
+
+Manifests ending in .json are read as JSON, others as YAML (needs PyYAML).
+"""
+
+import sys
+import json
+import time
+import threading
+import click
+import tdclient
+import urllib3
+from tabulate import tabulate
+from armdata import query_util
+from armdata import writers
+from armdata.metadata_cache import MetadataCache
+from armdata.polling import JobTimeout
+from armdata.query_cli import ArmQueryCLI
+
+BATCH_FORMATS = ['csv'] + writers.COLUMNAR_FORMATS
+
+DEFAULT_CONCURRENCY = query_util.ArmQuery.DEFAULT_CONCURRENCY
+
+DEFAULT_POOL_SIZE = query_util.ArmQuery.DEFAULT_POOL_SIZE
+
+
+def load_manifest(path):
+    """Read a manifest file
+    Args:
+        path: manifest file path, JSON if it ends in .json, YAML otherwise
+    Return:
+        manifest dict
+    """
+    with open(path) as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("YAML manifests need PyYAML, install it with: pip install armdata[yaml]")
+        return yaml.safe_load(f)
+
+
+def manifest_specs(manifest):
+    """Normalize the queries of a manifest
+    Args:
+        manifest: manifest dict
+    Return:
+        list of query dicts with every key filled in
+    """
+    defaults = manifest.get("defaults") or {}
+    specs = []
+    for index, entry in enumerate(manifest.get("queries") or []):
+        spec = {"columns": None, "min": None, "max": None, "limit": None,
+                "engine": "presto", "format": "csv", "compress": None}
+        spec.update(defaults)
+        spec.update(entry)
+        for key in ("db", "table", "output"):
+            if not spec.get(key):
+                raise ValueError("Query %d of the manifest has no %s" % (index + 1, key))
+        if isinstance(spec["columns"], list):
+            spec["columns"] = ",".join(spec["columns"])
+        if spec["engine"] not in ("hive", "presto"):
+            raise ValueError("Query %d of the manifest has an unknown engine: %s" % (index + 1, spec["engine"]))
+        if spec["format"] not in BATCH_FORMATS:
+            raise ValueError("Query %d of the manifest has an unsupported format: %s" % (index + 1, spec["format"]))
+        spec.setdefault("name", spec["output"])
+        specs.append(spec)
+    return specs
+
+
+class BatchRunner:
+    """Validates the queries against their table schemas, each table looked
+    up once, then runs them with at most `concurrency` jobs at a time and
+    per engine limits. Every result streams to its own output file.
+    """
+
+    def __init__(self, arm_query, concurrency=DEFAULT_CONCURRENCY, engine_limits=None):
+        """
+        Args:
+            arm_query: query_util.ArmQuery shared by all queries
+            concurrency: jobs running at the same time
+            engine_limits: dict of engine type to jobs running at the same time
+        """
+        self._arm_query = arm_query
+        self._concurrency = concurrency
+        self._engine_limits = engine_limits or {}
+
+    def _validate(self, specs):
+        """Check the tables and columns of the queries
+        Return:
+            dict of query index to error message
+        """
+        errors = {}
+        tables = {}
+        for index, spec in enumerate(specs):
+            key = (spec["db"], spec["table"])
+            if key not in tables:
+                tables[key] = self._arm_query.resolveTable(*key)
+            status, schema = tables[key]
+            if not status:
+                errors[index] = "%s name not found" % schema.capitalize()
+            elif spec["columns"]:
+                status, missing_columns = self._arm_query.checkTableColumns(
+                    spec["db"], spec["table"], spec["columns"].split(","))
+                if not status:
+                    errors[index] = "Column names not found in the table: %s" % str(missing_columns)
+        return errors
+
+    def _runOne(self, spec):
+        """Run one query into its output file
+        Return:
+            number of records written
+        """
+        columns, rows = self._arm_query.query(spec["db"], spec["table"], spec["columns"], spec["min"],
+                                              spec["max"], spec["limit"], spec["engine"], stream=True)
+        with writers.open_output(spec["output"], compression=spec["compress"]) as out:
+            if spec["format"] == "csv":
+                return writers.write_csv(out, columns, rows)
+            column_types = self._arm_query.columnTypes(spec["db"], spec["table"], columns)
+            return writers.write_columnar(spec["format"], out, columns, column_types, rows)
+
+    def run(self, specs):
+        """Run the queries
+        Args:
+            specs: list of query dicts, see manifest_specs
+        Return:
+            list of result dicts (name, status, records, seconds, error), in
+            the order of the queries
+        """
+        results = [{"name": spec["name"], "status": "pending", "records": None, "seconds": None,
+                    "error": None} for spec in specs]
+        for index, error in self._validate(specs).items():
+            results[index].update(status="failed", error=error)
+
+        pending = [index for index, result in enumerate(results) if result["status"] == "pending"]
+        running = {}
+        cond = threading.Condition()
+
+        def run_one(index):
+            spec = specs[index]
+            started = time.time()
+            update = {"status": "failed", "error": "interrupted"}
+            try:
+                records = self._runOne(spec)
+                update = {"status": "ok", "records": records}
+            except (tdclient.errors.APIError, tdclient.errors.DatabaseError, urllib3.exceptions.HTTPError,
+                    JobTimeout, ValueError, OSError) as e:
+                update = {"status": "failed", "error": str(e)}
+            finally:
+                update["seconds"] = round(time.time() - started, 3)
+                with cond:
+                    results[index].update(update)
+                    running[spec["engine"]] -= 1
+                    cond.notify()
+
+        threads = []
+        with cond:
+            while pending:
+                # start every query whose engine still has room
+                for index in list(pending):
+                    engine = specs[index]["engine"]
+                    if sum(running.values()) >= self._concurrency:
+                        break
+                    if running.get(engine, 0) >= max(1, self._engine_limits.get(engine, self._concurrency)):
+                        continue
+                    running[engine] = running.get(engine, 0) + 1
+                    pending.remove(index)
+                    thread = threading.Thread(target=run_one, args=(index,), daemon=True)
+                    thread.start()
+                    threads.append(thread)
+                if pending:
+                    cond.wait()
+        for thread in threads:
+            thread.join()
+        return results
+
+
+def print_summary(results, out=None):
+    """Print the outcome and timing of every query
+    """
+    out = out or sys.stderr
+    rows = [[r["name"], r["status"], r["records"], r["seconds"], r["error"] or ""] for r in results]
+    print(tabulate(rows, headers=["query", "status", "records", "seconds", "error"]), file=out)
+    failed = len([r for r in results if r["status"] != "ok"])
+    print("%d queries, %d failed" % (len(results), failed), file=out)
+
+
+@click.command()
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--concurrency', type=click.IntRange(min=1),
+              help='Jobs running at the same time, overrides the manifest')
+def main(manifest, concurrency):
+    """Run the queries of MANIFEST, each into its own output file"""
+    try:
+        manifest = load_manifest(manifest)
+        specs = manifest_specs(manifest)
+        apikey, endpoint = ArmQueryCLI.credentials()
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    concurrency = concurrency or manifest.get("concurrency") or DEFAULT_CONCURRENCY
+    with query_util.ArmQuery(apikey, endpoint, metadata_cache=MetadataCache(endpoint),
+                             pool_size=max(concurrency, DEFAULT_POOL_SIZE)) as arm_query:
+        runner = BatchRunner(arm_query, concurrency=concurrency, engine_limits=manifest.get("engines"))
+        try:
+            results = runner.run(specs)
+        except (tdclient.errors.APIError, tdclient.errors.DatabaseError) as e:
+            raise click.ClickException(str(e))
+    print_summary(results)
+    if any(result["status"] != "ok" for result in results):
+        sys.exit(1)
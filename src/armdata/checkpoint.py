@@ -0,0 +1,73 @@
+"""
+Track the watermark of incremental queries
+"""
+
+import os
+import json
+
+
+class Checkpoint:
+    """Highest `time` seen by previous runs, kept in a small JSON file so
+    the next run only asks for newer records.
+    """
+
+    def __init__(self, path):
+        """Load the checkpoint file if it exists
+        Args:
+            path: checkpoint file path
+        """
+        self.path = path
+        self.max_time = None
+        self.exists = False
+        try:
+            with open(path) as f:
+                self.max_time = json.load(f).get("max_time")
+            self.exists = True
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            raise ValueError("Invalid checkpoint file: %s" % path)
+        self._seen_max_time = self.max_time
+
+    def nextMinTime(self, min_time):
+        """Min time stamp of the next run
+        Args:
+            min_time: min time stamp requested, or None
+        Return:
+            the later of min_time and the record after the watermark
+        """
+        if self.max_time is None:
+            return min_time
+        return max(min_time or 0, self.max_time + 1)
+
+    def track(self, rows, time_index):
+        """Pass the records through, remembering the highest time
+        Args:
+            rows: iterator of records
+            time_index: position of the time column in a record
+        Return:
+            iterator yielding the same records
+        """
+        for row in rows:
+            row_time = row[time_index]
+            if row_time is not None and (self._seen_max_time is None or row_time > self._seen_max_time):
+                self._seen_max_time = row_time
+            yield row
+
+    def save(self):
+        """Write the highest time seen, atomically, once the records are output
+        """
+        if self._seen_max_time is None:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        import tempfile
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"max_time": self._seen_max_time}, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.max_time = self._seen_max_time
+        self.exists = True
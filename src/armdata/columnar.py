@@ -0,0 +1,273 @@
+"""
+Hold query results as typed columns instead of lists of records
+"""
+
+import sys
+import array
+import itertools
+from armdata.td_types import INTEGER_TYPES, FLOAT_TYPES
+
+# Strings are dictionary encoded until there are more than
+# DICTIONARY_MIN_VALUES distinct ones making up more than this share of the
+# values, past which the column keeps them as they are
+DICTIONARY_MAX_RATIO = 0.5
+DICTIONARY_MIN_VALUES = 1024
+
+# Records turned into columns at a time
+BATCH_ROWS = 10000
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ValueError("NumPy arrays need numpy, install it with: pip install numpy")
+    return numpy
+
+
+class ObjectColumn:
+    """Column of Python values, for the types without a compact form and
+    for columns holding values that do not fit their type
+    """
+
+    def __init__(self, values=None):
+        self.values = list(values or [])
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def extend(self, values):
+        """Append values
+        Return:
+            the column holding them, this one or the one it was converted to
+        """
+        self.values.extend(values)
+        return self
+
+    def take(self, indices):
+        """Column of the values at the given positions"""
+        return ObjectColumn([self.values[index] for index in indices])
+
+    def memoryBytes(self):
+        """Approximate bytes taken by the column"""
+        return sys.getsizeof(self.values) + sum(sys.getsizeof(value) for value in self.values)
+
+    def array(self):
+        """NumPy array of the values, needs numpy"""
+        numpy = _import_numpy()
+        result = numpy.empty(len(self.values), dtype=object)
+        for index, value in enumerate(self.values):
+            result[index] = value
+        return result
+
+
+class TypedColumn:
+    """Column of 64 bit integers ("q") or floats ("d") with an optional
+    validity byte per value telling the nulls apart
+    """
+
+    def __init__(self, typecode):
+        self.values = array.array(typecode)
+        # None until the first null, then 1 for every value set and 0 for nulls
+        self.valid = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if self.valid is not None and not self.valid[index]:
+            return None
+        return self.values[index]
+
+    def __iter__(self):
+        if self.valid is None:
+            return iter(self.values)
+        return (value if valid else None for value, valid in zip(self.values, self.valid))
+
+    def extend(self, values):
+        """Append values, see ObjectColumn.extend"""
+        size = len(self.values)
+        try:
+            if None not in values:
+                self.values.extend(values)
+                if self.valid is not None:
+                    self.valid.extend(b"\x01" * len(values))
+                return self
+            if self.valid is None:
+                self.valid = bytearray(b"\x01" * size)
+            for value in values:
+                self.values.append(0 if value is None else value)
+                self.valid.append(value is not None)
+            return self
+        except (TypeError, OverflowError):
+            del self.values[size:]
+            if self.valid is not None:
+                del self.valid[size:]
+            return ObjectColumn(self).extend(values)
+
+    def take(self, indices):
+        """Column of the values at the given positions"""
+        column = TypedColumn(self.values.typecode)
+        column.values.extend(self.values[index] for index in indices)
+        if self.valid is not None:
+            column.valid = bytearray(self.valid[index] for index in indices)
+        return column
+
+    def memoryBytes(self):
+        """Approximate bytes taken by the column"""
+        return sys.getsizeof(self.values) + (sys.getsizeof(self.valid) if self.valid is not None else 0)
+
+    def array(self):
+        """NumPy array of the values sharing their memory, a masked array
+        when the column holds nulls; needs numpy
+        """
+        numpy = _import_numpy()
+        values = numpy.frombuffer(self.values, dtype=numpy.int64 if self.values.typecode == "q" else numpy.float64)
+        if self.valid is None:
+            return values
+        return numpy.ma.masked_array(values, mask=numpy.frombuffer(self.valid, dtype=numpy.uint8) == 0)
+
+
+class DictionaryColumn:
+    """Column of repetitive values kept once each in a dictionary, the
+    column itself holding their codes (-1 for nulls)
+    """
+
+    def __init__(self):
+        self.codes = array.array("i")
+        self.dictionary = []
+        self._index = {None: -1}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        code = self.codes[index]
+        return self.dictionary[code] if code >= 0 else None
+
+    def __iter__(self):
+        # code -1 picks the trailing None
+        return map((self.dictionary + [None]).__getitem__, self.codes)
+
+    def extend(self, values):
+        """Append values, see ObjectColumn.extend"""
+        index, dictionary, codes = self._index, self.dictionary, self.codes
+        size = len(codes)
+        try:
+            for value in values:
+                code = index.get(value)
+                if code is None:
+                    code = index[value] = len(dictionary)
+                    dictionary.append(value)
+                codes.append(code)
+        except TypeError:
+            # unhashable values, e.g. arrays
+            del codes[size:]
+            return ObjectColumn(self).extend(values)
+        if len(dictionary) > DICTIONARY_MIN_VALUES and len(dictionary) > len(codes) * DICTIONARY_MAX_RATIO:
+            return ObjectColumn(self)
+        return self
+
+    def take(self, indices):
+        """Column of the values at the given positions, sharing the dictionary"""
+        column = DictionaryColumn()
+        column.dictionary = list(self.dictionary)
+        column._index = dict(self._index)
+        column.codes.extend(self.codes[index] for index in indices)
+        return column
+
+    def memoryBytes(self):
+        """Approximate bytes taken by the column"""
+        return (sys.getsizeof(self.codes) + sys.getsizeof(self.dictionary) + sys.getsizeof(self._index) +
+                sum(sys.getsizeof(value) for value in self.dictionary))
+
+    def array(self):
+        """NumPy array of the decoded values, needs numpy"""
+        numpy = _import_numpy()
+        dictionary = numpy.empty(len(self.dictionary) + 1, dtype=object)
+        for code, value in enumerate(self.dictionary):
+            dictionary[code] = value
+        return dictionary[numpy.frombuffer(self.codes, dtype=numpy.intc)]
+
+
+def new_column(td_type):
+    """Empty column of the compact form of a Treasure Data type"""
+    td_type = (td_type or "").lower()
+    if td_type in INTEGER_TYPES:
+        return TypedColumn("q")
+    if td_type in FLOAT_TYPES:
+        return TypedColumn("d")
+    if td_type == "string":
+        return DictionaryColumn()
+    return ObjectColumn()
+
+
+class ColumnarResult:
+    """Records of a query held column by column: integers and floats in
+    typed arrays, strings dictionary encoded while they repeat, other
+    values as Python objects.
+
+    Iterating it yields the records as tuples, like the lists of records
+    of ArmQuery.query. column() returns a column by name, whose array()
+    is a NumPy array when numpy is installed.
+    """
+
+    def __init__(self, column_names, column_types, rows=None):
+        """
+        Args:
+            column_names: list of column names
+            column_types: list of Treasure Data column types
+            rows: optional iterator of records to read
+        """
+        self.column_names = list(column_names)
+        self.column_types = list(column_types)
+        self.columns = [new_column(td_type) for td_type in self.column_types]
+        if rows is not None:
+            self.extend(rows)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __iter__(self):
+        return zip(*self.columns)
+
+    def __getitem__(self, index):
+        return tuple(column[index] for column in self.columns)
+
+    def extend(self, rows):
+        """Read records, BATCH_ROWS at a time
+        Args:
+            rows: iterator of records
+        """
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, BATCH_ROWS))
+            if not batch:
+                return
+            for index, column in enumerate(self.columns):
+                self.columns[index] = column.extend([row[index] for row in batch])
+
+    def column(self, name):
+        """Column by name, see TypedColumn, DictionaryColumn and ObjectColumn"""
+        return self.columns[self.column_names.index(name)]
+
+    def take(self, indices):
+        """Result holding the records at the given positions, e.g. those
+        a vectorized filter selected
+        Args:
+            indices: sequence of record positions
+        """
+        indices = list(indices)
+        result = ColumnarResult(self.column_names, self.column_types)
+        result.columns = [column.take(indices) for column in self.columns]
+        return result
+
+    def memoryBytes(self):
+        """Approximate bytes taken by the columns"""
+        return sum(column.memoryBytes() for column in self.columns)
@@ -0,0 +1,443 @@
+"""
+Keep a query process warm and serve the query command through it
+
+    query-daemon serve &
+    query --daemon sample_datasets www_access -l 10    # forwarded to the daemon
+    query-daemon status
+    query-daemon stop
+
+The daemon listens on a Unix socket, $ARMDATA_DAEMON_SOCKET or daemon.sock
+in the cache directory, readable by its user only. It keeps the modules
+loaded, one tdclient client whose connections stay open and the metadata
+entries read, so that repeated queries skip the interpreter startup, the
+TLS handshakes and the schema lookups.
+
+A query invocation with --daemon or ARMDATA_DAEMON=1 parses its arguments,
+then sends them to the daemon when one is listening with the same API key
+and endpoint, and plays back its stdout, stderr and exit code. Otherwise
+the query runs in the invoking process as before.
+
+Messages on the socket are frames of a kind byte, the payload length as a
+4 byte big-endian integer and the payload.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import socket
+import struct
+import hashlib
+import threading
+import contextvars
+import traceback
+import click
+from armdata.metadata_cache import default_cache_dir
+
+FRAME_HEADER = struct.Struct("!cI")
+
+# kinds of frames: the request, then the output of the query and its exit
+# code, or the reason it is not served
+REQUEST = b"Q"
+STDOUT = b"O"
+STDERR = b"E"
+EXIT = b"X"
+DECLINED = b"D"
+STATUS = b"S"
+
+# bytes of output buffered before a frame is sent
+OUTPUT_BUFFER_BYTES = 64 * 1024
+
+
+def daemon_socket_path():
+    """Socket of the daemon: $ARMDATA_DAEMON_SOCKET, or daemon.sock in the
+    cache directory, see metadata_cache.default_cache_dir
+    """
+    return os.getenv("ARMDATA_DAEMON_SOCKET") or os.path.join(default_cache_dir(), "daemon.sock")
+
+
+def credentials_key(apikey, endpoint):
+    """Digest telling whether the daemon runs with the same credentials,
+    without sending the API key
+    """
+    return hashlib.sha256(("%s\n%s" % (apikey, endpoint)).encode("utf-8")).hexdigest()
+
+
+def send_frame(sock, kind, payload=b""):
+    """Send one frame
+    Args:
+        sock: connected socket
+        kind: one byte frame kind, e.g. STDOUT
+        payload: bytes
+    """
+    sock.sendall(FRAME_HEADER.pack(kind, len(payload)) + payload)
+
+
+def recv_frame(rfile):
+    """Read one frame
+    Args:
+        rfile: binary file of the socket, see socket.makefile
+    Return:
+        tuple of the frame kind and payload, (None, None) once the
+        connection is closed
+    """
+    header = rfile.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return (None, None)
+    kind, size = FRAME_HEADER.unpack(header)
+    payload = rfile.read(size)
+    if len(payload) < size:
+        return (None, None)
+    return (kind, payload)
+
+
+def send_json(sock, kind, value):
+    send_frame(sock, kind, json.dumps(value).encode("utf-8"))
+
+
+class _FrameWriter(io.RawIOBase):
+    """Binary stream sending what is written as frames of one kind"""
+
+    def __init__(self, sock, lock, kind, tty):
+        """
+        Args:
+            sock: connected socket
+            lock: threading.Lock shared by the writers of the socket
+            kind: frame kind, STDOUT or STDERR
+            tty: what isatty() returns, as the stream of the client does
+        """
+        self._sock = sock
+        self._lock = lock
+        self._kind = kind
+        self._tty = tty
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return self._tty
+
+    def write(self, data):
+        with self._lock:
+            send_frame(self._sock, self._kind, bytes(data))
+        return len(data)
+
+
+def _text_writer(sock, lock, kind, tty, write_through=False):
+    """UTF-8 text stream with a buffer, like sys.stdout, sending frames"""
+    buffered = io.BufferedWriter(_FrameWriter(sock, lock, kind, tty), buffer_size=OUTPUT_BUFFER_BYTES)
+    return io.TextIOWrapper(buffered, encoding="utf-8", write_through=write_through)
+
+
+# (stdout, stderr) of the client of the query the current thread serves,
+# also seen by the threads it runs shards on, see partition.merge_shards
+_client_streams = contextvars.ContextVar("client_streams", default=None)
+
+
+class _StreamProxy:
+    """Replaces sys.stdout or sys.stderr in the daemon: every thread serving
+    a query writes to the streams of its client, other threads to the
+    streams of the daemon
+    """
+
+    def __init__(self, stream, index):
+        """
+        Args:
+            stream: the stream of the daemon
+            index: 0 for stdout, 1 for stderr
+        """
+        self._stream = stream
+        self._index = index
+
+    def __getattr__(self, attr):
+        streams = _client_streams.get()
+        return getattr(streams[self._index] if streams is not None else self._stream, attr)
+
+
+def run_params(params):
+    """Run the query command with its parsed parameters, reporting errors
+    the way click does
+    Args:
+        params: dict of the parameters of query_cli.main
+    Return:
+        exit code
+    """
+    from armdata import query_cli
+    ctx = click.Context(query_cli.main, info_name="query")
+    try:
+        with ctx:
+            ctx.invoke(query_cli.main, **params)
+        return 0
+    except click.ClickException as e:
+        if isinstance(e, click.UsageError) and e.ctx is None:
+            e.ctx = ctx
+        e.show(file=sys.stderr)
+        return e.exit_code
+    except click.exceptions.Exit as e:
+        return e.exit_code
+    except click.Abort:
+        click.echo("Aborted!", err=True)
+        return 1
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else int(e.code is not None)
+    except ConnectionError:
+        # the client went away, nobody is left to report to
+        raise
+    except Exception:
+        traceback.print_exc(file=sys.stderr)
+        return 1
+
+
+class QueryDaemon:
+    """Serves the query command on a Unix socket, one thread per
+    connection. The client connections of tdclient and the metadata read
+    are kept across the queries, see query_cli.ArmQueryCLI.shared_client.
+    Only clients with the API key and endpoint of the daemon are served.
+    """
+
+    def __init__(self, socket_path, apikey, endpoint, pool_size=None):
+        """
+        Args:
+            socket_path: Unix socket path
+            apikey: Treasure Data API key
+            endpoint: Treasure Data API endpoint
+            pool_size: connections kept alive to the endpoint,
+                ArmQuery.DEFAULT_POOL_SIZE if not given
+        Raises:
+            ValueError if a daemon already listens on the socket
+        """
+        import socketserver
+        from armdata import query_util
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(handler):
+                self._handle(handler.request)
+
+        self._path = socket_path
+        self._credentials = credentials_key(apikey, endpoint)
+        self._arm_query = query_util.ArmQuery(apikey, endpoint,
+                                              pool_size=pool_size or query_util.ArmQuery.DEFAULT_POOL_SIZE)
+        self._metadata = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._served = 0
+        self._running = 0
+        self._streams = None
+
+        if request(socket_path, {"command": "status"}) is not None:
+            raise ValueError("A query daemon already listens on %s" % socket_path)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        os.makedirs(os.path.dirname(socket_path) or ".", mode=0o700, exist_ok=True)
+        umask = os.umask(0o177)
+        try:
+            self._server = Server(socket_path, Handler)
+        finally:
+            os.umask(umask)
+
+    def serve_forever(self):
+        """Serve queries until stop is requested"""
+        from armdata import query_cli
+        self._streams = (sys.stdout, sys.stderr)
+        sys.stdout = _StreamProxy(sys.stdout, 0)
+        sys.stderr = _StreamProxy(sys.stderr, 1)
+        query_cli.ArmQueryCLI.shared_client = self._arm_query.getClient()
+        query_cli.ArmQueryCLI.shared_metadata = self._metadata
+        self._server.serve_forever()
+
+    def shutdown(self):
+        """Make serve_forever return, from another thread"""
+        self._server.shutdown()
+
+    def close(self):
+        """Stop listening and release the client"""
+        from armdata import query_cli
+        self._server.server_close()
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+        if self._streams is not None:
+            sys.stdout, sys.stderr = self._streams
+            self._streams = None
+        query_cli.ArmQueryCLI.shared_client = None
+        query_cli.ArmQueryCLI.shared_metadata = None
+        self._arm_query.close()
+
+    def status(self):
+        """dict of the process ID, seconds up, queries served and running"""
+        with self._lock:
+            return {"pid": os.getpid(), "uptime": round(time.time() - self._started),
+                    "served": self._served, "running": self._running}
+
+    def _handle(self, sock):
+        kind, payload = recv_frame(sock.makefile("rb"))
+        if kind != REQUEST:
+            return
+        message = json.loads(payload.decode("utf-8"))
+        command = message.get("command")
+        if command == "status":
+            send_json(sock, STATUS, self.status())
+        elif command == "stop":
+            send_json(sock, STATUS, self.status())
+            threading.Thread(target=self.shutdown, daemon=True).start()
+        elif command == "query":
+            if message.get("credentials") != self._credentials:
+                send_json(sock, DECLINED, {"reason": "credentials"})
+                return
+            try:
+                code = self._query(sock, message)
+            except ConnectionError:
+                return
+            send_json(sock, EXIT, {"code": code})
+
+    def _query(self, sock, message):
+        """Run a query with the output of this thread sent to the client
+        Return:
+            exit code
+        """
+        lock = threading.Lock()
+        out = _text_writer(sock, lock, STDOUT, message.get("stdout_tty", False))
+        err = _text_writer(sock, lock, STDERR, message.get("stderr_tty", False), write_through=True)
+        with self._lock:
+            self._running += 1
+        token = _client_streams.set((out, err))
+        try:
+            return run_params(message["params"])
+        finally:
+            _client_streams.reset(token)
+            with self._lock:
+                self._running -= 1
+                self._served += 1
+            for stream in (out, err):
+                try:
+                    stream.flush()
+                except (OSError, ValueError):
+                    pass
+
+
+def request(socket_path, message):
+    """Send a status or stop request to the daemon
+    Return:
+        status dict, see QueryDaemon.status, or None if no daemon listens
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            send_json(sock, REQUEST, message)
+            kind, payload = recv_frame(sock.makefile("rb"))
+    except OSError:
+        return None
+    if kind != STATUS:
+        return None
+    return json.loads(payload.decode("utf-8"))
+
+
+def forward(params, socket_path=None, out=None, err=None):
+    """Run the query command through the daemon when one listens
+    Args:
+        params: dict of the parsed parameters of query_cli.main
+        socket_path: Unix socket path, daemon_socket_path() if not given
+        out: binary file the records are written to, stdout by default
+        err: binary file the messages are written to, stderr by default
+    Return:
+        exit code, or None if no daemon serves the query and it has to run
+        in this process
+    """
+    from armdata import query_cli
+    socket_path = socket_path or daemon_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    params = dict(params, use_daemon=False)
+    for param in query_cli.main.params:
+        # the daemon runs in another directory
+        if isinstance(param.type, click.Path) and params.get(param.name):
+            params[param.name] = os.path.abspath(params[param.name])
+    try:
+        apikey, endpoint = query_cli.ArmQueryCLI.credentials()
+    except ValueError:
+        return None
+    message = {"command": "query", "params": params, "credentials": credentials_key(apikey, endpoint),
+               "stdout_tty": sys.stdout.isatty(), "stderr_tty": sys.stderr.isatty()}
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        send_json(sock, REQUEST, message)
+    except OSError:
+        sock.close()
+        return None
+    with sock:
+        rfile = sock.makefile("rb")
+        received = False
+        while True:
+            kind, payload = recv_frame(rfile)
+            if kind is None or kind == DECLINED:
+                if not received:
+                    # nothing ran yet, the query can run here instead
+                    return None
+                err = err or sys.stderr.buffer
+                err.write(b"Error: the query daemon closed the connection\n")
+                err.flush()
+                return 1
+            received = True
+            if kind == EXIT:
+                return json.loads(payload.decode("utf-8"))["code"]
+            stream = (out or sys.stdout.buffer) if kind == STDOUT else (err or sys.stderr.buffer)
+            stream.write(payload)
+            stream.flush()
+
+
+@click.group()
+def main():
+    """Keep a query process warm, the query command forwards to it"""
+
+
+socket_option = click.option('--socket', 'socket_path', type=click.Path(dir_okay=False),
+                             help='Unix socket, $ARMDATA_DAEMON_SOCKET or daemon.sock in the cache directory by default')
+
+
+@main.command()
+@socket_option
+@click.option('--pool-size', type=click.IntRange(min=1), help='Connections kept alive to the endpoint')
+def serve(socket_path, pool_size):
+    """Serve queries until stopped"""
+    from armdata.query_cli import ArmQueryCLI
+    socket_path = socket_path or daemon_socket_path()
+    try:
+        apikey, endpoint = ArmQueryCLI.credentials()
+        daemon = QueryDaemon(socket_path, apikey, endpoint, pool_size=pool_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo("Serving queries on %s" % socket_path, err=True)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+
+
+@main.command()
+@socket_option
+def stop(socket_path):
+    """Stop the daemon"""
+    socket_path = socket_path or daemon_socket_path()
+    if request(socket_path, {"command": "stop"}) is None:
+        raise click.ClickException("No query daemon listens on %s" % socket_path)
+    click.echo("Stopped the query daemon on %s" % socket_path, err=True)
+
+
+@main.command()
+@socket_option
+def status(socket_path):
+    """Print whether the daemon runs and the queries it served"""
+    socket_path = socket_path or daemon_socket_path()
+    info = request(socket_path, {"command": "status"})
+    if info is None:
+        raise click.ClickException("No query daemon listens on %s" % socket_path)
+    click.echo("pid %(pid)d, up %(uptime)ds, %(served)d queries served, %(running)d running" % info)
@@ -0,0 +1,183 @@
+"""
+Download job results in resumable chunks
+"""
+
+import os
+import json
+import zlib
+import shutil
+import hashlib
+import tempfile
+import threading
+import concurrent.futures
+import msgpack
+import tdclient
+import urllib3
+from armdata.metadata_cache import default_cache_dir
+
+DEFAULT_CHUNK_BYTES = 64 * 1024 ** 2
+
+# attempts at a chunk before the download fails and has to be resumed
+CHUNK_ATTEMPTS = 3
+
+# bytes read from a chunk file at a time
+READ_BYTES = 1024 ** 2
+
+
+class ResumableDownloads:
+    """Job results fetched as byte ranges of their msgpack.gz form.
+
+    Each completed chunk is kept in a directory of its own per job along
+    with a state file listing the completed chunks, so an interrupted
+    download continues where it stopped instead of starting over. The
+    directory is removed once every record has been read.
+    """
+
+    def __init__(self, endpoint, cache_dir=None, chunk_bytes=DEFAULT_CHUNK_BYTES, threads=1, on_start=None):
+        """
+        Args:
+            endpoint: Treasure Data API endpoint the jobs run on
+            cache_dir: cache directory, metadata_cache.default_cache_dir()
+                if not given
+            chunk_bytes: size of the byte ranges
+            threads: byte ranges downloaded at the same time
+            on_start: optional callable taking the job ID, called when the
+                download of a result starts or resumes
+        """
+        self._endpoint = endpoint
+        self._dir = os.path.join(cache_dir or default_cache_dir(), "downloads")
+        self._chunk_bytes = chunk_bytes
+        self._threads = threads
+        self._on_start = on_start
+
+    def jobDir(self, job_id):
+        """Directory holding the state and chunks of a job result"""
+        prefix = hashlib.sha1(self._endpoint.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self._dir, "%s-%s" % (prefix, job_id))
+
+    def rows(self, api, job_id):
+        """Download the result of a finished job
+        Args:
+            api: tdclient API
+            job_id: job ID
+        Return:
+            iterator of records, fed in order while later chunks download
+        """
+        return _JobDownload(api, job_id, self.jobDir(job_id), self._chunk_bytes, self._threads,
+                            self._on_start).rows()
+
+
+class _JobDownload:
+
+    def __init__(self, api, job_id, directory, chunk_bytes, threads, on_start):
+        self._api = api
+        self._job_id = job_id
+        self._dir = directory
+        self._threads = threads
+        self._on_start = on_start
+        self._lock = threading.Lock()
+        self._state = self._loadState()
+        if self._state is None:
+            result_size = api.show_job(job_id).get("result_size")
+            if result_size is None:
+                raise ValueError("Job %s does not report the size of its result, it cannot be "
+                                 "downloaded in chunks" % job_id)
+            self._state = {"job_id": job_id, "result_size": result_size, "chunk_bytes": chunk_bytes,
+                           "completed": []}
+
+    def _statePath(self):
+        return os.path.join(self._dir, "state.json")
+
+    def _chunkPath(self, index):
+        return os.path.join(self._dir, "part-%05d" % index)
+
+    def _loadState(self):
+        try:
+            with open(self._statePath()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            raise ValueError("Invalid download state file: %s" % self._statePath())
+
+    def _saveState(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._state, f)
+            os.replace(tmp_path, self._statePath())
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _chunks(self):
+        size, chunk_bytes = self._state["result_size"], self._state["chunk_bytes"]
+        return [(index, start, min(start + chunk_bytes, size) - 1)
+                for index, start in enumerate(range(0, size, chunk_bytes))]
+
+    def _fetchChunk(self, index, start, end):
+        """Download one byte range into its chunk file, retried CHUNK_ATTEMPTS times,
+        also when the connection drops in the middle of the response
+        Raises:
+            IOError once every attempt failed, telling how to resume
+        """
+        url = "/v3/job/result/%s?format=msgpack.gz" % self._job_id
+        for attempt in range(CHUNK_ATTEMPTS):
+            tmp_path = self._chunkPath(index) + ".tmp"
+            try:
+                with self._api.get(url, headers={"Range": "bytes=%d-%d" % (start, end)}) as res:
+                    if res.status not in (200, 206) or (res.status == 200 and start > 0):
+                        self._api.raise_error("Get job result failed", res, b"")
+                    with open(tmp_path, "wb") as f:
+                        for data in res.stream(READ_BYTES):
+                            f.write(data)
+                if os.path.getsize(tmp_path) != end - start + 1:
+                    raise IOError("Chunk %d of job %s is truncated" % (index, self._job_id))
+                os.replace(tmp_path, self._chunkPath(index))
+                break
+            except (IOError, tdclient.errors.APIError, urllib3.exceptions.HTTPError) as e:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                if attempt == CHUNK_ATTEMPTS - 1:
+                    raise IOError("Chunk %d of job %s failed %d times (%s), continue the download with "
+                                  "--resume %s" % (index, self._job_id, CHUNK_ATTEMPTS, e, self._job_id)) from e
+        with self._lock:
+            self._state["completed"].append(index)
+            self._saveState()
+
+    def _readChunk(self, index):
+        with open(self._chunkPath(index), "rb") as f:
+            while True:
+                data = f.read(READ_BYTES)
+                if not data:
+                    return
+                yield data
+
+    def rows(self):
+        os.makedirs(self._dir, exist_ok=True)
+        self._saveState()
+        if self._on_start is not None:
+            self._on_start(self._job_id)
+        chunks = self._chunks()
+        completed = set(self._state["completed"])
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self._threads)
+        try:
+            futures = {index: pool.submit(self._fetchChunk, index, start, end)
+                       for index, start, end in chunks if index not in completed}
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            unpacker = msgpack.Unpacker(raw=False, max_buffer_size=1000 * 1024 ** 2)
+            for index, _, _ in chunks:
+                if index in futures:
+                    futures[index].result()
+                for data in self._readChunk(index):
+                    while data:
+                        unpacker.feed(decompressor.decompress(data))
+                        # a result may hold several gzip members
+                        data = decompressor.unused_data
+                        if data:
+                            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                        for row in unpacker:
+                            yield row
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(self._dir, ignore_errors=True)
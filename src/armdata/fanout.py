@@ -0,0 +1,77 @@
+"""
+Expand database and table names into the tables a query fans out to
+"""
+
+import fnmatch
+
+# Result column holding the "db.table" each record of a fan-out comes from,
+# underscored to stay clear of the columns of the tables
+SOURCE_COLUMN = "_source"
+
+_GLOB_CHARS = "*?["
+
+
+def split_names(names):
+    """List of the names or patterns of a comma separated argument"""
+    return [name.strip() for name in names.split(",") if name.strip()]
+
+
+def is_pattern(name):
+    """True if name is a glob pattern, e.g. events_*"""
+    return any(char in name for char in _GLOB_CHARS)
+
+
+def is_fanout(db_names, table_names):
+    """True if the arguments name more than one database or table"""
+    return any("," in names or is_pattern(names) for names in (db_names, table_names))
+
+
+def match_names(patterns, names):
+    """Expand names and glob patterns against the existing names
+    Args:
+        patterns: list of names and glob patterns
+        names: list of existing names, or None if they are unknown, in
+            which case plain names are taken as they are
+    Return:
+        tuple of the matching names, in the order of the patterns and
+        without duplicates, and the list of plain names that do not exist
+    """
+    matched, missing = [], []
+    for pattern in patterns:
+        if is_pattern(pattern):
+            found = fnmatch.filter(sorted(names or []), pattern)
+        elif names is None or pattern in names:
+            found = [pattern]
+        else:
+            found = []
+            missing.append(pattern)
+        matched.extend(name for name in found if name not in matched)
+    return (matched, missing)
+
+
+def union_columns(column_lists):
+    """Column names of all the lists, in the order they are first seen"""
+    union = []
+    for column_names in column_lists:
+        union.extend(name for name in column_names if name not in union)
+    return union
+
+
+def tag_rows(source, column_names, union, rows):
+    """Records of one table laid out in the union of the columns, after
+    their source
+    Args:
+        source: "db.table" of the records
+        column_names: list of the column names of the records
+        union: list of the column names of the fan-out, see union_columns
+        rows: iterator of records
+    Return:
+        iterator of records, None for the columns the table does not have
+    """
+    if column_names == union:
+        for row in rows:
+            yield [source] + list(row)
+        return
+    positions = [column_names.index(name) if name in column_names else None for name in union]
+    for row in rows:
+        yield [source] + [row[position] if position is not None else None for position in positions]
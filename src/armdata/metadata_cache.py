@@ -0,0 +1,111 @@
+"""
+Cache database, table and column metadata on disk
+"""
+
+import os
+import json
+import time
+
+
+def default_cache_dir():
+    """Directory holding the armdata caches: $ARMDATA_CACHE_DIR, or armdata
+    under $XDG_CACHE_HOME (~/.cache by default)
+    """
+    if os.getenv("ARMDATA_CACHE_DIR"):
+        return os.getenv("ARMDATA_CACHE_DIR")
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "armdata")
+
+
+class MetadataCache:
+    """Metadata lookups kept in one JSON file per entry, keyed by endpoint,
+    kind (e.g. "schema") and database/table names.
+
+    Entries are written to a temporary file and renamed into place, so
+    parallel CLI processes only ever see complete entries; the last writer
+    wins when two of them refresh the same entry.
+    """
+
+    DEFAULT_TTL = 3600
+
+    def __init__(self, endpoint, cache_dir=None, ttl=DEFAULT_TTL, refresh=False, memory=None):
+        """
+        Args:
+            endpoint: Treasure Data API endpoint the metadata belongs to
+            cache_dir: cache directory, default_cache_dir() if not given
+            ttl: seconds an entry stays valid, 0 disables the cache
+            refresh: if True, existing entries are ignored and overwritten
+            memory: optional dict shared by the instances of a long-running
+                process, keeping the entries read or written so that each
+                file is only read once
+        """
+        self._endpoint = endpoint
+        self._dir = os.path.join(cache_dir or default_cache_dir(), "metadata")
+        self._ttl = ttl
+        self._refresh = refresh
+        self._memory = memory
+
+    def _path(self, kind, names):
+        import hashlib
+        key = json.dumps([self._endpoint, kind] + list(names))
+        return os.path.join(self._dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, kind, *names):
+        """Look up an entry
+        Args:
+            kind: kind of metadata, e.g. "schema"
+            names: database and table names the metadata belongs to
+        Return:
+            the cached value, or None if missing, expired or refreshing
+        """
+        if self._refresh or self._ttl <= 0:
+            return None
+        path = self._path(kind, names)
+        entry = self._memory.get(path) if self._memory is not None else None
+        if entry is None:
+            try:
+                with open(path) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                return None
+            if self._memory is not None:
+                self._memory[path] = entry
+        if time.time() - entry.get("stored_at", 0) > self._ttl:
+            return None
+        return entry.get("value")
+
+    def set(self, value, kind, *names):
+        """Store an entry
+        Args:
+            value: JSON serializable value
+            kind: kind of metadata, e.g. "schema"
+            names: database and table names the metadata belongs to
+        """
+        if self._ttl <= 0:
+            return
+        os.makedirs(self._dir, exist_ok=True)
+        import tempfile
+        entry = {"stored_at": time.time(), "value": value}
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(kind, names))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        if self._memory is not None:
+            self._memory[self._path(kind, names)] = entry
+
+    def invalidate(self, kind, *names):
+        """Remove an entry if it exists
+        Args:
+            kind: kind of metadata, e.g. "schema"
+            names: database and table names the metadata belongs to
+        """
+        if self._memory is not None:
+            self._memory.pop(self._path(kind, names), None)
+        try:
+            os.unlink(self._path(kind, names))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,141 @@
+"""
+Split a time range into shards and merge the rows of shards run in parallel
+"""
+
+import queue
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+SPLIT_SECONDS = {"hour": 3600, "day": 86400}
+
+# Rows handed from a shard's download thread to the merge at once
+SHARD_BATCH_ROWS = 1000
+
+# Batches a shard may download ahead of the merge
+SHARD_QUEUE_BATCHES = 16
+
+# Seconds the merge waits for a batch before it checks whether it was
+# stopped
+QUEUE_POLL_SECONDS = 0.1
+
+_DONE = object()
+
+_STOPPED = object()
+
+# Stop events of the merges whose shards the current thread runs, so that a
+# merge iterated by the shard of another one stops along with it
+_enclosing_stops = contextvars.ContextVar("enclosing_stops", default=())
+
+
+class _ShardError:
+    def __init__(self, error):
+        self.error = error
+
+
+def split_time_range(min_time, max_time, split_by):
+    """Split [min_time, max_time) into sub-ranges aligned on hour or day
+    boundaries (UTC)
+    Args:
+        min_time: min time stamp
+        max_time: max time stamp
+        split_by: "hour" or "day"
+    Return:
+        list of (min time stamp, max time stamp) in time order
+    """
+    step = SPLIT_SECONDS[split_by]
+    ranges = []
+    start = min_time
+    while start < max_time:
+        end = min((start // step + 1) * step, max_time)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def merge_shards(shards, concurrency, limit=None):
+    """Run shards concurrently and yield their rows shard by shard, in the
+    order the shards are given
+
+    Each shard downloads into its own bounded queue, so at most
+    `concurrency` shards are in flight and memory stays bounded. Once
+    `limit` rows are yielded, or the generator is closed, the running shards
+    are told to stop and no further shard is started. Shards run in a copy
+    of the context of the caller, see contextvars; a merge iterated by the
+    shard of another merge stops when that one does.
+    Args:
+        shards: list of callables taking a threading.Event, set when the
+            merge stops, and returning an iterator of rows
+        concurrency: number of shards run at the same time
+        limit: maximum number of rows yielded, all rows if None
+    Return:
+        iterator of rows
+    """
+    stopped = threading.Event()
+    queues = [queue.Queue(SHARD_QUEUE_BATCHES) for _ in shards]
+
+    def put(q, item):
+        while not stopped.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(shard, q):
+        _enclosing_stops.set(_enclosing_stops.get() + (stopped,))
+        if stopped.is_set():
+            return
+        rows = None
+        try:
+            rows = shard(stopped)
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= SHARD_BATCH_ROWS:
+                    if not put(q, batch):
+                        return
+                    batch = []
+            if batch and not put(q, batch):
+                return
+            put(q, _DONE)
+        except BaseException as e:
+            put(q, _ShardError(e))
+        finally:
+            if hasattr(rows, "close"):
+                rows.close()
+
+    def get(q, enclosing):
+        while True:
+            try:
+                return q.get(timeout=QUEUE_POLL_SECONDS)
+            except queue.Empty:
+                if stopped.is_set() or any(event.is_set() for event in enclosing):
+                    return _STOPPED
+
+    enclosing = _enclosing_stops.get()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        for shard, q in zip(shards, queues):
+            executor.submit(contextvars.copy_context().run, run, shard, q)
+        remaining = limit
+        for q in queues:
+            while True:
+                item = get(q, enclosing)
+                if item is _STOPPED:
+                    return
+                if item is _DONE:
+                    break
+                if isinstance(item, _ShardError):
+                    raise item.error
+                if remaining is not None:
+                    item = item[:remaining]
+                    remaining -= len(item)
+                for row in item:
+                    yield row
+                if remaining == 0:
+                    return
+    finally:
+        stopped.set()
+        executor.shutdown(wait=True)
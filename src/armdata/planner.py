@@ -0,0 +1,131 @@
+"""
+Estimate the scan of a query and choose the engine running it
+"""
+
+# Estimated bytes read above which --engine auto runs a query on Hive.
+# Long scans of many columns finish more reliably on Hive, narrow recent
+# windows much faster on Presto.
+HIVE_SCAN_BYTES = 20 * 1024 ** 3
+
+# Estimated records read above which --engine auto runs a query on Hive
+HIVE_SCAN_ROWS = 2 * 1000 ** 3
+
+
+def table_stats(info):
+    """Statistics of a table entry of tdclient's list_tables
+    Args:
+        info: dict of the table as listed by the API
+    Return:
+        dict of rows, bytes (estimated storage size), columns, first_time
+        and last_time, the creation and last log times bounding the time
+        range the records are assumed to be spread over. first_time is
+        None when the table was created at or after its last log time, as
+        bulk loaded tables are, leaving the time range unknown.
+    """
+    def timestamp(value):
+        return int(value.timestamp()) if hasattr(value, "timestamp") else int(value or 0)
+
+    first_time, last_time = timestamp(info.get("created_at")), timestamp(info.get("last_log_timestamp"))
+    #time is implicit in every table
+    columns = set(column[0] for column in info.get("schema") or []) | {"time"}
+    return {"rows": int(info.get("count") or 0), "bytes": int(info.get("estimated_storage_size") or 0),
+            "columns": len(columns),
+            "first_time": first_time if first_time < last_time else None, "last_time": last_time}
+
+
+def format_bytes(size):
+    """Human readable size, e.g. 1.5 GiB"""
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if size < 1024 or unit == "TiB":
+            return "%d %s" % (size, unit) if unit == "B" else "%.1f %s" % (size, unit)
+        size /= 1024.0
+
+
+class ScanEstimate:
+    """Records and bytes a query reads, assuming the records of the table
+    are spread evenly over its time range and its columns take the same
+    room each, as the storage is columnar.
+    """
+
+    def __init__(self, stats, min_time, max_time, columns):
+        """
+        Args:
+            stats: dict of the table statistics, see table_stats
+            min_time: min time stamp or None
+            max_time: max time stamp or None
+            columns: number of table columns read, time included
+        """
+        self.stats = stats
+        self.min_time = min_time
+        self.max_time = max_time
+        self.columns = min(columns, stats["columns"])
+        # why the estimate is rougher than usual, None if it is not
+        self.note = None
+        first_time, last_time = stats["first_time"], stats["last_time"]
+        if first_time is None:
+            self.time_fraction = 1.0
+            if min_time is not None or max_time is not None:
+                self.note = ("time range of the records unknown (table created after its last log), "
+                             "the whole table is assumed to be read")
+        else:
+            start, end = max(min_time or first_time, first_time), min(max_time or last_time, last_time)
+            self.time_fraction = max(0, end - start) / float(last_time - first_time)
+        self.column_fraction = self.columns / float(stats["columns"])
+        self.rows = int(round(stats["rows"] * self.time_fraction))
+        self.bytes = int(round(stats["bytes"] * self.time_fraction * self.column_fraction))
+
+    def engine(self):
+        """Engine fitting the scan
+        Return:
+            tuple of "hive" or "presto" and the reason for it
+        """
+        if self.bytes >= HIVE_SCAN_BYTES:
+            return ("hive", "estimated scan of %s is at least %s" % (format_bytes(self.bytes),
+                                                                      format_bytes(HIVE_SCAN_BYTES)))
+        if self.rows >= HIVE_SCAN_ROWS:
+            return ("hive", "estimated scan of {:,} records is at least {:,}".format(self.rows, HIVE_SCAN_ROWS))
+        return ("presto", "estimated scan is below %s and %s records" % (format_bytes(HIVE_SCAN_BYTES),
+                                                                           "{:,}".format(HIVE_SCAN_ROWS)))
+
+
+class QueryPlan:
+    """What a query would run: its statement, engine and estimated scan
+    """
+
+    def __init__(self, db, table, statement, engine, reason, estimate=None, jobs=1):
+        """
+        Args:
+            db: database name
+            table: table name
+            statement: SQL statement of the query (of its first job when split)
+            engine: engine type running the query
+            reason: why the engine was chosen
+            estimate: ScanEstimate, None if the table statistics are unknown
+            jobs: number of jobs the query runs as
+        """
+        self.db = db
+        self.table = table
+        self.statement = statement
+        self.engine = engine
+        self.reason = reason
+        self.estimate = estimate
+        self.jobs = jobs
+
+    def describe(self):
+        """List of [name, value] describing the plan, for --explain"""
+        lines = [["table", "%s.%s" % (self.db, self.table)]]
+        estimate = self.estimate
+        if estimate is not None:
+            lines.extend([
+                ["table records", "{:,}".format(estimate.stats["rows"])],
+                ["table size", format_bytes(estimate.stats["bytes"])],
+                ["time range read", "%.1f%%" % (estimate.time_fraction * 100)],
+                ["columns read", "%d of %d" % (estimate.columns, estimate.stats["columns"])],
+                ["estimated records", "{:,}".format(estimate.rows)],
+                ["estimated scan", format_bytes(estimate.bytes)],
+            ])
+            if estimate.note:
+                lines.append(["note", estimate.note])
+        lines.extend([["engine", "%s (%s)" % (self.engine, self.reason)], ["jobs", str(self.jobs)],
+                      ["statement", self.statement]])
+        return lines
@@ -0,0 +1,213 @@
+"""
+Wait for jobs with adaptive status checks and report their progress
+"""
+
+import sys
+import time
+import random
+import asyncio
+import threading
+import tdclient
+
+# seconds before the first job status check, growing by BACKOFF after every
+# check up to MAX_INTERVAL
+FIRST_INTERVAL = 0.2
+BACKOFF = 1.5
+MAX_INTERVAL = 30
+
+# share by which every interval is spread either way, so that concurrent
+# jobs do not check their status in lockstep
+JITTER = 0.2
+
+# statuses of a job still to finish, any other one ends the wait
+WAITING_STATUS = ["queued", "booting", "running"]
+
+
+class JobTimeout(Exception):
+    """A job did not finish within the timeout and was killed"""
+
+
+class JobPoller:
+    """Waits for jobs, checking their status soon after they are submitted,
+    then less and less often, so that short jobs return quickly and long
+    ones make few status requests. Shared by ArmQuery and AsyncArmQuery.
+    """
+
+    def __init__(self, check, timeout=None, progress=None, first_interval=None, backoff=None, max_interval=None,
+                 jitter=None):
+        """
+        Args:
+            check: callable taking a tdclient job and returning its status
+            timeout: optional seconds a job may take, after which it is
+                killed and JobTimeout raised
+            progress: optional Progress the statuses are reported to
+            first_interval: seconds before the first check, FIRST_INTERVAL
+                if not given
+            backoff: factor the interval grows by after every check, BACKOFF
+                if not given
+            max_interval: maximum seconds between two checks, MAX_INTERVAL
+                if not given
+            jitter: share by which every interval is spread either way,
+                JITTER if not given
+        """
+        self._check = check
+        self._timeout = timeout
+        self._progress = progress
+        self._first_interval = FIRST_INTERVAL if first_interval is None else first_interval
+        self._backoff = BACKOFF if backoff is None else backoff
+        self._max_interval = MAX_INTERVAL if max_interval is None else max_interval
+        self._jitter = JITTER if jitter is None else jitter
+
+    def intervals(self):
+        """Seconds to sleep before each status check, endlessly"""
+        interval = self._first_interval
+        while True:
+            yield interval * random.uniform(1 - self._jitter, 1 + self._jitter)
+            interval = min(interval * self._backoff, self._max_interval)
+
+    def _nextSleep(self, interval, started):
+        """Interval cut short by the timeout, None once it has passed"""
+        if self._timeout is None:
+            return interval
+        remaining = self._timeout - (time.monotonic() - started)
+        return min(interval, remaining) if remaining > 0 else None
+
+    def _checked(self, job, status):
+        """Report a status, True if the job no longer has to be waited for"""
+        if self._progress is not None:
+            self._progress.job(job.job_id, status)
+        return status not in WAITING_STATUS
+
+    def _timedOut(self, job):
+        return JobTimeout("Job %s did not finish within %s seconds and was killed" % (job.job_id, self._timeout))
+
+    def _kill(self, job):
+        try:
+            job.kill()
+        except tdclient.errors.APIError:
+            pass
+
+    def wait(self, job, stopped=None):
+        """Wait until the job finishes
+        Args:
+            job: tdclient job
+            stopped: optional threading.Event cutting the wait short
+        Return:
+            True once the job finished, False if stopped was set first
+        Raises:
+            JobTimeout once the timeout passed, after killing the job
+        """
+        started = time.monotonic()
+        for interval in self.intervals():
+            interval = self._nextSleep(interval, started)
+            if interval is None:
+                self._kill(job)
+                raise self._timedOut(job)
+            if stopped is not None:
+                if stopped.wait(interval):
+                    return False
+            else:
+                time.sleep(interval)
+            if self._checked(job, self._check(job)):
+                break
+        job.update()
+        return True
+
+    async def waitAsync(self, job, run):
+        """Coroutine counterpart of wait, sleeping on the event loop
+        Args:
+            job: tdclient job
+            run: coroutine function running a blocking call off the event
+                loop, e.g. AsyncArmQuery._run
+        Raises:
+            JobTimeout once the timeout passed, after killing the job
+        """
+        started = time.monotonic()
+        for interval in self.intervals():
+            interval = self._nextSleep(interval, started)
+            if interval is None:
+                await run(self._kill, job)
+                raise self._timedOut(job)
+            await asyncio.sleep(interval)
+            if self._checked(job, await run(self._check, job)):
+                break
+        await run(job.update)
+
+
+class Progress:
+    """Single status line of the jobs and the records read, rewritten in
+    place at most every REFRESH_SECONDS
+    """
+
+    REFRESH_SECONDS = 0.2
+
+    def __init__(self, out=None):
+        """
+        Args:
+            out: text file, stderr by default
+        """
+        self._out = out or sys.stderr
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._shown = 0.0
+        self._statuses = {}
+        self._rows = 0
+        self._width = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def job(self, job_id, status):
+        """Report the status of a job"""
+        with self._lock:
+            self._statuses[job_id] = status
+            self._show(force=True)
+
+    def trackRows(self, rows):
+        """Count the records read, see profiling.Profiler.trackRows
+        Args:
+            rows: iterator of records
+        Return:
+            iterator of the same records
+        """
+        for row in rows:
+            self._rows += 1
+            if not self._rows % 1000:
+                with self._lock:
+                    self._show()
+            yield row
+
+    def line(self):
+        """Text of the status line"""
+        statuses = list(self._statuses.items())
+        if not statuses:
+            jobs = "submitting"
+        elif len(statuses) == 1:
+            jobs = "job %s %s" % statuses[0]
+        else:
+            counts = {}
+            for _, status in statuses:
+                counts[status] = counts.get(status, 0) + 1
+            jobs = "jobs " + ", ".join("%d %s" % (count, status) for status, count in sorted(counts.items()))
+        return "%s | %ds | %s records" % (jobs, time.monotonic() - self._started, "{:,}".format(self._rows))
+
+    def _show(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._shown < self.REFRESH_SECONDS:
+            return
+        self._shown = now
+        line = self.line()
+        self._out.write("\r" + line.ljust(self._width))
+        self._out.flush()
+        self._width = len(line)
+
+    def close(self):
+        """Erase the status line"""
+        with self._lock:
+            if self._width:
+                self._out.write("\r" + " " * self._width + "\r")
+                self._out.flush()
+                self._width = 0
@@ -0,0 +1,223 @@
+"""
+Time the phases of a query run
+"""
+
+import sys
+import json
+import time
+import threading
+import contextlib
+
+
+class Profiler:
+    """Collects phase spans, job timings and transfer counters.
+
+    Spans and events are appended to a JSON lines trace file as they
+    complete if one is given, and summed up by summary(). Safe to share
+    between the threads of split queries.
+    """
+
+    enabled = True
+
+    def __init__(self, trace_path=None):
+        """
+        Args:
+            trace_path: optional JSON lines file receiving every span and event
+        """
+        self._lock = threading.Lock()
+        self._trace = open(trace_path, "w") if trace_path else None
+        # phase name to [count, total seconds]
+        self._phases = {}
+        self._jobs = []
+        self._counters = {}
+        self._started = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+    def _record(self, record):
+        if self._trace is not None:
+            self._trace.write(json.dumps(record, default=str) + "\n")
+
+    def addPhase(self, name, seconds):
+        """Add time measured elsewhere to a phase
+        """
+        with self._lock:
+            self._addPhase(name, seconds)
+
+    def _addPhase(self, name, seconds):
+        phase = self._phases.setdefault(name, [0, 0.0])
+        phase[0] += 1
+        phase[1] += seconds
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """Time the enclosed block as one occurrence of a phase
+        Args:
+            name: phase name
+            attrs: attributes of the span written to the trace
+        Return:
+            context manager of the attrs dict, which the block may add to
+        """
+        started = time.time()
+        perf_started = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            seconds = time.perf_counter() - perf_started
+            with self._lock:
+                self._addPhase(name, seconds)
+                self._record(dict(attrs, type="span", name=name, start=started, seconds=round(seconds, 6),
+                                  thread=threading.current_thread().name))
+
+    def event(self, name, **attrs):
+        """Record a point in time with attributes
+        """
+        with self._lock:
+            self._record(dict(attrs, type="event", name=name, time=time.time()))
+
+    def count(self, name, value):
+        """Add to a counter, e.g. rows or bytes downloaded
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def job(self, job_id, engine, info):
+        """Record the queue and run durations of a finished job
+        Args:
+            job_id: job ID
+            engine: engine type
+            info: job details of tdclient's show_job
+        """
+        created_at, start_at, end_at = info.get("created_at"), info.get("start_at"), info.get("end_at")
+        job = {
+            "job_id": job_id,
+            "engine": engine,
+            "status": info.get("status"),
+            "queue_seconds": (start_at - created_at).total_seconds() if created_at and start_at else None,
+            "run_seconds": (end_at - start_at).total_seconds() if start_at and end_at else None,
+            "records": info.get("num_records"),
+            "result_size": info.get("result_size"),
+        }
+        with self._lock:
+            self._jobs.append(job)
+            self._record(dict(job, type="job", name="job", time=time.time()))
+
+    def trackRows(self, rows, name="download"):
+        """Pass the records through, timing the wait for each one as the
+        `name` phase and counting them as `name`_rows
+        Args:
+            rows: iterator of records
+            name: phase name
+        Return:
+            iterator yielding the same records
+        """
+        rows = iter(rows)
+        count = 0
+        seconds = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    seconds += time.perf_counter() - started
+                    return
+                seconds += time.perf_counter() - started
+                count += 1
+                yield row
+        finally:
+            with self._lock:
+                self._addPhase(name, seconds)
+                self._counters[name + "_rows"] = self._counters.get(name + "_rows", 0) + count
+                self._record({"type": "span", "name": name, "seconds": round(seconds, 6), "rows": count,
+                              "thread": threading.current_thread().name})
+
+    def phaseSeconds(self, name):
+        """Total seconds spent in a phase"""
+        with self._lock:
+            return self._phases.get(name, [0, 0.0])[1]
+
+    def summary(self, out=None):
+        """Print the time per phase, the jobs and the counters
+        Args:
+            out: text file, stderr by default
+        """
+        from tabulate import tabulate
+        out = out or sys.stderr
+        with self._lock:
+            phases = [[name, count, round(seconds, 3)] for name, (count, seconds) in self._phases.items()]
+            jobs = list(self._jobs)
+            counters = dict(self._counters)
+        print(tabulate(phases, headers=["phase", "count", "seconds"]), file=out)
+        if jobs:
+            columns = ["job_id", "engine", "status", "queue_seconds", "run_seconds", "records"]
+            print(file=out)
+            print(tabulate([[job[c] for c in columns] for job in jobs], headers=columns), file=out)
+        print(file=out)
+        for name, value in sorted(counters.items()):
+            print("%s: %s" % (name, value), file=out)
+        print("total seconds: %.3f" % (time.time() - self._started), file=out)
+
+
+class NullProfiler:
+    """Profiler doing nothing, used when profiling is off
+    """
+
+    enabled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def close(self):
+        pass
+
+    def span(self, name, **attrs):
+        return _NULL_SPAN
+
+    def addPhase(self, name, seconds):
+        pass
+
+    def event(self, name, **attrs):
+        pass
+
+    def count(self, name, value):
+        pass
+
+    def job(self, job_id, engine, info):
+        pass
+
+    def trackRows(self, rows, name="download"):
+        return rows
+
+    def phaseSeconds(self, name):
+        return 0.0
+
+    def summary(self, out=None):
+        pass
+
+
+class _NullSpan:
+
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,216 @@
+"""
+Filters, aggregates and ordering run by the query engine
+"""
+
+import re
+import copy
+import math
+from armdata.td_types import INTEGER_TYPES, NUMERIC_TYPES
+
+AGGREGATES = ['count', 'sum', 'avg', 'min', 'max']
+
+_COMPARISON = re.compile(r"^\s*([^\s<>=!]+)\s*(<=|>=|!=|<>|=|<|>)\s*(.*?)\s*$")
+_LIKE = re.compile(r"^\s*(\S+)\s+(not\s+)?like\s+(.*?)\s*$", re.IGNORECASE)
+_NULL = re.compile(r"^\s*(\S+)\s+is\s+(not\s+)?null\s*$", re.IGNORECASE)
+
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+        return value[1:-1]
+    return value
+
+
+def _typed_value(column, td_type, value):
+    """Convert a value of the command line to the type of its column
+    """
+    value = _unquote(value)
+    td_type = td_type.lower()
+    try:
+        if td_type in INTEGER_TYPES:
+            return int(value)
+        if td_type in NUMERIC_TYPES:
+            number = float(value)
+            if not math.isfinite(number):
+                raise ValueError(value)
+            return number
+    except ValueError:
+        raise ValueError("Column %s holds %s values, got %r" % (column, td_type, value))
+    return value
+
+
+def parse_condition(text):
+    """Parse one --where condition
+    Args:
+        text: "column OP value" with OP one of = != <> < <= > >=,
+            "column [not] like pattern" or "column is [not] null"
+    Return:
+        tuple of column name, operator and value (None for null tests)
+    """
+    match = _NULL.match(text)
+    if match:
+        return (match.group(1), "IS NOT NULL" if match.group(2) else "IS NULL", None)
+    match = _LIKE.match(text)
+    if match:
+        return (match.group(1), "NOT LIKE" if match.group(2) else "LIKE", match.group(3))
+    match = _COMPARISON.match(text)
+    if match:
+        operator = "!=" if match.group(2) == "<>" else match.group(2)
+        return (match.group(1), operator, match.group(3))
+    raise ValueError("Invalid condition: %s" % text)
+
+
+def parse_aggregate(text):
+    """Parse one --agg aggregate
+    Args:
+        text: "count", or "FUNCTION:column" with FUNCTION one of AGGREGATES
+    Return:
+        tuple of function and column name (None for count of records)
+    """
+    function, _, column = text.partition(":")
+    function = function.strip().lower()
+    if function not in AGGREGATES:
+        raise ValueError("Unknown aggregate %s, expected one of %s" % (function, ", ".join(AGGREGATES)))
+    column = column.strip() or None
+    if column is None and function != "count":
+        raise ValueError("Aggregate %s needs a column, e.g. %s:size" % (function, function))
+    return (function, column)
+
+
+def parse_order(text):
+    """Parse one --order-by column
+    Args:
+        text: "column", "column:asc" or "column:desc"
+    Return:
+        tuple of column name and "ASC" or "DESC"
+    """
+    column, _, direction = text.partition(":")
+    direction = direction.strip().upper() or "ASC"
+    if direction not in ("ASC", "DESC"):
+        raise ValueError("Invalid order %s of column %s, expected asc or desc" % (direction, column))
+    return (column.strip(), direction)
+
+
+class Pushdown:
+    """Conditions, grouping, aggregates and ordering of a query, checked
+    against the table schema and compiled into its SQL statement by
+    query_builder, so that only the reduced result is downloaded.
+    """
+
+    def __init__(self, where=None, group_by=None, aggregates=None, order_by=None):
+        """
+        Args:
+            where: list of conditions ANDed together, see parse_condition
+            group_by: list of column names
+            aggregates: list of aggregates, see parse_aggregate
+            order_by: list of orderings, see parse_order
+        """
+        self.conditions = [parse_condition(text) for text in where or []]
+        self.group_by = [column.strip() for column in group_by or []]
+        self.aggregates = [parse_aggregate(text) for text in aggregates or []]
+        self.order_by = [parse_order(text) for text in order_by or []]
+
+    @property
+    def aggregating(self):
+        """True if the records are grouped or aggregated"""
+        return bool(self.group_by or self.aggregates)
+
+    @staticmethod
+    def aggregateName(function, column):
+        """Output column name of an aggregate"""
+        return function if column is None else "%s_%s" % (function, column)
+
+    def outputColumns(self, column_names):
+        """Column names of the result
+        Args:
+            column_names: list of the selected table columns
+        """
+        if not self.aggregating:
+            return column_names
+        return self.group_by + [self.aggregateName(function, column) for function, column in self.aggregates]
+
+    def outputTypes(self, schema, column_names):
+        """Treasure Data types of the result columns
+        Args:
+            schema: list of [column name, column type] of the table
+            column_names: list of the selected table columns
+        Return:
+            list of column types
+        """
+        types = dict(schema)
+        if not self.aggregating:
+            return [types.get(name, "string") for name in column_names]
+        output_types = [types.get(name, "string") for name in self.group_by]
+        for function, column in self.aggregates:
+            if function == "count":
+                output_types.append("long")
+            elif function == "avg":
+                output_types.append("double")
+            else:
+                output_types.append(types.get(column, "string"))
+        return output_types
+
+    def validate(self, schema, column_names):
+        """Check every referenced column against the table schema and
+        convert the condition values to the column types. The pushdown
+        itself is left as parsed, so that it can be validated again, e.g.
+        against every table of a fan-out query.
+        Args:
+            schema: list of [column name, column type] of the table
+            column_names: list of the selected table columns
+        Return:
+            copy of the pushdown with the converted condition values
+        Raises:
+            ValueError naming the first invalid column or value
+        """
+        types = dict(schema)
+        referenced = ([column for column, _, _ in self.conditions] + self.group_by +
+                      [column for _, column in self.aggregates if column is not None])
+        missing = [column for column in referenced if column not in types]
+        if missing:
+            raise ValueError("Column names not found in the table: %s" % str(missing))
+
+        conditions = []
+        for column, operator, value in self.conditions:
+            if isinstance(value, str) and "LIKE" not in operator:
+                value = _typed_value(column, types[column], value)
+            elif isinstance(value, str):
+                value = _unquote(value)
+            conditions.append((column, operator, value))
+
+        for function, column in self.aggregates:
+            if function in ("sum", "avg") and types[column].lower() not in NUMERIC_TYPES:
+                raise ValueError("Aggregate %s needs a numeric column, %s is %s" % (function, column, types[column]))
+
+        output_columns = self.outputColumns(column_names)
+        unordered = [column for column, _ in self.order_by if column not in output_columns]
+        if unordered:
+            raise ValueError("Order by columns not in the result: %s" % str(unordered))
+
+        validated = copy.copy(self)
+        validated.conditions = conditions
+        return validated
+
+    def selectColumns(self, column_names):
+        """Table columns selected as they are
+        Args:
+            column_names: list of the requested table columns
+        """
+        return self.group_by if self.aggregating else column_names
+
+    def scannedColumns(self, column_names):
+        """Table columns the engine reads: the selected columns and those
+        the conditions and aggregates refer to
+        Args:
+            column_names: list of the requested table columns
+        """
+        columns = list(self.selectColumns(column_names))
+        for column in ([column for column, _, _ in self.conditions] +
+                       [column for _, column in self.aggregates if column is not None]):
+            if column not in columns:
+                columns.append(column)
+        return columns
+
+    def aggregateColumns(self):
+        """List of (function, column or None, output name) of the aggregates
+        """
+        return [(function, column, self.aggregateName(function, column)) for function, column in self.aggregates]
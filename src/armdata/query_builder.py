@@ -0,0 +1,125 @@
+"""
+Build SELECT statements with quoted identifiers and literals
+"""
+
+import re
+import math
+import functools
+
+_LITERALS = {
+    # hive string literals escape with a backslash, presto doubles quotes
+    "hive": re.compile(r"'(?:[^'\\]|\\.)*'|`(?:[^`]|``)*`|\"(?:[^\"]|\"\")*\"|\s+", re.DOTALL),
+    "presto": re.compile(r"'(?:[^']|'')*'|`(?:[^`]|``)*`|\"(?:[^\"]|\"\")*\"|\s+", re.DOTALL),
+}
+
+
+def quote_identifier(name, engine):
+    """Quote a column or table name, with backquotes for hive and double
+    quotes for presto
+    """
+    if engine == "hive":
+        return "`" + name.replace("`", "``") + "`"
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value, engine):
+    """Render a value as a SQL literal
+    Args:
+        value: None, bool, int, float or str
+        engine: engine type, hive string literals escape with a backslash
+    Raises:
+        ValueError if value is nan or infinite, which no engine reads as a
+        number literal
+    """
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError("%r has no SQL literal" % value)
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if engine == "hive":
+        return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+    return "'" + value.replace("'", "''") + "'"
+
+
+def normalize(query, engine="presto"):
+    """Canonical form of a SQL statement: runs of white space outside
+    literals and quoted identifiers collapse into one space
+    Args:
+        query: SQL statement
+        engine: engine type, which decides how string literals escape quotes
+    """
+    pattern = _LITERALS.get(engine, _LITERALS["presto"])
+    return pattern.sub(lambda match: " " if match.group(0).isspace() else match.group(0), query).strip()
+
+
+def _template_text(text):
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+@functools.lru_cache(maxsize=256)
+def compile_select(engine, table, columns, aggregates, conditions, group_by, order_by, has_limit):
+    """Compile the shape of a SELECT statement into a str.format template
+    taking the rendered literals in order: min time, max time, the value of
+    every condition having one, then the limit. Statements of the same
+    shape, e.g. the sub-ranges of a split query, share one template.
+    Args:
+        engine: engine type
+        table: table name
+        columns: tuple of selected column names
+        aggregates: tuple of (function, column or None, output name)
+        conditions: tuple of (column, operator, True if it takes a value)
+        group_by: tuple of column names
+        order_by: tuple of (column, "ASC" or "DESC")
+        has_limit: True if the statement has a LIMIT
+    Return:
+        template string
+    """
+    def identifier(name):
+        return _template_text(quote_identifier(name, engine))
+
+    select = [identifier(column) for column in columns]
+    for function, column, name in aggregates:
+        argument = "*" if column is None else identifier(column)
+        select.append("%s(%s) AS %s" % (function.upper(), argument, identifier(name)))
+    sql = "SELECT " + ", ".join(select) + " FROM " + identifier(table)
+    sql += " WHERE TD_TIME_RANGE(" + identifier("time") + ", {}, {})"
+    for column, operator, has_value in conditions:
+        sql += " AND " + identifier(column) + " " + operator + (" {}" if has_value else "")
+    if group_by:
+        sql += " GROUP BY " + ", ".join(identifier(column) for column in group_by)
+    if order_by:
+        sql += " ORDER BY " + ", ".join(identifier(column) + " " + direction for column, direction in order_by)
+    if has_limit:
+        sql += " LIMIT {}"
+    return sql + ";"
+
+
+def select_statement(engine, table, columns, min_time=None, max_time=None, limit=None, aggregates=(),
+                     conditions=(), group_by=(), order_by=()):
+    """Render a canonical SELECT statement over a time range
+    Args:
+        engine: engine type
+        table: table name
+        columns: list of selected column names
+        min_time: min time stamp or None
+        max_time: max time stamp or None
+        limit: limit of records or None
+        aggregates: list of (function, column or None, output name)
+        conditions: list of (column, operator, value), value None for
+            operators without one such as IS NULL
+        group_by: list of column names
+        order_by: list of (column, "ASC" or "DESC")
+    Return:
+        SQL statement
+    """
+    template = compile_select(engine, table, tuple(columns), tuple(tuple(a) for a in aggregates),
+                              tuple((column, operator, value is not None) for column, operator, value in conditions),
+                              tuple(group_by), tuple(tuple(o) for o in order_by), bool(limit))
+    values = [min_time or None, max_time or None]
+    values += [value for _, _, value in conditions if value is not None]
+    if limit:
+        values.append(limit)
+    return template.format(*[quote_literal(value, engine) for value in values])
@@ -1,9 +1,20 @@
 import os
+import io
+import sys
+import itertools
 import click
-import re
-from tabulate import tabulate
-import tdclient
-from armdata import query_util
+from armdata.metadata_cache import MetadataCache
+from armdata.checkpoint import Checkpoint
+from armdata.profiling import Profiler, NULL_PROFILER
+from armdata.pushdown import Pushdown
+from armdata import fanout
+from armdata import writers
+
+# tdclient, tabulate and the modules running queries are imported where they
+# are used, so that --help and argument errors return without loading them
+
+# query_util.ArmQuery.DEFAULT_CONCURRENCY
+DEFAULT_CONCURRENCY = 4
 
 class ArmQueryCLI:
     """It takes the following parameters to perform a query and return the 
@@ -28,31 +39,95 @@ class ArmQueryCLI:
         SELECT <col_list>
             FROM <table_name>
             WHERE TD_TIME_RANGE(time, <min_time>, <max_time>) LIMIT <limit>
+            
+    optional: seconds 'metadata_ttl' the table schema
+        is cached on disk. 0 disables the cache.
+    optional: 'refresh_metadata' to ignore and overwrite cached metadata.
+    optional: 'result_cache' to serve repeated queries of past time windows
+        from results cached on disk.
+    optional: 'profiler' (profiling.Profiler) timing every phase of the run.
+    optional: 'pushdown' (pushdown.Pushdown) conditions, grouping, aggregates
+        and ordering compiled into the query.
+    optional: 'reuse_jobs_within' seconds a successful job with the same
+        statement is reused instead of submitting a new one.
+    optional: 'resumable' to download results in chunks that an interrupted
+        run can resume, 'download_threads' of them at the same time.
+    optional: 'progress' (polling.Progress) showing the job statuses and
+        'job_timeout' seconds after which a job is killed.
+        
+    The database and table names may also be glob patterns or comma
+    separated lists, see verifyTables and queryTables.
     """
     
     DEFAULT_ENDPOINT = "https://api.treasuredata.com/"
     
-    def __init__(self, db_name, table_name):
+    # tdclient client and metadata entries kept warm across the invocations
+    # served by a query daemon, see daemon.QueryDaemon
+    shared_client = None
+    shared_metadata = None
+    
+    def __init__(self, db_name, table_name, metadata_ttl=MetadataCache.DEFAULT_TTL,
+                 refresh_metadata=False, result_cache=False, profiler=None, pushdown=None, resumable=False,
+                 download_threads=1, reuse_jobs_within=None, progress=None, job_timeout=None):
         self.db = db_name
         self.table = table_name
-    
+        # (db, table) the names expand to, see verifyTables
+        self.tables = None
+        self._progress = progress
+        self.pushdown = pushdown
+        self._apikey, self._endpoint = self.credentials()
+        from armdata import query_util
+        from armdata.result_cache import ResultCache
+        from armdata.download import ResumableDownloads
+            
+        metadata_cache = MetadataCache(self._endpoint, ttl=metadata_ttl, refresh=refresh_metadata,
+                                       memory=self.shared_metadata)
+        downloads = None
+        if resumable:
+            downloads = ResumableDownloads(self._endpoint, threads=download_threads, on_start=print_resume_hint)
+        self.arm_query = query_util.ArmQuery(self._apikey, self._endpoint, metadata_cache=metadata_cache,
+                                             result_cache=ResultCache(self._endpoint) if result_cache else None,
+                                             profiler=profiler, downloads=downloads,
+                                             reuse_jobs_within=reuse_jobs_within, progress=progress,
+                                             job_timeout=job_timeout, client=self.shared_client)
+        
+    @classmethod
+    def credentials(cls):
+        """Read the API key from TD_API_KEY and the endpoint from TD_API_SERVER
+        Return:
+            (apikey, endpoint)
+        """
         if "TD_API_KEY" in os.environ:
-            self._apikey = os.getenv("TD_API_KEY")
+            apikey = os.getenv("TD_API_KEY")
         else:
             raise ValueError("no API key given")
             
         if os.getenv("TD_API_SERVER"):
-            self._endpoint = os.getenv("TD_API_SERVER")
+            endpoint = os.getenv("TD_API_SERVER")
         else:
-            self._endpoint = self.DEFAULT_ENDPOINT
-            
-        self.arm_query = query_util.ArmQuery(self._apikey, self._endpoint)
+            endpoint = cls.DEFAULT_ENDPOINT
+        return (apikey, endpoint)
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        
+    def close(self):
+        """Release the connections shared by the queries of this invocation
+        and erase the status line
+        """
+        self.arm_query.close()
+        if self._progress is not None:
+            self._progress.close()
         
     def verifyDbAndTable(self):
         """If verifies that the db name and table name exist
         Return: (True, "")  #table name found
         or (False, "table"|"database") # either database name or table name not found
         """
+        import tdclient
         try:
             status, cause = self.arm_query.checkDbAndTable(self.db, self.table)
             return (status, cause)
@@ -70,6 +145,7 @@ class ArmQueryCLI:
             (True, "")  #table name found
             or (False, "table"|"database") # either database name or table name not found
         """
+        import tdclient
         try:
             status, missing_columns = self.arm_query.checkTableColumns(self.db, self.table, col_list)
             return (status, missing_columns)
@@ -78,27 +154,195 @@ class ArmQueryCLI:
         except tdclient.errors.DatabaseError as e:
             raise click.ClickException(str(e))
     
-    def query(self, col_list, min_time, max_time, limit, engine):
+    def verifyTables(self):
+        """Expand the database and table names or patterns into the tables
+        they name, with a single listing of the catalog
+        Return: (True, "")  #tables found, kept in self.tables
+        or (False, "table"|"database") # a name or pattern matched nothing
+        """
+        import tdclient
+        try:
+            status, tables_or_cause = self.arm_query.resolveTables(self.db, self.table)
+        except tdclient.errors.APIError as e:
+            raise click.ClickException(str(e))
+        except tdclient.errors.DatabaseError as e:
+            raise click.ClickException(str(e))
+        if not status:
+            return (False, tables_or_cause)
+        self.tables = tables_or_cause
+        return (True, "")
+        
+    def verifyTablesColumns(self, col_list):
+        """Verify that every table found by verifyTables has the columns
+        Args:
+            col_list: list of column names
+        Return:
+            (True, {})  #every table has them
+            or (False, dict of "db.table" to the list of columns it lacks)
+        """
+        import tdclient
+        missing = {}
+        try:
+            for db, table in self.tables:
+                status, missing_columns = self.arm_query.checkTableColumns(db, table, col_list)
+                if not status:
+                    missing["%s.%s" % (db, table)] = missing_columns
+        except tdclient.errors.APIError as e:
+            raise click.ClickException(str(e))
+        except tdclient.errors.DatabaseError as e:
+            raise click.ClickException(str(e))
+        return (not missing, missing)
+        
+    def queryTables(self, col_list, min_time, max_time, limit, engine, concurrency=DEFAULT_CONCURRENCY):
+        """Query every table found by verifyTables, see ArmQuery.queryTables
+        Args:
+            see query
+        Return:
+            tuple of column names, source first, and iterator of records
+        """
+        import tdclient
+        try:
+            columns, rows = self.arm_query.queryTables(self.tables, col_list, min_time, max_time, limit, engine,
+                                                       concurrency=concurrency, pushdown=self.pushdown)
+            return (columns, self._guardRows(rows))
+        except tdclient.errors.APIError as e:
+            raise click.ClickException(str(e))
+        except tdclient.errors.DatabaseError as e:
+            raise click.ClickException(str(e))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+            
+    def query(self, col_list, min_time, max_time, limit, engine, split_by=None,
+              concurrency=DEFAULT_CONCURRENCY):
         """Query the table with the provided parameters
         Args:
             col_list: list of column names separated by comma
             min_time: min time stamp
             max_time: max time stamp
             limit: limit of records
-            engine: engine type
+            engine: engine type, or "auto" to choose it after the estimated scan
+            split_by: "hour" or "day" to run the time range as concurrent jobs
+            concurrency: number of concurrent jobs when split_by is given
         Return:
-            tuple of column names and List of records that match the query criteria
+            tuple of column names and iterator of records that match the query
+            criteria, fed while the result is being downloaded
         """
+        import tdclient
+        from armdata.polling import JobTimeout
         try:
-            columns, rows = self.arm_query.query(self.db, self.table, col_list, min_time, max_time, limit, engine)
-            return (columns, rows)
+            columns, rows = self.arm_query.query(self.db, self.table, col_list, min_time, max_time, limit, engine, stream=True,
+                                                 split_by=split_by, concurrency=concurrency, pushdown=self.pushdown)
+            return (columns, self._guardRows(rows))
         except tdclient.errors.APIError as e:
             raise click.ClickException(str(e))
         except tdclient.errors.DatabaseError as e:
             raise click.ClickException(str(e))
             
+        except (ValueError, JobTimeout) as e:
+            raise click.ClickException(str(e))
+            
+    def explain(self, col_list, min_time, max_time, limit, engine, split_by=None):
+        """Describe the query without running it, see ArmQuery.plan
+        Args:
+            see query
+        Return:
+            planner.QueryPlan of the query
+        """
+        import tdclient
+        try:
+            return self.arm_query.plan(self.db, self.table, col_list, min_time, max_time, limit, engine,
+                                       split_by=split_by, pushdown=self.pushdown)
+        except tdclient.errors.APIError as e:
+            raise click.ClickException(str(e))
+        except tdclient.errors.DatabaseError as e:
+            raise click.ClickException(str(e))
         except ValueError as e:
             raise click.ClickException(str(e))
+            
+    def preview(self, col_list, rows, engine, min_time=None, max_time=None):
+        """Read the first records of the most recent data, see ArmQuery.preview
+        Args:
+            col_list: list of column names separated by comma
+            rows: number of records wanted
+            engine: engine type, or "auto"
+            min_time: optional min time stamp
+            max_time: optional max time stamp
+        Return:
+            tuple of column names and iterator of lists of records, one per
+            time slice read
+        """
+        import tdclient
+        try:
+            columns, batches = self.arm_query.preview(self.db, self.table, col_list, rows, engine, min_time=min_time,
+                                                      max_time=max_time, pushdown=self.pushdown)
+            return (columns, self._guardRows(batches))
+        except tdclient.errors.APIError as e:
+            raise click.ClickException(str(e))
+        except tdclient.errors.DatabaseError as e:
+            raise click.ClickException(str(e))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+            
+    def resume(self, job_id):
+        """Download the result of an earlier job, see ArmQuery.resumeJob
+        Args:
+            job_id: job ID
+        Return:
+            tuple of column names and iterator of records
+        """
+        import tdclient
+        try:
+            columns, rows = self.arm_query.resumeJob(job_id)
+            return (columns, self._guardRows(rows))
+        except tdclient.errors.APIError as e:
+            raise click.ClickException(str(e))
+        except tdclient.errors.DatabaseError as e:
+            raise click.ClickException(str(e))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+            
+    def columnTypes(self, column_names):
+        """Look up the types of the queried columns
+        Args:
+            column_names: list of column names
+        Return:
+            list of column type names
+        """
+        import tdclient
+        try:
+            if self.tables is not None:
+                return self.arm_query.tablesColumnTypes(self.tables, column_names, pushdown=self.pushdown)
+            return self.arm_query.columnTypes(self.db, self.table, column_names, pushdown=self.pushdown)
+        except tdclient.errors.APIError as e:
+            raise click.ClickException(str(e))
+        except tdclient.errors.DatabaseError as e:
+            raise click.ClickException(str(e))
+            
+    def _guardRows(self, rows):
+        """Iterate the streamed records, reporting download failures the same
+        way as failures of the query itself
+        Args:
+            rows: iterator of records
+        """
+        import tdclient
+        import urllib3
+        from armdata.polling import JobTimeout
+        try:
+            for row in rows:
+                yield row
+        except tdclient.errors.APIError as e:
+            raise click.ClickException(str(e))
+        except tdclient.errors.DatabaseError as e:
+            raise click.ClickException(str(e))
+        except urllib3.exceptions.HTTPError as e:
+            #the connection dropped in the middle of the result
+            raise click.ClickException("Download failed: %s" % e)
+        except (IOError, ValueError, JobTimeout) as e:
+            raise click.ClickException(str(e))
+
+def print_resume_hint(job_id):
+    click.echo("Downloading the result of job %s, an interrupted download continues with "
+               "--resume %s" % (job_id, job_id), err=True)
 
 def validate_limit(ctx, param, value):
     if value and value <=0:
@@ -122,32 +366,164 @@ def validate_timestamp_range(min_time, max_time):
     if int(min_time) > int(max_time):
         raise click.BadParameter('Min time is greater than the max time')
 
-def print_tabular(column_names, data):
-    print(tabulate(data, headers=column_names))
+# Records shown by --preview without --limit
+PREVIEW_ROWS = 20
+
+# Rows held by print_tabular to lay out the columns before it gives up on
+# streaming and buffers the whole result
+TABULAR_SAMPLE_ROWS = 10000
+
+def print_tabular(column_names, data, out=None, header=True):
+    """Column widths depend on every row, so results that do not fit in
+    TABULAR_SAMPLE_ROWS are buffered in full with a warning. Writes to
+    stdout unless another text file is given. Without the header, as when
+    appending to earlier output, no records print nothing.
+    """
+    from tabulate import tabulate
+    data = iter(data)
+    rows = list(itertools.islice(data, TABULAR_SAMPLE_ROWS + 1))
+    if len(rows) > TABULAR_SAMPLE_ROWS:
+        click.echo("Warning: more than %d records, buffering the whole result "
+                   "for tabular output (use -f csv to stream it)" % TABULAR_SAMPLE_ROWS, err=True)
+        rows.extend(data)
+    if not header and not rows:
+        return
+    if header:
+        print(tabulate(rows, headers=column_names), file=out or sys.stdout)
+    else:
+        #the plain format leaves out the rules around the records as well
+        print(tabulate(rows, tablefmt="plain"), file=out or sys.stdout)
     
-def print_csv(column_names, data):
-    def convertToStr(column):
-        if not column:
-            return ""
-        else:
-            return str(column)
+def print_preview(column_names, batches, out=None):
+    """Print the lists of records of a preview as soon as each arrives, in
+    columns laid out after the header and the first list. Writes to stdout
+    unless another text file is given.
+    """
+    out = out or sys.stdout
+    widths = None
+    for batch in batches:
+        cells = [["" if value is None else str(value) for value in row] for row in batch]
+        if widths is None:
+            widths = [max([len(name)] + [len(row[index]) for row in cells])
+                      for index, name in enumerate(column_names)]
+            print("  ".join(name.ljust(width) for name, width in zip(column_names, widths)).rstrip(), file=out)
+            print("  ".join("-" * width for width in widths), file=out)
+        for row in cells:
+            print("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip(), file=out)
+        out.flush()
+    if widths is None:
+        print("  ".join(column_names), file=out)
+    
+def print_plan(plan, out=None):
+    """Print the estimate and plan of a query for --explain, to stdout
+    unless another text file is given
+    """
+    width = max(len(name) for name, _ in plan.describe())
+    for name, value in plan.describe():
+        print("%s  %s" % (name.ljust(width), value), file=out or sys.stdout)
+    
+def write_output(query_cli, format, columns, rows, output=None, compression=None, append=False,
+                 header=True, preview=False, part_rows=None, sqlite_table=None):
+    """Write the records in the requested format
+    Args:
+        query_cli: ArmQueryCLI the records come from
+        format: tabular, or one of sinks.SINK_FORMATS
+        columns: list of column names
+        rows: iterator of records
+        output: output file path, stdout if None; the database file of sqlite
+        compression: "gzip" or "zstd", guessed from the output file suffix if None
+        append: if True, append to the output file
+        header: if False, leave out the csv or tabular header
+        preview: if True, rows is an iterator of lists of records of
+            --preview, printed list by list in tabular format
+        part_rows: if given, the records are split into part files of this
+            many records, see sinks.RotatingFileSink
+        sqlite_table: table the sqlite format inserts the records into
+    """
+    from armdata import sinks
+    if preview and format != "tabular":
+        rows = itertools.chain.from_iterable(rows)
         
-    print(",".join(column_names))
-    for row in data:
-        formatted_row = [convertToStr(col) for col in row]
-        print(",".join(formatted_row))
+    try:
+        if format != "tabular":
+            sink = sinks.open_sink(format, output, compression=compression, append=append, header=header,
+                                   part_rows=part_rows, table=sqlite_table)
+            column_types = query_cli.columnTypes(columns) if sink.needs_types else None
+            sink.write(columns, column_types, rows)
+            return
+        with writers.open_output(output, compression=compression, append=append) as out:
+            text = io.TextIOWrapper(out, encoding="utf-8")
+            if preview:
+                print_preview(columns, rows, out=text)
+            else:
+                print_tabular(columns, rows, out=text, header=header)
+            text.flush()
+            text.detach()
+    except ValueError as e:
+        raise click.ClickException(str(e))
     
 """  
 query -f csv -e hive -c 'my_col1,my_col2,my_col5' -m 1427347140 -M 1427350725 -l 100
 my_db my_table
 where:
-  -f / --format is optional and specifies the output format: tabular by default
+  my_db and my_table may also be glob patterns or comma separated lists, e.g. my_db 'events_*' or
+'db_us,db_eu' events: every matching table is queried by its own concurrent job and the records
+come out table by table, after a "_source" column holding their db.table
+  -f / --format is optional and specifies the output format: tabular by default, or
+csv, parquet, arrow (IPC file), msgpack (columnar batches) and sqlite (a table of the SQLite
+database file given by --output)
+  -o / --output is optional and specifies the output file: stdout by default
+  --part-rows is optional and splits the csv or columnar output into part files of that many records,
+numbered before the extension: out-00000.csv, out-00001.csv...
+  --sqlite-table is optional and specifies the table sqlite output inserts into, created if needed:
+the queried table name by default
+  --compress is optional and compresses the output with gzip or zstd, guessed from a .gz/.zst
+output file name by default
   -c / --column is optional and specifies the comma separated list of columns to restrict the
 result to. Read all columns if not specified.
   -l / --limit is optional and specifies the limit of records returned. Read all records if not specified.
   -m / --min is optional and specifies the minimum timestamp: NULL by default
   -M / --max is optional and specifies the maximum timestamp: NULL by default
-  -e / --engine is optional and specifies the query engine: ‘presto’ by default
+  -e / --engine is optional and specifies the query engine: ‘presto’ by default, or 'auto' to run
+large scans on hive and small ones on presto after the table record count, size and the requested
+time range and columns
+  --preview is optional and shows the first records (--limit, 20 by default) of the most recent data
+as soon as they arrive, reading wider time slices only while too few records came back
+  --explain is optional and prints the estimated scan, the engine and the statement of the query
+without running it
+  --split-by is optional and runs the [min, max) range as one job per hour or day
+  --concurrency is optional and specifies the number of concurrent jobs with --split-by or several
+tables
+  --since-checkpoint is optional and only outputs records newer than the ones seen by the
+previous run with the same checkpoint file, without the csv header once the file exists; it
+cannot be combined with --limit, which would leave out older records for good
+  --result-cache is optional and serves repeated queries of past time windows from a local cache
+  --metadata-ttl is optional and specifies the seconds table schemas are cached
+  --refresh-metadata is optional and ignores the cached table schemas
+  --where is optional and filters the records on the server, e.g. 'code>=500', "path like '/api%'"
+or 'agent is not null', may be repeated
+  --group-by is optional and groups the records by a comma separated list of columns
+  --agg is optional and adds an aggregate column: count, or count|sum|avg|min|max:column, may be
+repeated
+  --order-by is optional and sorts the result by a column, column:desc for descending order, may be
+repeated
+  --reuse-jobs is optional and downloads the result of a successful job of the account that ran the
+same query on the same engine within the given seconds instead of submitting a new job
+  --resumable is optional and downloads the result in chunks kept on disk, so that an interrupted
+download can be continued with --resume
+  --resume is optional and downloads the result of an earlier job by its ID without running the
+query again, continuing an interrupted --resumable download
+  --download-threads is optional and specifies the number of chunks downloaded at the same time
+  --timeout is optional and kills a job that did not finish within the given seconds
+  --progress / --no-progress is optional and shows the job statuses, the time elapsed and the records
+read on stderr: shown by default when stderr is a terminal and the records do not go to it
+  --profile is optional and prints the time spent in every phase, the jobs and the bytes downloaded
+to stderr
+  --trace is optional and writes every phase span and job as JSON lines to a file
+  --daemon is optional and forwards the query to a query daemon started with "query-daemon serve" when
+one listens on $ARMDATA_DAEMON_SOCKET (daemon.sock in the cache directory by default) with the same API
+key and endpoint, keeping the client connections and metadata warm across invocations. Without a daemon
+the query runs in the invoking process. ARMDATA_DAEMON=1 sets it for every query
 """
 
 @click.command()
@@ -156,9 +532,20 @@ result to. Read all columns if not specified.
 @click.option(
     '--format', '-f',
     default='tabular',
-    type=click.Choice(['csv', 'tabular']),
+    type=click.Choice(['csv', 'tabular'] + writers.COLUMNAR_FORMATS + ['sqlite']),
     help='Output format',
 )
+@click.option(
+    '--output', '-o', type=click.Path(dir_okay=False),
+    help='Output file, stdout by default'
+)
+@click.option('--part-rows', type=click.IntRange(min=1), metavar='ROWS',
+              help='Split the output into part files of ROWS records each')
+@click.option('--sqlite-table', help='Table sqlite output inserts into, the queried table name by default')
+@click.option(
+    '--compress', type=click.Choice(writers.COMPRESSIONS),
+    help='Output compression, guessed from a .gz/.zst output file name by default'
+)
 @click.option(
     '--column', '-c',
     help='Table column list, separated by comma'
@@ -174,39 +561,233 @@ result to. Read all columns if not specified.
 @click.option(
     '--engine', '-e',
     default='presto',
-    type=click.Choice(['hive', 'presto']),
-    help='Database engine type',
+    type=click.Choice(['hive', 'presto', 'auto']),
+    help='Database engine type, auto chooses it after the estimated scan',
 )
-def main(db_name, table_name, format, column, limit, min, max, engine):
-     
+@click.option('--preview', is_flag=True,
+              help='Show the first records of the most recent data quickly, widening the time range as needed')
+@click.option('--explain', is_flag=True,
+              help='Print the estimated scan, engine and statement without running the query')
+@click.option('--split-by', type=click.Choice(['hour', 'day']),
+              help='Run the time range as concurrent jobs of one hour or day each')
+@click.option('--concurrency', type=click.IntRange(min=1),
+              default=DEFAULT_CONCURRENCY, show_default=True,
+              help='Number of concurrent jobs with --split-by or several tables')
+@click.option('--since-checkpoint', type=click.Path(dir_okay=False),
+              help='File recording the last time seen, only newer records are output')
+@click.option('--result-cache', is_flag=True,
+              help='Serve repeated queries of past time windows from a local cache')
+@click.option('--metadata-ttl', type=click.IntRange(min=0), default=MetadataCache.DEFAULT_TTL,
+              show_default=True, help='Seconds table metadata is cached, 0 disables the cache')
+@click.option('--refresh-metadata', is_flag=True,
+              help='Ignore and overwrite the cached table metadata')
+@click.option('--where', multiple=True,
+              help="Condition run by the engine, e.g. 'code>=500' or \"path like '/api%'\", may be repeated")
+@click.option('--group-by', help='Columns to group the records by, separated by comma')
+@click.option('--agg', multiple=True,
+              help='Aggregate column: count, or count|sum|avg|min|max:column, may be repeated')
+@click.option('--order-by', multiple=True,
+              help='Column to sort the result by, column:desc for descending order, may be repeated')
+@click.option('--reuse-jobs', type=click.IntRange(min=0), metavar='SECONDS',
+              help='Reuse the result of an identical successful job started within SECONDS')
+@click.option('--resumable', is_flag=True,
+              help='Download the result in chunks that an interrupted run can resume')
+@click.option('--resume', metavar='JOB_ID',
+              help='Download the result of an earlier job, continuing an interrupted download')
+@click.option('--download-threads', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Chunks downloaded at the same time with --resumable or --resume')
+@click.option('--timeout', type=click.IntRange(min=1), metavar='SECONDS',
+              help='Kill a job that did not finish within SECONDS')
+@click.option('--progress/--no-progress', default=None,
+              help='Show the job statuses and records read on stderr, by default when it is a terminal')
+@click.option('--profile', is_flag=True,
+              help='Print the time spent in every phase to stderr')
+@click.option('--trace', type=click.Path(dir_okay=False),
+              help='Write the phase spans and jobs as JSON lines to this file')
+@click.option('--daemon', 'use_daemon', is_flag=True, envvar='ARMDATA_DAEMON',
+              help='Run the query in a daemon started with query-daemon serve when one listens')
+def main(db_name, table_name, format, output, part_rows, sqlite_table, compress, column, limit, min, max, engine, preview, explain, split_by,
+         concurrency, since_checkpoint, result_cache, metadata_ttl, refresh_metadata, where, group_by, agg, order_by,
+         reuse_jobs, resumable, resume, download_threads, timeout, progress, profile, trace, use_daemon):
+
+    if use_daemon:
+        #a running daemon serves the query, otherwise it runs in this process
+        from armdata import daemon
+        code = daemon.forward(click.get_current_context().params)
+        if code is not None:
+            sys.exit(code)
+
     if min and max:
         validate_timestamp_range(min, max)
         
-    #Verify that the database name and table name exist
-    #Print proper error messages if not so
-    query_cli = ArmQueryCLI(db_name, table_name)
-    status, cause = query_cli.verifyDbAndTable()
-    if not status:
-        if cause == "database":
-            raise click.BadParameter('Database name not found')
-        elif cause == "table":
-            raise click.BadParameter('Table name not found')
+    pushdown = None
+    if where or group_by or agg or order_by:
+        try:
+            pushdown = Pushdown(where=where, group_by=group_by.split(',') if group_by else None,
+                                aggregates=agg, order_by=order_by)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+        if pushdown.aggregating:
+            if column:
+                raise click.BadParameter('--column cannot be combined with --group-by or --agg')
+            if split_by:
+                raise click.BadParameter('--split-by cannot be combined with --group-by or --agg')
+            if since_checkpoint:
+                raise click.BadParameter('--since-checkpoint cannot be combined with --group-by or --agg')
+        
+    if format in writers.COLUMNAR_FORMATS:
+        if not output and sys.stdout.isatty():
+            raise click.BadParameter('%s output is binary, write it to a file with --output' % format)
+        if since_checkpoint:
+            raise click.BadParameter('--since-checkpoint appends records, it needs csv, tabular or sqlite output')
+    if format == "sqlite":
+        if not output:
+            raise click.BadParameter('sqlite output needs the database file, give it with --output')
+        if compress or part_rows:
+            raise click.BadParameter('sqlite output cannot be combined with --compress or --part-rows')
+        if not sqlite_table and fanout.is_fanout(db_name, table_name):
+            raise click.BadParameter('sqlite output of several tables needs --sqlite-table')
+    elif sqlite_table:
+        raise click.BadParameter('--sqlite-table needs sqlite output')
+    if part_rows:
+        if not output or format == "tabular":
+            raise click.BadParameter('--part-rows splits csv or columnar output files, it needs --output')
+        if since_checkpoint:
+            raise click.BadParameter('--part-rows cannot be combined with --since-checkpoint')
+        
+    #Resume from the watermark of the previous run, the time column is
+    #needed to move it forward
+    checkpoint = None
+    if since_checkpoint:
+        if limit:
+            #LIMIT returns arbitrary records, the watermark would skip the
+            #older ones left out
+            raise click.BadParameter('--since-checkpoint reads every new record, it cannot be combined with --limit')
+        try:
+            checkpoint = Checkpoint(since_checkpoint)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+        min = checkpoint.nextMinTime(min)
+        if max and min >= max:
+            return
+        if column and 'time' not in column.split(','):
+            column += ',time'
+        
+    if split_by and not (min and max):
+        raise click.BadParameter('--split-by needs both the min and max timestamps')
+        
+    if resume and (column or limit or min or max or split_by or pushdown or checkpoint):
+        raise click.BadParameter('--resume downloads the result of an earlier job, it cannot be '
+                                 'combined with options of the query')
+    if preview and (split_by or resume or resumable or checkpoint or explain or (pushdown and pushdown.aggregating)):
+        raise click.BadParameter('--preview reads the most recent records, it cannot be combined with --split-by, '
+                                 '--resume, --resumable, --since-checkpoint, --explain, --group-by or --agg')
+    if fanout.is_fanout(db_name, table_name) and (split_by or resume or resumable or checkpoint or preview or
+                                                  explain):
+        raise click.BadParameter('Several tables cannot be combined with --split-by, --resume, --resumable, '
+                                 '--since-checkpoint, --preview or --explain')
+    if explain and resume:
+        raise click.BadParameter('--explain describes a query, it cannot be combined with --resume')
+    if resumable and split_by:
+        raise click.BadParameter('--resumable downloads the result of a single job, it cannot be '
+                                 'combined with --split-by')
+        
+    profiler = Profiler(trace) if profile or trace else NULL_PROFILER
+    try:
+        with profiler:
+            run_query(db_name, table_name, format, output, compress, column, limit, min, max, engine,
+                      split_by, concurrency, checkpoint, result_cache, metadata_ttl, refresh_metadata,
+                      profiler, pushdown, resume, bool(resumable or resume), download_threads, reuse_jobs,
+                      explain, preview, timeout, progress, part_rows, sqlite_table or table_name)
+    finally:
+        if profile:
+            profiler.summary()
             
-    #Verify that the provided column list exist in the table
-    if column:
-        column_list = column.split(',')
-        status, missing_columns = query_cli.verifyTableColumns(column_list)
+def run_query(db_name, table_name, format, output, compress, column, limit, min, max, engine, split_by,
+              concurrency, checkpoint, result_cache, metadata_ttl, refresh_metadata, profiler, pushdown=None,
+              resume=None, resumable=False, download_threads=1, reuse_jobs=None, explain=False,
+              preview=False, timeout=None, progress=None, part_rows=None, sqlite_table=None):
+    """Verify the table and columns, run the query and write its records,
+    see main for the arguments
+    """
+    if progress is None:
+        #the status line would break up records written to the same terminal
+        progress = sys.stderr.isatty() and (bool(output) or not sys.stdout.isatty())
+    status_line = None
+    if progress and not explain:
+        from armdata.polling import Progress
+        status_line = Progress()
+        
+    #One client and its connections are shared by every step
+    with ArmQueryCLI(db_name, table_name, metadata_ttl=metadata_ttl,
+                     refresh_metadata=refresh_metadata, result_cache=result_cache,
+                     profiler=profiler, pushdown=pushdown, resumable=resumable,
+                     download_threads=download_threads, reuse_jobs_within=reuse_jobs,
+                     progress=status_line, job_timeout=timeout) as query_cli:
+        #Verify that the database name and table name exist
+        #Print proper error messages if not so
+        fan_out = fanout.is_fanout(db_name, table_name)
+        if fan_out:
+            status, cause = query_cli.verifyTables()
+        else:
+            status, cause = query_cli.verifyDbAndTable()
         if not status:
-            raise click.BadParameter('Column names not found in the table: %s' %str(missing_columns))
+            if cause == "database":
+                raise click.BadParameter('Database name not found')
+            elif cause == "table":
+                raise click.BadParameter('Table name not found')
+            
+        #Verify that the provided column list exist in the table
+        if column and fan_out:
+            status, missing_columns = query_cli.verifyTablesColumns(column.split(','))
+            if not status:
+                raise click.BadParameter('Column names not found in the tables: %s' % "; ".join(
+                    "%s %s" % (source, str(columns)) for source, columns in sorted(missing_columns.items())))
+        elif column:
+            column_list = column.split(',')
+            status, missing_columns = query_cli.verifyTableColumns(column_list)
+            if not status:
+                raise click.BadParameter('Column names not found in the table: %s' %str(missing_columns))
     
-    columns, rows = query_cli.query(column, min, max, limit, engine)
-    #print("columns: {0}".format(columns))
+        if explain:
+            print_plan(query_cli.explain(column, min, max, limit, engine, split_by=split_by))
+            return
+            
+        if preview:
+            columns, rows = query_cli.preview(column, limit or PREVIEW_ROWS, engine, min_time=min, max_time=max)
+        elif resume:
+            columns, rows = query_cli.resume(resume)
+        elif fan_out:
+            columns, rows = query_cli.queryTables(column, min, max, limit, engine, concurrency=concurrency)
+        else:
+            columns, rows = query_cli.query(column, min, max, limit, engine, split_by=split_by,
+                                            concurrency=concurrency)
+        #print("columns: {0}".format(columns))
+        
+        if not (preview or split_by or fan_out):
+            #download on a thread of its own while the records are written,
+            #split and fan-out queries already download on shard threads
+            from armdata.sinks import prefetch
+            rows = prefetch(rows)
     
-    #print the retrieved data to screen
-    if format == "csv":
-        print_csv(columns, rows)
-    elif format == "tabular":
-        print_tabular(columns, rows)
+        if checkpoint is not None:
+            rows = checkpoint.track(rows, columns.index('time'))
+            
+        #print the retrieved data to screen or the output file
+        appending = bool(checkpoint and checkpoint.exists)
+        if status_line is not None and not preview:
+            rows = status_line.trackRows(rows)
+        if profiler.enabled and not preview:
+            #time spent waiting for records is left out of the formatting time
+            rows = profiler.trackRows(rows, "fetch")
+        with profiler.span("output", format=format):
+            write_output(query_cli, format, columns, rows, output=output, compression=compress,
+                         append=appending, header=not appending, preview=preview, part_rows=part_rows,
+                         sqlite_table=sqlite_table)
+        profiler.addPhase("format", profiler.phaseSeconds("output") - profiler.phaseSeconds("fetch"))
+            
+        if checkpoint is not None:
+            checkpoint.save()
         
 
 def start():
@@ -3,14 +3,245 @@ Query the database
 """
 
 import os
+import time
+import itertools
+import threading
+import msgpack
 import tdclient
+from armdata import partition
+from armdata import download
+from armdata import query_builder
+from armdata import planner
+from armdata import fanout
+from armdata import polling
+from armdata.columnar import ColumnarResult
+from armdata.profiling import NULL_PROFILER
 
 
 class ArmQuery:
     
-    def __init__(self, apikey, endpoint='https://api.treasuredata.com'):
+    DEFAULT_POOL_SIZE = 10
+    DEFAULT_MAX_RETRY_DELAY = 600
+    DEFAULT_CONCURRENCY = 4
+    
+    # recent successful jobs looked through for one to reuse, and seconds
+    # their listing is kept for the following queries
+    REUSE_SCAN_JOBS = 100
+    REUSE_LIST_TTL = 30
+    
+    # widths of the time slices a preview reads, newest first, before it
+    # reads everything older
+    PREVIEW_WINDOWS = [3600, 86400, 7 * 86400, 30 * 86400, 365 * 86400]
+    
+    def __init__(self, apikey, endpoint='https://api.treasuredata.com', metadata_cache=None,
+                 pool_size=DEFAULT_POOL_SIZE, max_retry_delay=DEFAULT_MAX_RETRY_DELAY,
+                 retry_post_requests=False, result_cache=None, profiler=None, downloads=None,
+                 reuse_jobs_within=None, progress=None, job_timeout=None, client=None):
+        """The instance owns one tdclient client whose keep-alive connections
+        are shared by all operations. Use it as a context manager, or call
+        close(), to release them.
+        Args:
+            apikey: Treasure Data API key
+            endpoint: Treasure Data API endpoint
+            metadata_cache: optional metadata_cache.MetadataCache used to
+                skip table schema lookups across runs
+            pool_size: number of connections kept alive to the endpoint
+            max_retry_delay: cumulative seconds failed requests are retried
+                for, with exponential backoff
+            retry_post_requests: if True, job submissions are retried too
+            result_cache: optional result_cache.ResultCache serving repeated
+                queries without running a job
+            profiler: optional profiling.Profiler timing every phase
+            downloads: optional download.ResumableDownloads fetching the
+                results of single job queries in resumable chunks
+            reuse_jobs_within: if given, the result of a successful job of
+                the account with the same statement, engine and database
+                started less than this many seconds ago is downloaded
+                instead of submitting a new job
+            progress: optional polling.Progress the job statuses are shown on
+            job_timeout: optional seconds a job may take before it is
+                killed and polling.JobTimeout raised
+            client: optional tdclient client shared with other instances,
+                used instead of creating one and left open by close()
+        """
         self._apikey = apikey
         self._endpoint = endpoint
+        self._metadata_cache = metadata_cache
+        self._pool_size = pool_size
+        self._max_retry_delay = max_retry_delay
+        self._retry_post_requests = retry_post_requests
+        self._result_cache = result_cache
+        self._profiler = profiler or NULL_PROFILER
+        self._downloads = downloads
+        self._reuse_jobs_within = reuse_jobs_within
+        self._poller = polling.JobPoller(self._jobStatus, timeout=job_timeout, progress=progress)
+        self._recent_jobs = None
+        self._recent_jobs_lock = threading.Lock()
+        self._client = client
+        self._owns_client = client is None
+        self._client_lock = threading.Lock()
+        # schemas resolved by this instance, keyed by (db, table)
+        self._schemas = {}
+        # statistics of the tables listed by this instance, see planner.table_stats
+        self._stats = {}
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        
+    def getClient(self):
+        """Return the shared tdclient client, creating it on first use
+        """
+        with self._client_lock:
+            if self._client is None:
+                self._client = tdclient.Client(apikey=self._apikey, endpoint=self._endpoint,
+                                               retry_post_requests=self._retry_post_requests,
+                                               max_cumul_retry_delay=self._max_retry_delay,
+                                               maxsize=self._pool_size)
+            return self._client
+            
+    def close(self):
+        """Release the shared client and its connections
+        """
+        with self._client_lock:
+            if self._client is not None and self._owns_client:
+                self._client.close()
+                self._client = None
+        
+    def _fetchTableSchema(self, db, table):
+        """Fetch the schema of the table with a single listing of the
+        database's tables, which also tells a missing database apart. The
+        statistics of the table are kept from the same listing.
+        Args:
+            db: database name
+            table: table name
+        Return:
+            list of [column name, column type], or None if the table does not exist
+        Raises:
+            tdclient.errors.NotFoundError if the database does not exist
+        """
+        with self._profiler.span("catalog", db=db):
+            tables = self.getClient().api.list_tables(db)
+        if table not in tables:
+            return None
+        return self._listedSchema(db, table, tables[table])
+        
+    def _listedSchema(self, db, table, info):
+        """Schema of a table entry of the database listing, keeping the
+        statistics of the table
+        """
+        stats = planner.table_stats(info)
+        self._stats[(db, table)] = stats
+        if self._metadata_cache is not None:
+            self._metadata_cache.set(stats, "stats", db, table)
+        schema = [[column[0], column[1]] for column in info.get("schema") or []]
+        #time is implicit in every table
+        if "time" not in [name for name, _ in schema]:
+            schema.append(["time", "long"])
+        return schema
+        
+    def resolveTable(self, db, table, fresh=False):
+        """Look up the specified table and its schema in one round trip
+        
+        Schemas are kept for the lifetime of the instance and in the
+        metadata cache if one is given. Missing tables are never cached.
+        Args:
+            db: database name
+            table: table name
+            fresh: if True, bypass the cached schemas
+        Return:
+            (True, list of [column name, column type]) # table found
+            (False, "database" | "table") # either db or table does not exist
+        """
+        with self._profiler.span("resolve_table", db=db, table=table) as span:
+            key = (db, table)
+            if not fresh:
+                schema = self._schemas.get(key)
+                span["source"] = "memory"
+                if schema is None and self._metadata_cache is not None:
+                    schema = self._metadata_cache.get("schema", db, table)
+                    span["source"] = "disk"
+                if schema is not None:
+                    self._schemas[key] = schema
+                    return (True, schema)
+                    
+            span["source"] = "api"
+            try:
+                schema = self._fetchTableSchema(db, table)
+            except tdclient.errors.NotFoundError:
+                return (False, "database")
+            if schema is None:
+                return (False, "table")
+            self._schemas[key] = schema
+            if self._metadata_cache is not None:
+                self._metadata_cache.set(schema, "schema", db, table)
+            return (True, schema)
+        
+    def resolveTables(self, db_names, table_names):
+        """Expand database and table names or glob patterns against the
+        catalog: the databases are listed once if a database pattern needs
+        it, and the tables of every matching database once
+        Args:
+            db_names: database name, glob pattern (e.g. "logs_*") or comma
+                separated list of them
+            table_names: table name, glob pattern or comma separated list
+        Return:
+            (True, list of (db, table)) # the tables found
+            (False, "database" | "table") # a name does not exist, or the
+                patterns matched no database or table
+        """
+        with self._profiler.span("resolve_tables", db=db_names, table=table_names):
+            db_patterns = fanout.split_names(db_names)
+            databases = None
+            if any(fanout.is_pattern(pattern) for pattern in db_patterns):
+                with self._profiler.span("catalog"):
+                    databases = list(self.getClient().api.list_databases())
+            dbs, missing = fanout.match_names(db_patterns, databases)
+            if missing or not dbs:
+                return (False, "database")
+                
+            resolved = []
+            for db in dbs:
+                try:
+                    with self._profiler.span("catalog", db=db):
+                        tables = self.getClient().api.list_tables(db)
+                except tdclient.errors.NotFoundError:
+                    return (False, "database")
+                names, missing = fanout.match_names(fanout.split_names(table_names), list(tables))
+                if missing:
+                    return (False, "table")
+                for table in names:
+                    schema = self._listedSchema(db, table, tables[table])
+                    self._schemas[(db, table)] = schema
+                    if self._metadata_cache is not None:
+                        self._metadata_cache.set(schema, "schema", db, table)
+                    resolved.append((db, table))
+            if not resolved:
+                return (False, "table")
+            return (True, resolved)
+            
+    def tableStats(self, db, table):
+        """Look up the record count, size and time range of the table,
+        listing the database's tables again if they are not cached
+        Args:
+            db: database name
+            table: table name
+        Return:
+            dict of statistics, see planner.table_stats, or None if the
+            table does not exist
+        """
+        key = (db, table)
+        stats = self._stats.get(key)
+        if stats is None and self._metadata_cache is not None:
+            stats = self._metadata_cache.get("stats", db, table)
+        if stats is None:
+            self.resolveTable(db, table, fresh=True)
+            stats = self._stats.get(key)
+        if stats is not None:
+            self._stats[key] = stats
+        return stats
         
     def checkDbAndTable(self, database, table):
         """Check that the specified db and table exist
@@ -19,32 +250,19 @@ class ArmQuery:
             table: table name
             
         Return:
-            (True, "table") # db and table exist
+            (True, "") # db and table exist
             (False, "database" | "table") # either db or table does not exist
         """
-        
-        msg = ""
-        db_found = False
-        table_found = False
-        with tdclient.Client(apikey=self._apikey, endpoint=self._endpoint) as client:
-            for db in client.databases():
-                if db.name == database:
-                    db_found = True
-                    for tbl in db.tables():
-                        if tbl.table_name == table:
-                            table_found = True
-                            msg = ""
-                            return (True, msg)
-        
-                        
-        #Either db or table is not found
-        if not db_found:
-            return (False, "database")
-        else:
-            return (False, "table")
+        status, schema_or_cause = self.resolveTable(database, table)
+        if not status:
+            return (False, schema_or_cause)
+        return (True, "")
     
     def checkTableColumns(self, db, table, col_list):
         """Check that the column list are indeed in the specified table
+        
+        A column missing from a cached schema is looked up again before
+        being reported.
         Args:
             db: database name
             table: table name
@@ -54,40 +272,70 @@ class ArmQuery:
             (True, []) # The specified list of column names is in the table
             (False, list of column names missing in the table) #mismatching column names
         """
-        query = "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE                TABLE_NAME='"+table+"';"
-          
-        with tdclient.Client(apikey=self._apikey, endpoint=self._endpoint) as client:
-            job = client.query(db, query, type="presto")
-            # sleep until job's finish
-            job.wait()
-            column_names = [column for row in job.result() for column in row]
-            missing_columns = []
-            for col in col_list:
-                if col not in column_names:
-                    missing_columns.append(col)
-            if missing_columns:
-                return (False, missing_columns)
-            else:
-                return (True, [])
+        column_names = self.tableColumnNames(db, table)
+        missing_columns = [col for col in col_list if col not in column_names]
+        if missing_columns:
+            column_names = self.tableColumnNames(db, table, fresh=True)
+            missing_columns = [col for col in col_list if col not in column_names]
+        if missing_columns:
+            return (False, missing_columns)
+        else:
+            return (True, [])
             
-    def _queryTableColumnNames(self, db, table):
+    def tableColumnNames(self, db, table, fresh=False):
         """Query column names in the specified table
         Args:
             db: database name
             table: table name
+            fresh: if True, bypass the cached schemas
         Return:
-            list of column names in the table
+            list of column names in the table, empty if the table does not exist
         """
-        query = "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE                TABLE_NAME='"+table+"';"
-          
-        with tdclient.Client(apikey=self._apikey, endpoint=self._endpoint) as client:
-            job = client.query(db, query, type="presto")
-            # sleep until job's finish
-            job.wait()
-            column_names = [column for row in job.result() for column in row]
-            return column_names
+        status, schema = self.resolveTable(db, table, fresh=fresh)
+        if not status:
+            return []
+        return [name for name, _ in schema]
             
-    def query(self, db, table, col_list, min_time, max_time, limit, engine):
+    def columnTypes(self, db, table, column_names, pushdown=None):
+        """Look up the types of columns in the table schema
+        Args:
+            db: database name
+            table: table name
+            column_names: list of column names
+            pushdown: optional pushdown.Pushdown of the query, whose
+                aggregated result columns are typed after their function
+        Return:
+            list of column type names, "string" for columns not in the schema
+        """
+        status, schema = self.resolveTable(db, table)
+        if pushdown is not None and pushdown.aggregating:
+            return pushdown.outputTypes(schema if status else [], column_names)
+        types = dict(schema) if status else {}
+        return [types.get(name, "string") for name in column_names]
+        
+    def buildQuery(self, table, col_list, min_time, max_time, limit, pushdown=None, engine="presto"):
+        """Build the SELECT statement of a query, see query_builder
+        Args:
+            table: table name
+            col_list: column names separated by comma
+            min_time: min time stamp or None
+            max_time: max time stamp or None
+            limit: limit of records or None
+            pushdown: optional validated pushdown.Pushdown
+            engine: engine type the identifiers and literals are quoted for
+        Return:
+            canonical SQL statement
+        """
+        columns = col_list.split(",")
+        if pushdown is None:
+            return query_builder.select_statement(engine, table, columns, min_time, max_time, limit)
+        return query_builder.select_statement(engine, table, pushdown.selectColumns(columns), min_time, max_time,
+                                              limit, aggregates=pushdown.aggregateColumns(),
+                                              conditions=pushdown.conditions, group_by=pushdown.group_by,
+                                              order_by=pushdown.order_by)
+        
+    def query(self, db, table, col_list, min_time, max_time, limit, engine, stream=False,
+              split_by=None, concurrency=DEFAULT_CONCURRENCY, pushdown=None, columnar=False):
         """Query the specified table
         Args:
             db: database name
@@ -96,33 +344,416 @@ class ArmQuery:
             min_time: min time stamp
             max_time: max time stamp
             limit: limit of records
-            engine: engine type
+            engine: engine type, or "auto" to choose it after the estimated
+                scan of the query, see plan
+            stream: if True, the records are returned as an iterator which
+                yields rows while the result is still being downloaded
+            split_by: "hour" or "day" to split [min_time, max_time) into
+                sub-ranges queried by concurrent jobs. Records come back
+                sub-range by sub-range in time order.
+            concurrency: number of concurrent jobs when split_by is given
+            pushdown: optional pushdown.Pushdown of conditions, grouping,
+                aggregates and ordering run by the engine. It is checked
+                against the table schema, raising ValueError if invalid.
+            columnar: if True, the records are read into a
+                columnar.ColumnarResult typed after the table schema, which
+                takes a fraction of the memory of lists of records
+        Return:
+            tuple of column names and List (iterator when stream is set,
+            ColumnarResult when columnar is set) of records that match the
+            query criteria
+            
+        With a result cache, results of windows whose max_time is in the
+        past are served from it, open windows only within its short ttl.
+        """
+        col_list, column_names, pushdown = self._prepare(db, table, col_list, min_time, max_time, split_by,
+                                                         pushdown)
+        if engine == "auto":
+            engine = self._chooseEngine(db, table, col_list, min_time, max_time, pushdown)[0]
+            
+        query = self.buildQuery(table, col_list, min_time, max_time, limit, pushdown=pushdown, engine=engine)
+        rows = None
+        cache_key = None
+        if self._result_cache is not None:
+            cache_ttl = self._result_cache.windowTtl(max_time)
+            if cache_ttl != 0:
+                cache_key = self._result_cache.key(db, query, engine)
+                cached = self._result_cache.get(cache_key)
+                self._profiler.event("result_cache", hit=cached is not None)
+                if cached is not None:
+                    rows = cached[1]
+                    
+        if rows is None:
+            if split_by:
+                shards = [self._shard(db, self.buildQuery(table, col_list, shard_min, shard_max, limit,
+                                                            pushdown=pushdown, engine=engine), engine)
+                          for shard_min, shard_max in partition.split_time_range(min_time, max_time, split_by)]
+                rows = partition.merge_shards(shards, concurrency, limit=limit)
+            else:
+                job = self.submit(db, query, engine)
+                # sleep until job's finish
+                with self._profiler.span("wait", job_id=job.job_id):
+                    self._poller.wait(job)
+                rows = self._jobResult(job, engine, resumable=True)
+            if cache_key is not None:
+                rows = self._result_cache.put(cache_key, column_names, rows, ttl=cache_ttl)
+            
+        if columnar:
+            column_types = self.columnTypes(db, table, column_names, pushdown=pushdown)
+            return (column_names, ColumnarResult(column_names, column_types, rows))
+        if stream:
+            return (column_names, rows)
+        return (column_names, list(rows))
+        
+    def queryTables(self, tables, col_list, min_time, max_time, limit, engine,
+                    concurrency=DEFAULT_CONCURRENCY, pushdown=None):
+        """Query several tables as concurrent jobs, one per table
+        Args:
+            tables: list of (db, table), see resolveTables
+            col_list: column names separated by comma, every column of
+                every table if empty
+            min_time: min time stamp
+            max_time: max time stamp
+            limit: limit of records, of every job and of the whole result
+            engine: engine type, or "auto" to choose it table by table
+            concurrency: number of concurrent jobs
+            pushdown: optional pushdown.Pushdown, validated against every table
         Return:
-            tuple of column names and List of records that match the query criteria
+            tuple of column names, fanout.SOURCE_COLUMN first, and iterator
+            of records table by table, each starting with its "db.table".
+            Tables lacking a column of the others have None in its place.
+        Raises:
+            ValueError if a table has a fanout.SOURCE_COLUMN column
         """
+        queries = []
+        for db, table in tables:
+            table_col_list, column_names, table_pushdown = self._prepare(db, table, col_list, min_time, max_time,
+                                                                         None, pushdown)
+            table_engine = engine
+            if engine == "auto":
+                table_engine = self._chooseEngine(db, table, table_col_list, min_time, max_time, table_pushdown)[0]
+            query = self.buildQuery(table, table_col_list, min_time, max_time, limit, pushdown=table_pushdown,
+                                     engine=table_engine)
+            queries.append((db, table, query, table_engine, column_names))
+            
+        union = fanout.union_columns([column_names for _, _, _, _, column_names in queries])
+        if fanout.SOURCE_COLUMN in union:
+            raise ValueError("Column %s of the tables clashes with the column naming the table of every record, "
+                             "leave it out with --column" % fanout.SOURCE_COLUMN)
+        
+        def shard(db, table, query, engine, column_names):
+            run = self._shard(db, query, engine)
+            return lambda stopped: fanout.tag_rows("%s.%s" % (db, table), column_names, union, run(stopped))
+            
+        shards = [shard(*arguments) for arguments in queries]
+        return ([fanout.SOURCE_COLUMN] + union, partition.merge_shards(shards, concurrency, limit=limit))
+        
+    def tablesColumnTypes(self, tables, column_names, pushdown=None):
+        """Look up the types of the result columns of queryTables
+        Args:
+            tables: list of (db, table)
+            column_names: list of the result column names, source first
+            pushdown: optional pushdown.Pushdown of the query
+        Return:
+            list of column type names, each from the first table having the
+            column, "string" if none has it
+        """
+        result_columns = column_names[1:]
+        aggregating = pushdown is not None and pushdown.aggregating
+        types = {}
+        for db, table in tables:
+            status, schema = self.resolveTable(db, table)
+            table_columns = [name for name, _ in schema] if status else []
+            table_types = self.columnTypes(db, table, result_columns, pushdown=pushdown)
+            for name, td_type in zip(result_columns, table_types):
+                if aggregating or name in table_columns:
+                    types.setdefault(name, td_type)
+        return ["string"] + [types.get(name, "string") for name in result_columns]
+        
+    def _prepare(self, db, table, col_list, min_time, max_time, split_by, pushdown):
+        """Check the arguments of a query and validate its pushdown
+        Return:
+            tuple of the column list, all columns when col_list is empty,
+            the list of result column names and the validated pushdown
+            (None without one)
+        """
+        if split_by and not (min_time and max_time):
+            raise ValueError("Splitting a query by %s needs both min and max timestamps" % split_by)
+            
         if not col_list:
-            column_names = self._queryTableColumnNames(db, table)
+            column_names = self.tableColumnNames(db, table)
         else:
             column_names = col_list.split(',')
             
         if not col_list:
             col_list = ",".join(column_names)
-        if not min_time:
-            min_time = "NULL"
-        if not max_time:
-            max_time = "NULL"
-        if  not limit:
-            limit_cause = ";"
+            
+        if pushdown is not None:
+            if split_by and pushdown.aggregating:
+                raise ValueError("Grouped or aggregated queries cannot be split by %s" % split_by)
+            status, schema = self.resolveTable(db, table)
+            if not status:
+                raise ValueError("%s name not found" % schema.capitalize())
+            pushdown = pushdown.validate(schema, column_names)
+            column_names = pushdown.outputColumns(column_names)
+        return (col_list, column_names, pushdown)
+        
+    def _chooseEngine(self, db, table, col_list, min_time, max_time, pushdown=None):
+        """Estimate the scan of a query from the table statistics
+        Return:
+            tuple of engine type, reason and planner.ScanEstimate (None,
+            with Presto, if the statistics are unknown)
+        """
+        stats = self.tableStats(db, table)
+        if stats is None:
+            return ("presto", "table statistics unknown", None)
+        columns = col_list.split(",")
+        if pushdown is not None:
+            columns = pushdown.scannedColumns(columns)
+        estimate = planner.ScanEstimate(stats, min_time, max_time, len(set(columns) | {"time"}))
+        engine, reason = estimate.engine()
+        return (engine, reason, estimate)
+        
+    def plan(self, db, table, col_list, min_time, max_time, limit, engine, split_by=None, pushdown=None):
+        """Describe what query would run, without running it
+        Args:
+            see query
+        Return:
+            planner.QueryPlan with the statement, the engine and the
+            estimated scan of the query
+        """
+        col_list, _, pushdown = self._prepare(db, table, col_list, min_time, max_time, split_by, pushdown)
+        chosen, reason, estimate = self._chooseEngine(db, table, col_list, min_time, max_time, pushdown)
+        if engine == "auto":
+            engine = chosen
+        elif estimate is not None and chosen != engine:
+            reason = "requested, the estimate favours %s: %s" % (chosen, reason)
         else:
-            limit_cause = " LIMIT "+str(limit)+";"
-        query = "SELECT "+col_list+" FROM "+table+" WHERE TD_TIME_RANGE(time, "+str(min_time)+", " +str(max_time)+")"+limit_cause
-          
-        with tdclient.Client(apikey=self._apikey, endpoint=self._endpoint) as client:
-            job = client.query(db, query, type=engine)
-            # sleep until job's finish
-            job.wait()
-            rows = [row for row in job.result()]
-            return (column_names, rows)
+            reason = "requested"
+        jobs = 1
+        if split_by:
+            ranges = partition.split_time_range(min_time, max_time, split_by)
+            jobs = len(ranges)
+            if ranges:
+                min_time, max_time = ranges[0]
+        statement = self.buildQuery(table, col_list, min_time, max_time, limit, pushdown=pushdown, engine=engine)
+        return planner.QueryPlan(db, table, statement, engine, reason, estimate=estimate, jobs=jobs)
+        
+    def preview(self, db, table, col_list, rows, engine, min_time=None, max_time=None, pushdown=None):
+        """Read the first records of the most recent data quickly
+        
+        Slices of the time range are queried newest first, each one wider
+        than the last, until enough records came back. Every slice asks
+        for the missing records only and no slice runs once enough were
+        read. Closing the iterator early, e.g. on an interrupt, kills the
+        job still running.
+        Args:
+            db: database name
+            table: table name
+            col_list: column names separated by comma, all if empty
+            rows: number of records wanted
+            engine: engine type, or "auto"
+            min_time: optional min time stamp, no slice reads older records
+            max_time: optional max time stamp, the end of the first slice.
+                The last log time of the table (or now) if not given.
+            pushdown: optional pushdown.Pushdown, it cannot aggregate
+        Return:
+            tuple of column names and iterator of lists of records, one
+            list per slice as soon as it is read
+        """
+        if pushdown is not None and pushdown.aggregating:
+            raise ValueError("Grouped or aggregated queries cannot be previewed")
+        col_list, column_names, pushdown = self._prepare(db, table, col_list, min_time, max_time, None, pushdown)
+        if max_time is None:
+            stats = self.tableStats(db, table)
+            if stats is None or not stats["last_time"]:
+                # no log time is known, the table may still have records
+                max_time = int(time.time()) + 1
+            else:
+                max_time = stats["last_time"] + 1
+        return (column_names, self._previewSlices(db, table, col_list, rows, engine, min_time, max_time,
+                                                  pushdown))
+        
+    def _previewSlices(self, db, table, col_list, rows, engine, min_time, max_time, pushdown):
+        remaining = rows
+        slice_max = max_time
+        windows = list(self.PREVIEW_WINDOWS) + [None]
+        for window in windows:
+            slice_min = max_time - window if window is not None else None
+            if min_time is not None and (slice_min is None or slice_min < min_time):
+                slice_min = min_time
+            slice_engine = engine
+            if engine == "auto":
+                slice_engine = self._chooseEngine(db, table, col_list, slice_min, slice_max, pushdown)[0]
+            query = self.buildQuery(table, col_list, slice_min, slice_max, remaining, pushdown=pushdown,
+                                     engine=slice_engine)
+            job = self.submit(db, query, slice_engine)
+            finished = False
+            try:
+                with self._profiler.span("wait", job_id=job.job_id):
+                    self._poller.wait(job)
+                finished = True
+                batch = list(itertools.islice(self._jobResult(job, slice_engine), remaining))
+            finally:
+                if not finished:
+                    try:
+                        job.kill()
+                    except tdclient.errors.APIError:
+                        pass
+            if batch:
+                yield batch
+            remaining -= len(batch)
+            # nothing older is left to read. The creation time of the table
+            # bounds nothing, bulk loads hold records older than it
+            if remaining <= 0 or slice_min is None or slice_min == min_time:
+                return
+            slice_max = slice_min
+            
+    def _recentJobs(self):
+        """Most recent successful jobs of the account, listed at most once
+        every REUSE_LIST_TTL seconds
+        """
+        with self._recent_jobs_lock:
+            if self._recent_jobs is None or time.time() - self._recent_jobs[0] > self.REUSE_LIST_TTL:
+                jobs = self.getClient().api.list_jobs(0, self.REUSE_SCAN_JOBS - 1, status="success")
+                self._recent_jobs = (time.time(), jobs)
+            return self._recent_jobs[1]
+            
+    def _reusableJob(self, db, query, engine):
+        """Find the latest successful job running the same statement
+        Args:
+            db: database name
+            query: SQL statement
+            engine: engine type
+        Return:
+            tdclient job started within the freshness window, or None
+        """
+        normalized = query_builder.normalize(query, engine)
+        oldest = time.time() - self._reuse_jobs_within
+        for info in self._recentJobs():
+            started = info.get("start_at") or info.get("created_at")
+            if (info.get("type") == engine and info.get("database") == db and info.get("query")
+                    and started is not None and started.timestamp() >= oldest
+                    and query_builder.normalize(info["query"], engine) == normalized):
+                return self.getClient().job(info["job_id"])
+        return None
+        
+    def submit(self, db, query, engine):
+        """Issue the job of a query, or reuse a recent identical one
+        Args:
+            db: database name
+            query: SQL statement, see buildQuery
+            engine: engine type
+        Return:
+            tdclient job
+        """
+        if self._reuse_jobs_within:
+            with self._profiler.span("reuse_lookup", engine=engine) as span:
+                job = self._reusableJob(db, query, engine)
+                span["job_id"] = job.job_id if job is not None else None
+            if job is not None:
+                return job
+        with self._profiler.span("submit", engine=engine) as span:
+            job = self.getClient().query(db, query, type=engine)
+            span["job_id"] = job.job_id
+        return job
+        
+    def _jobStatus(self, job):
+        """Status of a job, with the light status request rather than the
+        full job details
+        """
+        return self.getClient().job_status(job.job_id)
+        
+    async def waitAsync(self, job, run):
+        """Wait for a job on an event loop, with the backoff and timeout of
+        the other queries, see polling.JobPoller.waitAsync
+        Args:
+            job: tdclient job
+            run: coroutine function running a blocking call off the event
+                loop
+        """
+        await self._poller.waitAsync(job, run)
+        
+    def _jobResult(self, job, engine, resumable=False):
+        """Download the result of a finished job
+        
+        When profiling, the job details are recorded and the result is
+        read from the msgpack result endpoint directly to count the bytes
+        downloaded.
+        Args:
+            job: finished tdclient job
+            engine: engine type
+            resumable: if True and downloads were given, fetch the result
+                in resumable chunks
+        Return:
+            iterator of records
+        """
+        resumable = resumable and self._downloads is not None
+        if not (self._profiler.enabled or resumable):
+            return job.result()
+        api = self.getClient().api
+        if self._profiler.enabled:
+            self._profiler.job(job.job_id, engine, api.show_job(job.job_id))
+        if not job.success():
+            # let tdclient raise its usual error
+            return job.result()
+        if resumable:
+            return self._profiler.trackRows(self._downloads.rows(api, job.job_id))
+        return self._profiler.trackRows(self._countedResult(api, job.job_id))
+        
+    def resumeJob(self, job_id):
+        """Download the result of an earlier job without running it again,
+        continuing an interrupted resumable download
+        Args:
+            job_id: ID of a successful job
+        Return:
+            tuple of the column names of the job result and iterator of records
+        """
+        api = self.getClient().api
+        info = api.show_job(job_id)
+        if info.get("status") != "success":
+            raise ValueError("Job %s is %s, only the result of a successful job can be downloaded"
+                             % (job_id, info.get("status")))
+        column_names = [column[0] for column in info.get("hive_result_schema") or []]
+        downloads = self._downloads or download.ResumableDownloads(self._endpoint)
+        return (column_names, self._profiler.trackRows(downloads.rows(api, job_id)))
+        
+    def _countedResult(self, api, job_id):
+        with api.get("/v3/job/result/%s?format=msgpack" % job_id) as res:
+            if res.status != 200:
+                api.raise_error("Get job result failed", res, "")
+            unpacker = msgpack.Unpacker(raw=False, max_buffer_size=1000 * 1024 ** 2)
+            for chunk in res.stream(1024 ** 2):
+                self._profiler.count("bytes_downloaded", len(chunk))
+                unpacker.feed(chunk)
+                for row in unpacker:
+                    yield row
+        
+    def _shard(self, db, query, engine):
+        """Make the callable running one sub-range of a split query
+        Args:
+            db: database name
+            query: SQL statement of the sub-range
+            engine: engine type
+        Return:
+            callable taking the stop event of partition.merge_shards and
+            returning an iterator of records
+        """
+        def run(stopped):
+            job = self.submit(db, query, engine)
+            try:
+                with self._profiler.span("wait", job_id=job.job_id):
+                    if not self._poller.wait(job, stopped):
+                        return
+                for row in self._jobResult(job, engine):
+                    yield row
+            finally:
+                if stopped.is_set() and not job.finished():
+                    try:
+                        job.kill()
+                    except tdclient.errors.APIError:
+                        pass
+        return run
         
         
 if __name__ == "__main__":
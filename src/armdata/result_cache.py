@@ -0,0 +1,163 @@
+"""
+Cache query results on disk
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import msgpack
+from armdata import query_builder
+from armdata.metadata_cache import default_cache_dir
+
+
+def normalize_query(query, engine="presto"):
+    """Canonical form of a SQL statement used to key cached results, see
+    query_builder.normalize
+    """
+    return query_builder.normalize(query, engine)
+
+
+class ResultCache:
+    """Query results kept in one msgpack file per entry, named after the hash
+    of the endpoint, database, engine and normalized SQL.
+
+    An entry is a header map (column names, time stored, ttl) followed by
+    one msgpack array per record. Entries are written to a temporary file
+    while the records stream through and renamed into place once complete.
+    Reading an entry marks it as recently used; the least recently used
+    entries are evicted once the cache exceeds max_bytes.
+    """
+
+    DEFAULT_MAX_BYTES = 1024 ** 3
+    DEFAULT_OPEN_TTL = 300
+
+    def __init__(self, endpoint, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES,
+                 open_ttl=DEFAULT_OPEN_TTL):
+        """
+        Args:
+            endpoint: Treasure Data API endpoint the results come from
+            cache_dir: cache directory, metadata_cache.default_cache_dir()
+                if not given
+            max_bytes: total size the entries are evicted down to
+            open_ttl: seconds results of windows without a past max time
+                are cached, 0 to never cache them
+        """
+        self._endpoint = endpoint
+        self._dir = os.path.join(cache_dir or default_cache_dir(), "results")
+        self._max_bytes = max_bytes
+        self._open_ttl = open_ttl
+
+    def key(self, db, query, engine):
+        """Cache key of a query
+        Args:
+            db: database name
+            query: SQL statement
+            engine: engine type
+        Return:
+            hex digest
+        """
+        key = json.dumps([self._endpoint, db, engine, normalize_query(query, engine)])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def windowTtl(self, max_time):
+        """Seconds the result of a time window may be cached
+        Args:
+            max_time: max time stamp of the window or None
+        Return:
+            None if the window is closed and never expires, otherwise the
+            ttl for open windows, 0 meaning the result is not cached
+        """
+        if max_time and max_time <= time.time():
+            return None
+        return self._open_ttl
+
+    def _path(self, key):
+        return os.path.join(self._dir, key + ".msgpack")
+
+    def get(self, key):
+        """Look up a cached result
+        Args:
+            key: cache key
+        Return:
+            tuple of column names and iterator of records, or None if the
+            entry is missing or expired
+        """
+        path = self._path(key)
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return None
+        unpacker = msgpack.Unpacker(f, raw=False)
+        try:
+            header = unpacker.unpack()
+        except (ValueError, msgpack.OutOfData):
+            f.close()
+            return None
+        ttl = header.get("ttl")
+        if ttl is not None and time.time() - header["stored_at"] > ttl:
+            f.close()
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return (header["columns"], self._iterRecords(f, unpacker))
+
+    def _iterRecords(self, f, unpacker):
+        with f:
+            for row in unpacker:
+                yield row
+
+    def put(self, key, column_names, rows, ttl=None):
+        """Store a result while it streams through
+
+        The entry is only committed once the records are exhausted, an
+        iterator abandoned half way leaves the cache untouched.
+        Args:
+            key: cache key
+            column_names: list of column names
+            rows: iterator of records
+            ttl: seconds the entry is valid, None for no expiry
+        Return:
+            iterator yielding the same records
+        """
+        os.makedirs(self._dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir, suffix=".tmp")
+        committed = False
+        try:
+            with os.fdopen(fd, "wb") as f:
+                packer = msgpack.Packer(use_bin_type=True)
+                f.write(packer.pack({"columns": column_names, "stored_at": time.time(), "ttl": ttl}))
+                for row in rows:
+                    f.write(packer.pack(row))
+                    yield row
+            os.replace(tmp_path, self._path(key))
+            committed = True
+        finally:
+            if not committed:
+                os.unlink(tmp_path)
+        self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries beyond max_bytes
+        """
+        entries = []
+        for name in os.listdir(self._dir):
+            if not name.endswith(".msgpack"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self._dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self._dir, name))
+            except OSError:
+                pass
+            total -= size
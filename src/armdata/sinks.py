@@ -0,0 +1,221 @@
+"""
+Write the records of a query into a sink: a csv or columnar file or
+stdout, rotating part files, or a table of a local SQLite database
+"""
+
+import os
+import json
+import itertools
+from armdata import writers
+from armdata.td_types import INTEGER_TYPES, FLOAT_TYPES
+
+# Formats written by the sinks, tabular output is printed by query_cli
+SINK_FORMATS = ['csv'] + writers.COLUMNAR_FORMATS + ['sqlite']
+
+# Records inserted by one executemany of the SQLite sink, each batch in a
+# transaction of its own
+SQLITE_BATCH_ROWS = 10000
+
+_END = object()
+
+
+def prefetch(rows):
+    """Download the records on a thread of their own while the caller
+    writes them. The download runs at most partition.SHARD_QUEUE_BATCHES
+    batches of SHARD_BATCH_ROWS records ahead and waits once the queue is
+    full, so a slow sink holds back the download instead of filling memory,
+    and a slow download no longer stalls the writes in between.
+    Args:
+        rows: iterator of records
+    Return:
+        iterator of the same records
+    """
+    from armdata.partition import merge_shards
+    return merge_shards([lambda stopped: rows], 1)
+
+
+class Sink:
+    """Destination of the records of a query"""
+
+    # True if write needs the Treasure Data types of the columns
+    needs_types = False
+
+    def write(self, column_names, column_types, rows):
+        """Write the records
+        Args:
+            column_names: list of column names
+            column_types: list of Treasure Data column types, None unless
+                needs_types
+            rows: iterator of records
+        Return:
+            number of records written
+        """
+        raise NotImplementedError
+
+
+def _write_file(format, out, column_names, column_types, rows, header=True):
+    if format == "csv":
+        return writers.write_csv(out, column_names, rows, header=header)
+    return writers.write_columnar(format, out, column_names, column_types, rows)
+
+
+class FileSink(Sink):
+    """csv or columnar records written to a file or stdout, see
+    writers.open_output
+    """
+
+    def __init__(self, format, path=None, compression=None, append=False, header=True):
+        """
+        Args:
+            format: "csv" or one of writers.COLUMNAR_FORMATS
+            path: output file path, stdout if None
+            compression: "gzip" or "zstd", guessed from the path if None
+            append: if True, append to the output file
+            header: if False, leave out the csv header
+        """
+        self._format = format
+        self._path = path
+        self._compression = compression
+        self._append = append
+        self._header = header
+        self.needs_types = format in writers.COLUMNAR_FORMATS
+
+    def write(self, column_names, column_types, rows):
+        with writers.open_output(self._path, compression=self._compression, append=self._append) as out:
+            return _write_file(self._format, out, column_names, column_types, rows, header=self._header)
+
+
+def part_path(path, index):
+    """Path of a part file: the part number before the extension and
+    compression suffix, e.g. events-00002.csv.gz for events.csv.gz
+    """
+    root, ext = os.path.splitext(path)
+    if ext in writers._COMPRESSION_SUFFIXES:
+        root, inner = os.path.splitext(root)
+        ext = inner + ext
+    return "%s-%05d%s" % (root, index, ext)
+
+
+class RotatingFileSink(Sink):
+    """Records split into part files of part_rows records each, every part
+    a complete file of its format, see part_path. A result without records
+    still gets its first part.
+    """
+
+    def __init__(self, format, path, part_rows, compression=None):
+        """
+        Args:
+            format: "csv" or one of writers.COLUMNAR_FORMATS
+            path: output file path the part paths derive from
+            part_rows: records per part file
+            compression: "gzip" or "zstd", guessed from the path if None
+        """
+        self._format = format
+        self._path = path
+        self._part_rows = part_rows
+        self._compression = compression
+        self.needs_types = format in writers.COLUMNAR_FORMATS
+        # paths of the parts written
+        self.parts = []
+
+    def write(self, column_names, column_types, rows):
+        rows = iter(rows)
+        count = 0
+        while True:
+            first = next(rows, _END)
+            if first is _END and self.parts:
+                return count
+            part = itertools.islice(rows, self._part_rows - 1)
+            if first is not _END:
+                part = itertools.chain([first], part)
+            path = part_path(self._path, len(self.parts))
+            with writers.open_output(path, compression=self._compression) as out:
+                count += _write_file(self._format, out, column_names, column_types, part)
+            self.parts.append(path)
+            if first is _END:
+                return count
+
+
+def _sqlite_type(td_type):
+    td_type = (td_type or "").lower()
+    if td_type in INTEGER_TYPES:
+        return "INTEGER"
+    if td_type in FLOAT_TYPES:
+        return "REAL"
+    return "TEXT"
+
+
+def _sqlite_value(value):
+    if isinstance(value, (list, dict)):
+        # array<...> and map<...> values
+        return json.dumps(value)
+    return value
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+class SQLiteSink(Sink):
+    """Records inserted into a table of a local SQLite database, created
+    with the column types if it does not exist and appended to otherwise.
+    The records are inserted SQLITE_BATCH_ROWS at a time with executemany,
+    each batch in a transaction of its own.
+    """
+
+    needs_types = True
+
+    def __init__(self, path, table):
+        """
+        Args:
+            path: SQLite database file
+            table: table name
+        """
+        self._path = path
+        self._table = table
+
+    def write(self, column_names, column_types, rows):
+        import sqlite3
+        statement = "INSERT INTO %s (%s) VALUES (%s)" % (
+            _quote(self._table), ", ".join(_quote(name) for name in column_names),
+            ", ".join("?" * len(column_names)))
+        count = 0
+        try:
+            connection = sqlite3.connect(self._path)
+        except sqlite3.Error as e:
+            raise ValueError("Cannot open the SQLite database %s: %s" % (self._path, e))
+        try:
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (
+                    _quote(self._table), ", ".join("%s %s" % (_quote(name), _sqlite_type(td_type))
+                                                   for name, td_type in zip(column_names, column_types))))
+            for batch in writers.iter_batches(rows, SQLITE_BATCH_ROWS):
+                with connection:
+                    connection.executemany(statement, ([_sqlite_value(value) for value in row] for row in batch))
+                count += len(batch)
+        except sqlite3.Error as e:
+            raise ValueError("Cannot write to the SQLite table %s: %s" % (self._table, e))
+        finally:
+            connection.close()
+        return count
+
+
+def open_sink(format, path=None, compression=None, append=False, header=True, part_rows=None, table=None):
+    """Sink of an output format
+    Args:
+        format: one of SINK_FORMATS
+        path: output file path, stdout if None; the database file of sqlite
+        compression: "gzip" or "zstd", guessed from the path if None
+        append: if True, append to the output file
+        header: if False, leave out the csv header
+        part_rows: if given, the records are split into part files of
+            this many records, see RotatingFileSink
+        table: table name of sqlite
+    Return:
+        Sink
+    """
+    if format == "sqlite":
+        return SQLiteSink(path, table)
+    if part_rows:
+        return RotatingFileSink(format, path, part_rows, compression=compression)
+    return FileSink(format, path, compression=compression, append=append, header=header)
@@ -0,0 +1,22 @@
+"""
+Classes of the Treasure Data column types, shared by the pushdown
+conditions, the columnar results and the output formats
+"""
+
+INTEGER_TYPES = ['int', 'long', 'bigint']
+
+FLOAT_TYPES = ['float', 'double']
+
+NUMERIC_TYPES = INTEGER_TYPES + FLOAT_TYPES
+
+# Arrow types of the Treasure Data column types, other types (array<...>,
+# map<...>) are written as JSON strings
+ARROW_TYPES = {
+    "int": "int64",
+    "long": "int64",
+    "bigint": "int64",
+    "float": "float64",
+    "double": "float64",
+    "boolean": "bool_",
+    "string": "string",
+}
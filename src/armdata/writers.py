@@ -0,0 +1,180 @@
+"""
+Write query results as csv or in columnar formats
+"""
+
+import io
+import os
+import sys
+import csv
+import gzip
+import json
+import itertools
+import contextlib
+from armdata.td_types import ARROW_TYPES
+
+COLUMNAR_FORMATS = ['parquet', 'arrow', 'msgpack']
+
+COMPRESSIONS = ['gzip', 'zstd']
+
+_COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+
+# Rows in a record batch (and parquet row group)
+BATCH_ROWS = 65536
+
+# Rows encoded and written at once by write_csv, small enough for the first
+# rows to show up while the rest is downloading
+CSV_BATCH_ROWS = 10000
+
+# Buffer size of output files
+OUTPUT_BUFFER_BYTES = 1024 ** 2
+
+
+def iter_batches(rows, batch_rows=None):
+    """Group the records into lists of batch_rows (BATCH_ROWS by default) records
+    """
+    batch_rows = batch_rows or BATCH_ROWS
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_rows))
+        if not batch:
+            return
+        yield batch
+
+
+def _zstd_writer(f, closefd):
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd compression needs zstandard, install it with: pip install zstandard")
+    return zstandard.ZstdCompressor().stream_writer(f, closefd=closefd)
+
+
+@contextlib.contextmanager
+def open_output(path=None, compression=None, append=False):
+    """Open a buffered binary output, optionally compressed
+    Args:
+        path: output file path, stdout if None
+        compression: "gzip" or "zstd", guessed from the .gz/.zst suffix of
+            path if None
+        append: if True, append to the output file. Compressed files get
+            a new gzip member or zstd frame.
+    Return:
+        context manager of the binary file object
+    """
+    if compression is None and path:
+        compression = _COMPRESSION_SUFFIXES.get(os.path.splitext(path)[1])
+    if path:
+        f = open(path, "ab" if append else "wb", buffering=OUTPUT_BUFFER_BYTES)
+    else:
+        sys.stdout.flush()
+        f = sys.stdout.buffer
+    try:
+        if compression == "gzip":
+            with gzip.GzipFile(fileobj=f, mode="ab" if append else "wb", compresslevel=6) as out:
+                yield out
+        elif compression == "zstd":
+            with _zstd_writer(f, closefd=False) as out:
+                yield out
+        else:
+            yield f
+    finally:
+        if path:
+            f.close()
+        else:
+            f.flush()
+
+
+def write_csv(out, column_names, rows, header=True):
+    """Write the records as csv quoted per RFC 4180, encoding CSV_BATCH_ROWS
+    records at a time into a single write. None is written as an empty field.
+    Args:
+        out: binary file object
+        column_names: list of column names
+        rows: iterator of records
+        header: if False, leave out the header line
+    Return:
+        number of records written
+    """
+    count = 0
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    if header:
+        writer.writerow(column_names)
+    for batch in iter_batches(rows, CSV_BATCH_ROWS):
+        writer.writerows(batch)
+        out.write(buf.getvalue().encode("utf-8"))
+        buf.seek(0)
+        buf.truncate()
+        count += len(batch)
+    if buf.tell():
+        out.write(buf.getvalue().encode("utf-8"))
+    out.flush()
+    return count
+
+
+def _import_pyarrow(format):
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("%s output needs pyarrow, install it with: pip install pyarrow" % format)
+    return pyarrow
+
+
+def _complex_value(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def _record_batch(pa, schema, column_types, batch):
+    arrays = []
+    for index, (field, td_type) in enumerate(zip(schema, column_types)):
+        values = [row[index] for row in batch]
+        if td_type.lower() not in ARROW_TYPES:
+            values = [_complex_value(value) for value in values]
+        elif td_type.lower() == "string":
+            values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+        try:
+            arrays.append(pa.array(values, type=field.type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            raise ValueError("Column %s does not hold %s values: %s" % (field.name, td_type, e))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_columnar(format, out, column_names, column_types, rows):
+    """Write the records in a columnar format, BATCH_ROWS records at a time
+    Args:
+        format: "parquet", "arrow" (IPC file) or "msgpack"
+        out: binary file object
+        column_names: list of column names
+        column_types: list of Treasure Data column types
+        rows: iterator of records
+    Return:
+        number of records written
+    """
+    count = 0
+    if format == "msgpack":
+        import msgpack
+        # a header map, then one map of column name to values per batch
+        packer = msgpack.Packer(use_bin_type=True)
+        out.write(packer.pack({"columns": column_names, "types": column_types}))
+        for batch in iter_batches(rows):
+            out.write(packer.pack({name: [row[index] for row in batch]
+                                   for index, name in enumerate(column_names)}))
+            count += len(batch)
+        return count
+
+    pa = _import_pyarrow(format)
+    schema = pa.schema([(name, getattr(pa, ARROW_TYPES.get(td_type.lower(), "string"))())
+                        for name, td_type in zip(column_names, column_types)])
+    if format == "parquet":
+        writer = pa.parquet.ParquetWriter(out, schema)
+    else:
+        writer = pa.ipc.new_file(out, schema)
+    with writer:
+        for batch in iter_batches(rows):
+            writer.write_batch(_record_batch(pa, schema, column_types, batch))
+            count += len(batch)
+    return count
@@ -0,0 +1,446 @@
+"""
+Local stand-in for the Treasure Data API endpoints tdclient uses
+
+    python tests/bench/td_standin.py --port 8765 --table bench.events:2000000 --run-latency 2
+    TD_API_KEY=x TD_API_SERVER=http://127.0.0.1:8765 query bench events -f csv -m 1412380000
+
+Tables hold synthetic records computed from the record index, so tables of
+millions of records cost no memory. Records are one `interval` second
+apart starting at `start_time`, and jobs understand the statements built
+by ArmQuery: a column list, a TD_TIME_RANGE on time and an optional LIMIT.
+Jobs stay queued for `queue_latency` seconds and run for `run_latency`
+seconds before succeeding. The API key is not checked.
+"""
+
+import io
+import re
+import gzip
+import json
+import time
+import email
+import threading
+import itertools
+import urllib.parse
+import http.server
+import click
+import msgpack
+
+# Columns of the synthetic tables besides time
+DEFAULT_COLUMNS = [
+    ["host", "string"],
+    ["path", "string"],
+    ["method", "string"],
+    ["code", "long"],
+    ["size", "long"],
+    ["latency", "double"],
+    ["agent", "string"],
+]
+
+DEFAULT_START_TIME = 1412320000
+
+# Records packed into each chunk of a streamed result
+RESULT_CHUNK_ROWS = 5000
+
+_QUERY_PATTERN = re.compile(
+    r"^\s*SELECT\s+(?P<columns>.+?)\s+FROM\s+(?P<table>\S+)"
+    r'(?:\s+WHERE\s+TD_TIME_RANGE\(\s*["`]?time["`]?\s*,\s*(?P<min>\S+?)\s*,\s*(?P<max>\S+?)\s*\))?'
+    r"(?:\s+LIMIT\s+(?P<limit>\d+))?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL)
+
+
+def _timestamp(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(t))
+
+
+def _identifier(name):
+    return name.strip().strip('"`')
+
+
+class StandinTable:
+    """Synthetic table whose records are computed from their index
+    """
+
+    def __init__(self, name, rows, columns=None, start_time=DEFAULT_START_TIME, interval=1):
+        """
+        Args:
+            name: table name
+            rows: number of records
+            columns: list of [name, type] besides time, DEFAULT_COLUMNS if not given
+            start_time: time of the first record
+            interval: seconds between records
+        """
+        self.name = name
+        self.rows = rows
+        self.columns = columns or DEFAULT_COLUMNS
+        self.start_time = start_time
+        self.interval = interval
+
+    def schema(self):
+        return [[name, td_type, name] for name, td_type in self.columns]
+
+    def columnNames(self):
+        return [name for name, _ in self.columns] + ["time"]
+
+    def indexRange(self, min_time, max_time):
+        """Indexes of the records with min_time <= time < max_time
+        """
+        first, last = 0, self.rows
+        if min_time is not None:
+            first = max(first, -(-(min_time - self.start_time) // self.interval))
+        if max_time is not None:
+            last = min(last, -(-(max_time - self.start_time) // self.interval))
+        return first, max(first, last)
+
+    def _value(self, name, td_type, index):
+        if name == "time":
+            return self.start_time + index * self.interval
+        if td_type in ("int", "long", "bigint"):
+            return (index * 7919) % 100000
+        if td_type in ("float", "double"):
+            return (index % 1000) * 0.25
+        return "%s-%d" % (name, index % 1000)
+
+    def records(self, column_names, first, last):
+        """Iterate over the records of an index range
+        Args:
+            column_names: list of column names in record order
+            first: index of the first record
+            last: index after the last record
+        """
+        types = dict(self.columns)
+        columns = [(name, types.get(name, "long")) for name in column_names]
+        for index in range(first, last):
+            yield [self._value(name, td_type, index) for name, td_type in columns]
+
+
+class StandinJob:
+    """A query job and the index range of its result
+    """
+
+    def __init__(self, job_id, job_type, database, query, created_at):
+        self.job_id = job_id
+        self.type = job_type
+        self.database = database
+        self.query = query
+        self.created_at = created_at
+        self.killed_at = None
+        self.error = None
+        self.table = None
+        self.column_names = None
+        self.first = self.last = 0
+        self.gzip_result = None
+
+
+class TdStandin:
+    """State of the stand-in: databases, tables and jobs
+    """
+
+    def __init__(self, tables, queue_latency=0, run_latency=0, result_size=False):
+        """
+        Args:
+            tables: dict of database name to list of StandinTable
+            queue_latency: seconds jobs stay queued
+            run_latency: seconds jobs stay running
+            result_size: if True, job details carry the size of the
+                msgpack.gz result, which compresses the result once
+        """
+        self.databases = {db: {table.name: table for table in db_tables}
+                          for db, db_tables in tables.items()}
+        self.queue_latency = queue_latency
+        self.run_latency = run_latency
+        self.result_size = result_size
+        self._jobs = {}
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def issueJob(self, job_type, database, query):
+        with self._lock:
+            job = StandinJob(str(next(self._job_ids)), job_type, database, query, time.time())
+            self._jobs[job.job_id] = job
+        match = _QUERY_PATTERN.match(query)
+        table = self.databases.get(database, {}).get(_identifier(match.group("table"))) if match else None
+        if table is None:
+            job.error = "Unsupported statement or unknown table: %s" % query
+            return job
+        columns = [_identifier(column) for column in match.group("columns").split(",")]
+        if columns == ["*"]:
+            columns = table.columnNames()
+        unknown = [column for column in columns if column not in table.columnNames()]
+        if unknown:
+            job.error = "Column cannot be resolved: %s" % ", ".join(unknown)
+            return job
+
+        def bound(value):
+            return None if value is None or value.upper() == "NULL" else int(value)
+
+        job.table = table
+        job.column_names = columns
+        job.first, job.last = table.indexRange(bound(match.group("min")), bound(match.group("max")))
+        if match.group("limit"):
+            job.last = min(job.last, job.first + int(match.group("limit")))
+        return job
+
+    def job(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        """Jobs, most recent first"""
+        return sorted(self._jobs.values(), key=lambda job: int(job.job_id), reverse=True)
+
+    def status(self, job):
+        if job.killed_at is not None:
+            return "killed"
+        elapsed = time.time() - job.created_at
+        if elapsed < self.queue_latency:
+            return "queued"
+        if elapsed < self.queue_latency + self.run_latency:
+            return "running"
+        return "error" if job.error else "success"
+
+    def killJob(self, job):
+        status = self.status(job)
+        if status in ("queued", "running"):
+            job.killed_at = time.time()
+        return status
+
+    def resultChunks(self, job):
+        """msgpack encoded records of a job, RESULT_CHUNK_ROWS at a time"""
+        packer = msgpack.Packer(use_bin_type=True)
+        for first in range(job.first, job.last, RESULT_CHUNK_ROWS):
+            last = min(job.last, first + RESULT_CHUNK_ROWS)
+            yield b"".join(packer.pack(row) for row in job.table.records(job.column_names, first, last))
+
+    def gzipResult(self, job):
+        """The msgpack.gz result of a job, compressed once"""
+        if job.gzip_result is None:
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=1) as f:
+                for chunk in self.resultChunks(job):
+                    f.write(chunk)
+            job.gzip_result = buf.getvalue()
+        return job.gzip_result
+
+    def jobInfo(self, job):
+        status = self.status(job)
+        start_at = job.created_at + self.queue_latency
+        end_at = start_at + self.run_latency
+        info = {
+            "job_id": job.job_id,
+            "type": job.type,
+            "database": job.database,
+            "query": job.query,
+            "status": status,
+            "url": None,
+            "created_at": _timestamp(job.created_at),
+            "updated_at": _timestamp(time.time()),
+            "start_at": _timestamp(start_at) if status != "queued" else None,
+            "end_at": _timestamp(end_at) if status in ("success", "error") else None,
+            "num_records": job.last - job.first if status == "success" else None,
+            "result_size": None,
+            "hive_result_schema": None,
+            "debug": {"stderr": job.error} if job.error else None,
+        }
+        if status == "success":
+            types = dict(job.table.columns)
+            info["hive_result_schema"] = json.dumps([[name, types.get(name, "long")] for name in job.column_names])
+            if self.result_size:
+                info["result_size"] = len(self.gzipResult(job))
+        return info
+
+
+class StandinHandler(http.server.BaseHTTPRequestHandler):
+    """Routes the API requests to the TdStandin of the server
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _sendJson(self, body, status=200):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _notFound(self, message):
+        self._sendJson({"error": "Resource not found", "message": message}, status=404)
+
+    def _formFields(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            message = email.message_from_bytes(b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+            return {part.get_param("name", header="content-disposition"): part.get_payload(decode=True).decode("utf-8")
+                    for part in message.get_payload()}
+        return {key: values[0] for key, values in urllib.parse.parse_qs(body.decode("utf-8")).items()}
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = {key: values[0] for key, values in urllib.parse.parse_qs(url.query).items()}
+        parts = [urllib.parse.unquote(part) for part in url.path.strip("/").split("/")]
+        standin = self.server.standin
+        if parts == ["v3", "database", "list"]:
+            self._sendJson({"databases": [{"name": db, "count": sum(t.rows for t in tables.values()),
+                                           "permission": "administrator"}
+                                          for db, tables in sorted(standin.databases.items())]})
+        elif parts[:3] == ["v3", "table", "list"] and len(parts) == 4:
+            tables = standin.databases.get(parts[3])
+            if tables is None:
+                return self._notFound("Database '%s' does not exist" % parts[3])
+            self._sendJson({"database": parts[3], "tables": [
+                {"name": table.name, "type": "log", "count": table.rows,
+                 "estimated_storage_size": table.rows * 16 * (len(table.columns) + 1),
+                 "schema": json.dumps(table.schema())}
+                for table in tables.values()]})
+        elif parts[:3] == ["v3", "job", "list"]:
+            jobs = [standin.jobInfo(job) for job in standin.jobs()]
+            if params.get("status"):
+                jobs = [job for job in jobs if job["status"] == params["status"]]
+            first = int(params.get("from", 0))
+            last = int(params["to"]) + 1 if "to" in params else first + 20
+            self._sendJson({"jobs": jobs[first:last]})
+        elif parts[:2] == ["v3", "job"] and len(parts) == 4 and parts[2] in ("status", "show", "result"):
+            job = standin.job(parts[3])
+            if job is None:
+                return self._notFound("Job %s does not exist" % parts[3])
+            if parts[2] == "status":
+                self._sendJson({"job_id": job.job_id, "status": standin.status(job)})
+            elif parts[2] == "show":
+                self._sendJson(standin.jobInfo(job))
+            else:
+                self._sendResult(standin, job, params.get("format", "msgpack"))
+        else:
+            self._notFound("No route for %s" % url.path)
+
+    def _sendResult(self, standin, job, format):
+        if standin.status(job) != "success":
+            return self._sendJson({"error": "Job %s has no result" % job.job_id}, status=422)
+        if format == "msgpack.gz":
+            data = standin.gzipResult(job)
+            status = 200
+            match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range") or "")
+            if match:
+                start = int(match.group(1))
+                end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+                status = 206
+                self.send_response(status)
+                self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, len(data)))
+                data = data[start:end + 1]
+            else:
+                self.send_response(status)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if format != "msgpack":
+            return self._sendJson({"error": "Unsupported result format: %s" % format}, status=422)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-msgpack")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in standin.resultChunks(job):
+            if chunk:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        parts = [urllib.parse.unquote(part) for part in urllib.parse.urlparse(self.path).path.strip("/").split("/")]
+        fields = self._formFields()
+        standin = self.server.standin
+        if parts[:3] == ["v3", "job", "issue"] and len(parts) == 5:
+            if parts[4] not in standin.databases:
+                return self._notFound("Database '%s' does not exist" % parts[4])
+            job = standin.issueJob(parts[3], parts[4], fields.get("query", ""))
+            self._sendJson({"job": job.job_id, "job_id": job.job_id, "database": job.database})
+        elif parts[:3] == ["v3", "job", "kill"] and len(parts) == 4:
+            job = standin.job(parts[3])
+            if job is None:
+                return self._notFound("Job %s does not exist" % parts[3])
+            self._sendJson({"job_id": job.job_id, "former_status": standin.killJob(job)})
+        else:
+            self._notFound("No route for %s" % self.path)
+
+
+class StandinServer:
+    """HTTP server of a TdStandin, serving from a daemon thread
+    """
+
+    def __init__(self, standin, host="127.0.0.1", port=0):
+        """
+        Args:
+            standin: TdStandin to serve
+            host: address to listen on
+            port: port to listen on, any free port if 0
+        """
+        self._server = http.server.ThreadingHTTPServer((host, port), StandinHandler)
+        self._server.daemon_threads = True
+        self._server.standin = standin
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self._server.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serveForever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def parse_tables(specs):
+    """Tables of the command line, each given as db.table:rows
+    Return:
+        dict of database name to list of StandinTable
+    """
+    tables = {}
+    for spec in specs:
+        match = re.match(r"^([^.:]+)\.([^.:]+):(\d+)$", spec)
+        if not match:
+            raise click.BadParameter("expected db.table:rows, got %s" % spec)
+        tables.setdefault(match.group(1), []).append(StandinTable(match.group(2), int(match.group(3))))
+    return tables
+
+
+@click.command()
+@click.option('--host', default="127.0.0.1", help='Address to listen on')
+@click.option('--port', default=8765, help='Port to listen on')
+@click.option('--table', 'tables', multiple=True, default=["bench.events:1000000"],
+              help='Synthetic table as db.table:rows, may be repeated')
+@click.option('--queue-latency', default=0.0, help='Seconds jobs stay queued')
+@click.option('--run-latency', default=0.0, help='Seconds jobs stay running')
+@click.option('--result-size', is_flag=True, help='Report the msgpack.gz size of results in job details')
+def main(host, port, tables, queue_latency, run_latency, result_size):
+    """Serve synthetic tables through the Treasure Data API"""
+    standin = TdStandin(parse_tables(tables), queue_latency=queue_latency, run_latency=run_latency,
+                        result_size=result_size)
+    server = StandinServer(standin, host=host, port=port)
+    click.echo("Serving on %s" % server.endpoint, err=True)
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
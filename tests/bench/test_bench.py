@@ -0,0 +1,166 @@
+"""
+End to end benchmarks of the query command against the local stand-in
+
+    ARMDATA_BENCH=1 pytest -s tests/bench
+    python tests/bench/test_bench.py --rows 2000000 --run-latency 1
+
+Each output format runs `query` in its own process, reporting the time to
+the first output byte, rows/sec and the peak RSS of the process. The
+metadata checks are timed in process with a cold ArmQuery. The benchmarks
+are skipped unless ARMDATA_BENCH is set; ARMDATA_BENCH_ROWS sets the table
+size, ARMDATA_BENCH_MIN_ROWS_PER_SEC fails formats slower than that and
+ARMDATA_BENCH_REPORT writes the report as JSON.
+"""
+
+import os
+import sys
+import json
+import time
+import statistics
+import subprocess
+import tempfile
+import click
+import pytest
+from click.testing import CliRunner
+from tabulate import tabulate
+from td_standin import TdStandin, StandinTable, StandinServer
+from armdata import query_cli
+from armdata.query_util import ArmQuery
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src")
+
+BENCH_FORMATS = ["csv", "tabular", "parquet", "arrow", "msgpack"]
+
+# Formats written to a file rather than stdout
+FILE_FORMATS = ["parquet", "arrow", "msgpack"]
+
+METADATA_ROUNDS = 5
+
+
+def time_metadata(endpoint, db, table, columns):
+    """Median seconds of checkDbAndTable and checkTableColumns with a cold ArmQuery
+    """
+    check_table, check_columns = [], []
+    for _ in range(METADATA_ROUNDS):
+        with ArmQuery("bench", endpoint) as arm_query:
+            started = time.perf_counter()
+            arm_query.checkDbAndTable(db, table)
+            check_table.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            arm_query.checkTableColumns(db, table, columns)
+            check_columns.append(time.perf_counter() - started)
+    return statistics.median(check_table), statistics.median(check_columns)
+
+
+def run_format(endpoint, db, table, format, rows, workdir):
+    """Run the query command for one output format in a child process
+    Return:
+        dict of format, rows, seconds, first_byte (seconds), rows_per_sec
+        and peak_rss_mb
+    """
+    args = [sys.executable, "-c", "from armdata.query_cli import start; start()", db, table, "-f", format]
+    output = None
+    if format in FILE_FORMATS:
+        output = os.path.join(workdir, "bench." + format)
+        args += ["-o", output]
+    env = dict(os.environ, TD_API_KEY="bench", TD_API_SERVER=endpoint, ARMDATA_CACHE_DIR=workdir,
+               PYTHONPATH=os.pathsep.join([SRC_DIR, os.environ.get("PYTHONPATH", "")]))
+    started = time.perf_counter()
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env)
+    first_byte = None
+    while True:
+        chunk = proc.stdout.read1(1024 ** 2)
+        if not chunk:
+            break
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+    _, status, usage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - started
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    proc.stdout.close()
+    if proc.returncode != 0:
+        raise RuntimeError("query -f %s exited with %d" % (format, proc.returncode))
+    if output is not None:
+        first_byte = None
+    return {
+        "format": format,
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "first_byte": round(first_byte, 3) if first_byte is not None else None,
+        "rows_per_sec": int(rows / seconds),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+    }
+
+
+def run_benchmarks(rows, formats=None, queue_latency=0, run_latency=0):
+    """Serve a synthetic table of `rows` records and benchmark every format
+    Return:
+        report dict with the metadata check latencies and one result per format
+    """
+    standin = TdStandin({"bench": [StandinTable("events", rows)]},
+                        queue_latency=queue_latency, run_latency=run_latency)
+    with StandinServer(standin) as server, tempfile.TemporaryDirectory() as workdir:
+        check_table, check_columns = time_metadata(server.endpoint, "bench", "events", ["host", "code"])
+        results = [run_format(server.endpoint, "bench", "events", format, rows, workdir)
+                   for format in formats or BENCH_FORMATS]
+    return {"rows": rows, "check_db_and_table": round(check_table, 5),
+            "check_table_columns": round(check_columns, 5), "formats": results}
+
+
+def print_report(report, out=None):
+    out = out or sys.stdout
+    print("%d rows, checkDbAndTable %.5fs, checkTableColumns %.5fs" % (
+        report["rows"], report["check_db_and_table"], report["check_table_columns"]), file=out)
+    columns = ["format", "seconds", "first_byte", "rows_per_sec", "peak_rss_mb"]
+    print(tabulate([[result[c] for c in columns] for result in report["formats"]], headers=columns), file=out)
+
+
+def test_standin_end_to_end(tmp_path):
+    standin = TdStandin({"bench": [StandinTable("events", 1000)]})
+    with StandinServer(standin) as server:
+        runner = CliRunner()
+        result = runner.invoke(query_cli.main, ["bench", "events", "-f", "csv", "-c", "host,code",
+                                                "-m", "1412320010", "-M", "1412320013"],
+                               env={"TD_API_KEY": "bench", "TD_API_SERVER": server.endpoint,
+                                    "ARMDATA_CACHE_DIR": str(tmp_path)})
+        assert result.exit_code == 0
+        assert result.output == "host,code\nhost-10,79190\nhost-11,87109\nhost-12,95028\n"
+
+        result = runner.invoke(query_cli.main, ["bench", "missing"],
+                               env={"TD_API_KEY": "bench", "TD_API_SERVER": server.endpoint,
+                                    "ARMDATA_CACHE_DIR": str(tmp_path)})
+        assert result.exit_code == 2
+        assert "Table name not found" in result.output
+
+
+@pytest.mark.skipif(not os.environ.get("ARMDATA_BENCH"), reason="set ARMDATA_BENCH=1 to run the benchmarks")
+def test_benchmarks():
+    report = run_benchmarks(int(os.environ.get("ARMDATA_BENCH_ROWS", 200000)))
+    print_report(report)
+    if os.environ.get("ARMDATA_BENCH_REPORT"):
+        with open(os.environ["ARMDATA_BENCH_REPORT"], "w") as f:
+            json.dump(report, f, indent=2)
+    min_rows_per_sec = int(os.environ.get("ARMDATA_BENCH_MIN_ROWS_PER_SEC", 0))
+    for result in report["formats"]:
+        assert result["rows_per_sec"] >= min_rows_per_sec, result
+
+
+@click.command()
+@click.option('--rows', default=1000000, help='Records in the synthetic table')
+@click.option('--format', 'formats', multiple=True, type=click.Choice(BENCH_FORMATS),
+              help='Format to benchmark, may be repeated, all by default')
+@click.option('--queue-latency', default=0.0, help='Seconds jobs stay queued')
+@click.option('--run-latency', default=0.0, help='Seconds jobs stay running')
+@click.option('--json', 'json_path', type=click.Path(dir_okay=False), help='Also write the report as JSON')
+def main(rows, formats, queue_latency, run_latency, json_path):
+    """Benchmark the query command against a local stand-in server"""
+    report = run_benchmarks(rows, formats, queue_latency, run_latency)
+    print_report(report)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
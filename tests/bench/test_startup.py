@@ -0,0 +1,59 @@
+"""
+Startup budget of the query command
+
+    pytest tests/bench/test_startup.py
+
+`query --help` has to return within ARMDATA_STARTUP_BUDGET_MS (100 by
+default) on top of the startup of a bare interpreter, and importing the
+command must not load the Treasure Data client or the output libraries,
+which are only needed once a query runs.
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src")
+
+# Modules only the code paths running a query may import
+HEAVY_MODULES = ["tdclient", "urllib3", "tabulate", "msgpack", "pyarrow", "zstandard", "armdata.query_util",
+                 "armdata.download", "armdata.result_cache"]
+
+STARTUP_ROUNDS = 5
+
+
+def run_python(code):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SRC_DIR, os.environ.get("PYTHONPATH", "")]))
+    return subprocess.run([sys.executable, "-c", code], env=env, stdout=subprocess.PIPE, check=True)
+
+
+def startup_seconds(code):
+    """Fastest of STARTUP_ROUNDS runs of code in a fresh interpreter
+    """
+    timings = []
+    for _ in range(STARTUP_ROUNDS):
+        started = time.perf_counter()
+        run_python(code)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def test_import_is_light():
+    result = run_python("import sys, armdata.query_cli; print(' '.join(sorted(sys.modules)))")
+    loaded = result.stdout.decode().split()
+    assert [name for name in HEAVY_MODULES if name in loaded] == []
+
+
+def test_default_concurrency():
+    # imported here so that collecting the budget tests loads nothing
+    from armdata import query_cli
+    from armdata.query_util import ArmQuery
+    assert query_cli.DEFAULT_CONCURRENCY == ArmQuery.DEFAULT_CONCURRENCY
+
+
+def test_help_budget():
+    budget = float(os.environ.get("ARMDATA_STARTUP_BUDGET_MS", 100)) / 1000
+    bare = startup_seconds("pass")
+    help_seconds = startup_seconds("import sys; from armdata.query_cli import start; sys.argv = ['query', '--help']; start()")
+    assert help_seconds - bare < budget, "query --help took %.0f ms over interpreter startup" % ((help_seconds - bare) * 1000)
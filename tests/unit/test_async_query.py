@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+from mock import patch
+from armdata import polling
+from armdata.async_query import AsyncArmQuery
+
+APIKEY = "10574/8fe2c7251368da13d33683b37fa382c87f8eb"
+
+@patch.object(polling, 'FIRST_INTERVAL', 0.01)
+@patch('armdata.query_util.tdclient.Client')
+def test_async_query(mock_client):
+    client = mock_client.return_value
+    client.job_status.side_effect = ["queued", "running", "success"]
+    job = client.query.return_value
+    job.result.return_value = iter([['a', 1], ['b', 2]])
+    
+    async def run():
+        async with AsyncArmQuery(APIKEY) as td:
+            return await td.query('sample_datasets', 'www_access', 'host,code', None, None, 2, 'presto')
+    
+    assert asyncio.run(run()) == (['host', 'code'], [['a', 1], ['b', 2]])
+    assert client.job_status.call_count == 3
+    assert job.update.called
+    assert client.close.called
+    
+@patch.object(polling, 'FIRST_INTERVAL', 0.01)
+@patch('armdata.query_util.tdclient.Client')
+def test_async_query_concurrent(mock_client):
+    client = mock_client.return_value
+    client.job_status.return_value = "success"
+    client.query.return_value.result.side_effect = lambda: iter([['a']])
+    
+    async def run():
+        td = AsyncArmQuery(APIKEY)
+        return await asyncio.gather(*[td.query('sample_datasets', 'www_access', 'host', None, None, 1, 'presto')
+                                      for _ in range(50)])
+    
+    assert asyncio.run(run()) == [(['host'], [['a']])] * 50
+    
+@patch.object(polling, 'FIRST_INTERVAL', 0.01)
+@patch('armdata.query_util.tdclient.Client')
+def test_async_query_cancel_kills_job(mock_client):
+    client = mock_client.return_value
+    client.job_status.return_value = "running"
+    job = client.query.return_value
+    
+    async def run():
+        td = AsyncArmQuery(APIKEY)
+        task = asyncio.ensure_future(td.query('sample_datasets', 'www_access', 'host', None, None, 1, 'presto'))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    
+    asyncio.run(run())
+    assert job.kill.called
+    assert not job.result.called
+    
+@patch('armdata.query_util.tdclient.Client')
+def test_async_check_db_and_table(mock_client):
+    mock_client.return_value.api.list_tables.return_value = {'www_access': {'schema': []}}
+    
+    async def run():
+        td = AsyncArmQuery(APIKEY)
+        return (await td.checkDbAndTable('sample_datasets', 'www_access'),
+                await td.checkTableColumns('sample_datasets', 'www_access', ['time', 'host']))
+    
+    assert asyncio.run(run()) == ((True, ""), (False, ['host']))
@@ -0,0 +1,109 @@
+import json
+import time
+import threading
+import pytest
+import mock
+import urllib3
+from mock import patch
+from click.testing import CliRunner
+from armdata import batch
+from armdata.polling import JobTimeout
+from armdata.batch import BatchRunner, manifest_specs
+
+def test_manifest_specs():
+    specs = manifest_specs({
+        "defaults": {"db": "sample_datasets", "format": "csv"},
+        "queries": [{"table": "www_access", "columns": ["host", "path"], "output": "a.csv"},
+                    {"name": "b", "table": "www_access", "engine": "hive", "format": "parquet", "output": "b.parquet"}],
+    })
+    
+    assert specs[0]["columns"] == "host,path"
+    assert specs[0]["name"] == "a.csv"
+    assert specs[0]["engine"] == "presto"
+    assert specs[1]["name"] == "b"
+    assert specs[1]["db"] == "sample_datasets"
+    
+    with pytest.raises(ValueError) as e:
+        manifest_specs({"queries": [{"db": "sample_datasets", "table": "www_access"}]})
+    assert "Query 1 of the manifest has no output" in str(e.value)
+    with pytest.raises(ValueError):
+        manifest_specs({"queries": [{"db": "d", "table": "t", "output": "o", "format": "tabular"}]})
+    
+def _arm_query(delay=0.05):
+    arm_query = mock.MagicMock()
+    arm_query.resolveTable.side_effect = lambda db, table: (True, [["host", "string"]]) if table != "missing" else (False, "table")
+    arm_query.checkTableColumns.return_value = (True, [])
+    state = {"running": {}, "max": {}, "total": 0, "max_total": 0}
+    lock = threading.Lock()
+    def query(db, table, columns, min_time, max_time, limit, engine, stream):
+        with lock:
+            state["running"][engine] = state["running"].get(engine, 0) + 1
+            state["max"][engine] = max(state["max"].get(engine, 0), state["running"][engine])
+            state["total"] += 1
+            state["max_total"] = max(state["max_total"], state["total"])
+        time.sleep(delay)
+        with lock:
+            state["running"][engine] -= 1
+            state["total"] -= 1
+        if table == "broken":
+            raise ValueError("result is not ready")
+        if table == "slow":
+            raise JobTimeout("Job 1 did not finish within 60 seconds and was killed")
+        if table == "reset":
+            raise urllib3.exceptions.ProtocolError("Connection broken")
+        return (["host"], iter([["a"], ["b"]]))
+    arm_query.query.side_effect = query
+    return arm_query, state
+    
+def test_batch_runner_limits(tmp_path):
+    arm_query, state = _arm_query()
+    specs = manifest_specs({"queries": [
+        {"db": "d", "table": "t%d" % (i % 2), "engine": "hive" if i % 3 == 0 else "presto",
+         "output": str(tmp_path / ("%d.csv" % i))} for i in range(9)]})
+    
+    results = BatchRunner(arm_query, concurrency=3, engine_limits={"hive": 1}).run(specs)
+    
+    assert [r["status"] for r in results] == ["ok"] * 9
+    assert [r["records"] for r in results] == [2] * 9
+    assert state["max_total"] <= 3
+    assert state["max"]["hive"] == 1
+    #one schema lookup per table
+    assert arm_query.resolveTable.call_count == 2
+    assert (tmp_path / "4.csv").read_text() == "host\na\nb\n"
+    
+def test_batch_runner_failures(tmp_path):
+    arm_query, state = _arm_query(delay=0)
+    specs = manifest_specs({"queries": [
+        {"db": "d", "table": "missing", "output": str(tmp_path / "1.csv")},
+        {"db": "d", "table": "broken", "output": str(tmp_path / "2.csv")},
+        {"db": "d", "table": "t", "output": str(tmp_path / "3.csv")},
+        {"db": "d", "table": "slow", "output": str(tmp_path / "4.csv")},
+        {"db": "d", "table": "reset", "output": str(tmp_path / "5.csv")}]})
+    
+    results = BatchRunner(arm_query, concurrency=2).run(specs)
+    
+    assert results[0]["status"] == "failed" and results[0]["error"] == "Table name not found"
+    assert results[1]["status"] == "failed" and results[1]["error"] == "result is not ready"
+    assert results[2]["status"] == "ok"
+    assert results[3]["status"] == "failed" and "did not finish within 60 seconds" in results[3]["error"]
+    assert results[4]["status"] == "failed" and results[4]["error"] == "Connection broken"
+    assert arm_query.query.call_count == 4
+    
+@patch('armdata.query_util.ArmQuery')
+def test_batch_cli(mock_class, tmp_path):
+    """query-batch runs the manifest and reports every query
+    """
+    arm_query, state = _arm_query(delay=0)
+    mock_class.return_value.__enter__.return_value = arm_query
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps({"concurrency": 2, "queries": [
+        {"db": "d", "table": "t", "output": str(tmp_path / "1.csv")},
+        {"db": "d", "table": "missing", "output": str(tmp_path / "2.csv")}]}))
+    
+    runner = CliRunner()
+    result = runner.invoke(batch.main, [str(manifest)])
+    
+    assert result.exit_code == 1
+    assert "2 queries, 1 failed" in result.output
+    assert "Table name not found" in result.output
+    assert (tmp_path / "1.csv").read_text() == "host\na\nb\n"
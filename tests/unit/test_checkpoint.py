@@ -0,0 +1,97 @@
+import json
+from mock import patch
+from click.testing import CliRunner
+from armdata.checkpoint import Checkpoint
+from armdata.query_cli import main
+
+def test_checkpoint_watermark(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    checkpoint = Checkpoint(path)
+    assert not checkpoint.exists
+    assert checkpoint.nextMinTime(None) is None
+    assert checkpoint.nextMinTime(1412377100) == 1412377100
+    
+    rows = list(checkpoint.track(iter([['a', 1412377150], ['b', None], ['c', 1412377120]]), 1))
+    assert len(rows) == 3
+    checkpoint.save()
+    
+    checkpoint = Checkpoint(path)
+    assert checkpoint.exists
+    assert checkpoint.nextMinTime(None) == 1412377151
+    assert checkpoint.nextMinTime(1412377200) == 1412377200
+    
+def test_checkpoint_without_rows_keeps_watermark(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    path.write_text(json.dumps({"max_time": 1412377150}))
+    checkpoint = Checkpoint(str(path))
+    list(checkpoint.track(iter([]), 0))
+    checkpoint.save()
+    
+    assert json.loads(path.read_text()) == {"max_time": 1412377150}
+    
+@patch('armdata.query_util.ArmQuery')
+def test_cli_since_checkpoint(mock_class, tmp_path):
+    """Recurring runs only ask for records after the previous watermark
+       and append them without the csv header
+    """
+    path = str(tmp_path / "checkpoint.json")
+    instance = mock_class.return_value
+    instance.checkDbAndTable.return_value = (True, "")
+    instance.checkTableColumns.return_value = (True, [])
+    instance.query.return_value = (['host', 'time'], iter([['a', 1412377150], ['b', 1412377160]]))
+    
+    runner = CliRunner()
+    result = runner.invoke(main, ["sample_datasets", "www_access", "-f", "csv", "-c", "host",
+                                  "--since-checkpoint", path])
+    
+    assert result.exit_code == 0
+    assert result.output == "host,time\na,1412377150\nb,1412377160\n"
+    assert instance.query.call_args[0][2:4] == ('host,time', None)
+    
+    instance.query.return_value = (['host', 'time'], iter([['c', 1412377170]]))
+    result = runner.invoke(main, ["sample_datasets", "www_access", "-f", "csv", "-c", "host",
+                                  "--since-checkpoint", path])
+    
+    assert result.exit_code == 0
+    assert result.output == "c,1412377170\n"
+    assert instance.query.call_args[0][2:4] == ('host,time', 1412377161)
+    assert json.load(open(path)) == {"max_time": 1412377170}
+    
+@patch('armdata.query_util.ArmQuery')
+def test_cli_since_checkpoint_rejects_limit(mock_class, tmp_path):
+    """A limited query returns arbitrary records, moving the watermark past
+       the older ones it left out
+    """
+    path = str(tmp_path / "checkpoint.json")
+    runner = CliRunner()
+    for options in (["-l", "10"], ["-l", "10", "--split-by", "hour", "-m", "1412377100", "-M", "1412380700"]):
+        result = runner.invoke(main, ["sample_datasets", "www_access", "-f", "csv", "--since-checkpoint", path,
+                                      *options])
+        assert result.exit_code == 2
+        assert "--since-checkpoint reads every new record, it cannot be combined with --limit" in result.output
+    assert not mock_class.return_value.query.called
+    
+@patch('armdata.query_util.ArmQuery')
+def test_cli_since_checkpoint_tabular(mock_class, tmp_path):
+    """Appended tabular output has no header either
+    """
+    path = str(tmp_path / "checkpoint.json")
+    instance = mock_class.return_value
+    instance.checkDbAndTable.return_value = (True, "")
+    instance.checkTableColumns.return_value = (True, [])
+    instance.query.return_value = (['host', 'time'], iter([['a', 1412377150]]))
+    
+    runner = CliRunner()
+    result = runner.invoke(main, ["sample_datasets", "www_access", "-c", "host", "--since-checkpoint", path])
+    assert result.exit_code == 0
+    assert result.output.splitlines()[0].split() == ["host", "time"]
+    
+    instance.query.return_value = (['host', 'time'], iter([['c', 1412377170]]))
+    result = runner.invoke(main, ["sample_datasets", "www_access", "-c", "host", "--since-checkpoint", path])
+    assert result.exit_code == 0
+    assert result.output.split() == ["c", "1412377170"]
+    
+    instance.query.return_value = (['host', 'time'], iter([]))
+    result = runner.invoke(main, ["sample_datasets", "www_access", "-c", "host", "--since-checkpoint", path])
+    assert result.exit_code == 0
+    assert result.output == ""
@@ -1,12 +1,7 @@
-import pytest
-import click
 from click.testing import CliRunner
 import tdclient
 from mock import patch
-from armdata import query_util
-from armdata import query_cli
-from armdata.query_util import ArmQuery
-from armdata.query_cli import start, main
+from armdata.query_cli import main
 
 @patch('armdata.query_util.ArmQuery')
 def test_cli_with_row_records(mock_class):
@@ -322,3 +317,47 @@ def test_cli_with_non_supported_engine_type(mock_class):
     
     assert result.exit_code == 2
     assert "choose from hive, presto" in result.output
+    
+@patch('armdata.query_util.ArmQuery')
+def test_cli_with_streamed_csv_records(mock_class):
+    """Query streams the records to csv output as they are produced
+    
+       query_util.ArmQuery instance is mocked to return a generator of
+       records. Both the exit code and the csv lines are verified.
+    """
+    instance = mock_class.return_value
+    instance.checkDbAndTable.return_value = (True, "")
+    instance.checkTableColumns.return_value = (True, [])
+    columns = ['host','code','time']
+    instance.query.return_value = (columns, (['10.0.0.%d' % i, 200, 1412377100 + i] for i in range(2500)))
+    
+    runner = CliRunner()
+    result = runner.invoke(main, ["sample_datasets", "www_access", "-f", "csv", "-c", "host,code,time"])
+    
+    assert result.exit_code == 0
+    assert instance.query.call_args[1]['stream'] is True
+    lines = result.output.split('\n')
+    assert lines[0] == "host,code,time"
+    assert lines[1] == "10.0.0.0,200,1412377100"
+    assert lines[2500] == "10.0.0.2499,200,1412379599"
+    assert len(lines) == 2502
+    
+@patch('armdata.query_cli.TABULAR_SAMPLE_ROWS', 3)
+@patch('armdata.query_util.ArmQuery')
+def test_cli_with_tabular_records_over_sample(mock_class):
+    """Tabular output warns when the result exceeds the layout sample
+       but still prints every record
+    """
+    instance = mock_class.return_value
+    instance.checkDbAndTable.return_value = (True, "")
+    instance.checkTableColumns.return_value = (True, [])
+    columns = ['host','code']
+    instance.query.return_value = (columns, iter([['10.0.0.%d' % i, 200] for i in range(5)]))
+    
+    runner = CliRunner()
+    result = runner.invoke(main, ["sample_datasets", "www_access", "-c", "host,code"])
+    
+    assert result.exit_code == 0
+    assert "buffering the whole result" in result.output
+    for i in range(5):
+        assert '10.0.0.%d' % i in result.output
@@ -0,0 +1,75 @@
+import pytest
+from mock import patch
+from armdata import columnar
+from armdata.columnar import ColumnarResult, DictionaryColumn, ObjectColumn, TypedColumn
+from armdata.query_util import ArmQuery
+
+COLUMNS = ['host', 'code', 'size', 'tags', 'time']
+
+TYPES = ['string', 'long', 'double', 'array<string>', 'long']
+
+ROWS = [['host-%d' % (i % 3), 200 if i % 5 else None, i * 0.5, ['a'], 1412377100 + i] for i in range(50)]
+
+
+def test_typed_columns():
+    result = ColumnarResult(COLUMNS, TYPES, iter(ROWS))
+
+    assert len(result) == 50
+    assert list(result) == [tuple(row) for row in ROWS]
+    assert result[5] == ('host-2', None, 2.5, ['a'], 1412377105)
+    host, code, size, tags, time = result.columns
+    assert isinstance(host, DictionaryColumn) and host.dictionary == ['host-0', 'host-1', 'host-2']
+    assert isinstance(code, TypedColumn) and code.values.typecode == 'q' and code.valid[:6] == b'\x00\x01\x01\x01\x01\x00'
+    assert isinstance(size, TypedColumn) and size.values.typecode == 'd' and size.valid is None
+    assert isinstance(tags, ObjectColumn)
+    assert list(result.column('time'))[:2] == [1412377100, 1412377101]
+
+
+def test_values_not_fitting_the_type():
+    with patch.object(columnar, 'BATCH_ROWS', 2):
+        result = ColumnarResult(['code', 'host'], ['long', 'string'],
+                                [[1, 'a'], [2, 'b'], [None, ['x']], ['4xx', 'a']])
+
+    assert isinstance(result.column('code'), ObjectColumn)
+    assert isinstance(result.column('host'), ObjectColumn)
+    assert list(result) == [(1, 'a'), (2, 'b'), (None, ['x']), ('4xx', 'a')]
+
+
+def test_unique_strings_left_unencoded():
+    with patch.object(columnar, 'DICTIONARY_MIN_VALUES', 10):
+        result = ColumnarResult(['id'], ['string'], [['id-%d' % i] for i in range(100)])
+    assert isinstance(result.column('id'), ObjectColumn)
+    assert list(result)[-1] == ('id-99',)
+
+
+def test_take_and_memory():
+    result = ColumnarResult(COLUMNS, TYPES, ROWS)
+    taken = result.take([1, 5])
+    assert list(taken) == [tuple(ROWS[1]), tuple(ROWS[5])]
+
+    rows = [[i, i * 0.5, 'host-%d' % (i % 10)] for i in range(100000)]
+    compact = ColumnarResult(['code', 'size', 'host'], ['long', 'double', 'string'], rows)
+    assert compact.memoryBytes() < ObjectColumn(rows).memoryBytes() / 4
+
+
+def test_numpy_arrays():
+    numpy = pytest.importorskip("numpy")
+    result = ColumnarResult(COLUMNS, TYPES, ROWS)
+
+    code = result.column('code').array()
+    assert code.dtype == numpy.int64 and code.mask[0] and code.sum() == 200 * 40
+    assert result.column('size').array()[3] == 1.5
+    assert list(result.column('host').array()[:4]) == ['host-0', 'host-1', 'host-2', 'host-0']
+
+
+@patch('armdata.query_util.tdclient.Client')
+def test_query_columnar(mock_client):
+    client = mock_client.return_value
+    client.api.list_tables.return_value = {'www_access': {'schema': [['host', 'string', 'host'], ['code', 'long', 'code']]}}
+    client.query.return_value.result.return_value = iter([['a', 200], ['b', None]])
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com')
+
+    columns, result = td.query('sample_datasets', 'www_access', 'host,code', None, None, None, 'presto', columnar=True)
+    assert columns == ['host', 'code']
+    assert isinstance(result, ColumnarResult) and result.column_types == ['string', 'long']
+    assert list(result) == [('a', 200), ('b', None)]
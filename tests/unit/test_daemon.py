@@ -0,0 +1,118 @@
+import io
+import socket
+import threading
+import contextlib
+import pytest
+from click.testing import CliRunner
+from mock import patch
+from armdata import daemon
+from armdata import query_cli
+from armdata.daemon import QueryDaemon, forward, recv_frame, send_frame
+from armdata.metadata_cache import MetadataCache
+
+
+@pytest.fixture
+def daemon_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("TD_API_KEY", "x")
+    monkeypatch.delenv("TD_API_SERVER", raising=False)
+    monkeypatch.delenv("ARMDATA_DAEMON", raising=False)
+    return str(tmp_path / "daemon.sock")
+
+
+@contextlib.contextmanager
+def running_daemon(path):
+    """Daemon serving in a thread with a mocked ArmQuery, started in the
+    test itself since it replaces sys.stdout, which pytest sets per phase
+    """
+    with patch('armdata.query_util.ArmQuery') as mock_class:
+        query_daemon = QueryDaemon(path, "x", "https://api.treasuredata.com/")
+        thread = threading.Thread(target=query_daemon.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield path, mock_class.return_value
+        finally:
+            query_daemon.shutdown()
+            thread.join()
+            query_daemon.close()
+
+
+def test_frames():
+    left, right = socket.socketpair()
+    with left, right:
+        send_frame(left, daemon.STDOUT, b"abc")
+        send_frame(left, daemon.EXIT, b"")
+        left.close()
+        rfile = right.makefile("rb")
+        assert recv_frame(rfile) == (daemon.STDOUT, b"abc")
+        assert recv_frame(rfile) == (daemon.EXIT, b"")
+        assert recv_frame(rfile) == (None, None)
+
+
+def parse(*args):
+    return query_cli.main.make_context("query", list(args)).params
+
+
+def test_forward_absolute_paths(daemon_env, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with running_daemon(daemon_env) as (path, arm_query), \
+            patch('armdata.daemon.run_params', return_value=0) as run_params:
+        params = parse('--daemon', 'sample_datasets', 'www_access', '-f', 'csv', '-o', 'out.csv')
+        assert forward(params, path, io.BytesIO(), io.BytesIO()) == 0
+    sent = run_params.call_args[0][0]
+    assert sent["output"] == str(tmp_path / "out.csv")
+    assert sent["format"] == "csv" and not sent["use_daemon"]
+
+
+def test_forward_query(daemon_env):
+    out, err = io.BytesIO(), io.BytesIO()
+    with running_daemon(daemon_env) as (path, arm_query):
+        arm_query.checkDbAndTable.return_value = (True, "")
+        arm_query.checkTableColumns.return_value = (True, [])
+        arm_query.query.return_value = (['host', 'time'], iter([['a', 1], ['b', 2]]))
+        assert forward(parse('sample_datasets', 'www_access', '-f', 'csv', '-c', 'host,time'), path, out, err) == 0
+        assert out.getvalue() == b"host,time\na,1\nb,2\n"
+
+        arm_query.checkDbAndTable.return_value = (False, "table")
+        assert forward(parse('sample_datasets', 'nope'), path, out, err) == 2
+        assert b"Error: Invalid value: Table name not found" in err.getvalue()
+        assert daemon.request(path, {"command": "status"})["served"] == 2
+
+
+def test_forward_declined(daemon_env, monkeypatch):
+    with running_daemon(daemon_env) as (path, arm_query):
+        assert forward(parse('sample_datasets', 'www_access'), path + ".missing") is None
+        monkeypatch.setenv("TD_API_KEY", "other")
+        assert forward(parse('sample_datasets', 'www_access'), path) is None
+        assert not arm_query.query.called
+
+
+@patch('armdata.query_util.ArmQuery')
+def test_forwarding_is_opt_in(mock_class, daemon_env):
+    arm_query = mock_class.return_value
+    arm_query.checkDbAndTable.return_value = (True, "")
+    arm_query.checkTableColumns.return_value = (True, [])
+    arm_query.query.return_value = (['host'], iter([['a']]))
+    runner = CliRunner(env={"TD_API_KEY": "x", "ARMDATA_DAEMON_SOCKET": daemon_env})
+    with patch('armdata.daemon.forward', return_value=None) as mock_forward:
+        assert runner.invoke(query_cli.main, ['sample_datasets', 'www_access', '-f', 'csv']).exit_code == 0
+        assert not mock_forward.called
+        assert runner.invoke(query_cli.main, ['--help']).exit_code == 0
+        assert not mock_forward.called
+        arm_query.query.return_value = (['host'], iter([['a']]))
+        result = runner.invoke(query_cli.main, ['sample_datasets', 'www_access', '-f', 'csv'],
+                               env={"ARMDATA_DAEMON": "1"})
+        # no daemon listens, the query runs in this process
+        assert result.exit_code == 0 and result.output == "host\na\n"
+        assert mock_forward.call_args[0][0]["table_name"] == "www_access"
+
+
+def test_metadata_memory(tmp_path):
+    memory = {}
+    cache = MetadataCache("https://api.treasuredata.com", cache_dir=str(tmp_path), memory=memory)
+    cache.set([["host", "string"]], "schema", "db", "t")
+    assert len(memory) == 1
+    (tmp_path / "metadata").rename(tmp_path / "moved")
+    assert MetadataCache("https://api.treasuredata.com", cache_dir=str(tmp_path),
+                         memory=memory).get("schema", "db", "t") == [["host", "string"]]
+    cache.invalidate("schema", "db", "t")
+    assert cache.get("schema", "db", "t") is None
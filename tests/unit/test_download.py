@@ -0,0 +1,110 @@
+import os
+import gzip
+import json
+import contextlib
+import msgpack
+import pytest
+import tdclient
+import urllib3
+from mock import MagicMock, patch
+from click.testing import CliRunner
+from armdata import query_cli
+from armdata.download import ResumableDownloads
+
+ROWS = [['host-%d' % i, i] for i in range(2000)]
+
+
+class FakeApi:
+    """Serves a msgpack.gz result by byte range, failing the ranges starting
+    at fail_starts
+    """
+
+    def __init__(self, payload, fail_starts=(), drop_starts=()):
+        self.payload = payload
+        self.fail_starts = set(fail_starts)
+        # ranges whose connection drops after the first bytes, once each
+        self.drop_starts = set(drop_starts)
+        self.ranges = []
+
+    def show_job(self, job_id):
+        return {"status": "success", "result_size": len(self.payload)}
+
+    @contextlib.contextmanager
+    def get(self, url, headers=None):
+        start, end = [int(n) for n in headers["Range"][len("bytes="):].split("-")]
+        self.ranges.append((start, end))
+        if start in self.fail_starts:
+            raise tdclient.errors.APIError("Connection reset")
+        res = MagicMock(status=206)
+        res.stream.return_value = iter([self.payload[start:end + 1]])
+        if start in self.drop_starts:
+            self.drop_starts.discard(start)
+            res.stream.return_value = self._dropped(self.payload[start:start + 10])
+        yield res
+
+    def _dropped(self, data):
+        yield data
+        raise urllib3.exceptions.ProtocolError("Connection broken: IncompleteRead")
+
+    def raise_error(self, msg, res, body):
+        raise tdclient.errors.APIError(msg)
+
+
+def payload():
+    return gzip.compress(b"".join(msgpack.packb(row) for row in ROWS))
+
+
+def test_parallel_download(tmp_path):
+    api = FakeApi(payload())
+    started = []
+    downloads = ResumableDownloads("https://api.treasuredata.com", cache_dir=str(tmp_path), chunk_bytes=1000,
+                                   threads=4, on_start=started.append)
+
+    assert list(downloads.rows(api, "123")) == ROWS
+    assert started == ["123"]
+    assert len(api.ranges) == -(-len(api.payload) // 1000)
+    assert not os.path.exists(downloads.jobDir("123"))
+
+
+def test_resume_download(tmp_path):
+    data = payload()
+    downloads = ResumableDownloads("https://api.treasuredata.com", cache_dir=str(tmp_path), chunk_bytes=1000)
+
+    failing = FakeApi(data, fail_starts=[2000])
+    rows = downloads.rows(failing, "123")
+    with pytest.raises(IOError) as e:
+        list(rows)
+    assert "--resume 123" in str(e.value)
+    with open(os.path.join(downloads.jobDir("123"), "state.json")) as f:
+        completed = json.load(f)["completed"]
+    # later chunks keep downloading after a failed one
+    assert 0 in completed and 1 in completed and 2 not in completed
+
+    api = FakeApi(data)
+    assert list(downloads.rows(api, "123")) == ROWS
+    assert api.ranges[0] == (2000, 2999)
+    assert [(start, end) for start, end in api.ranges if start // 1000 in completed] == []
+
+
+def test_dropped_connection_retried(tmp_path):
+    api = FakeApi(payload(), drop_starts=[0, 1000])
+    downloads = ResumableDownloads("https://api.treasuredata.com", cache_dir=str(tmp_path), chunk_bytes=1000)
+
+    assert list(downloads.rows(api, "123")) == ROWS
+    assert [start for start, _ in api.ranges[:4]] == [0, 0, 1000, 1000]
+    assert not os.path.exists(downloads.jobDir("123"))
+
+
+@patch('armdata.query_util.ArmQuery')
+def test_cli_dropped_connection(mock_class):
+    def rows():
+        yield ['a', 1]
+        raise urllib3.exceptions.ProtocolError("Connection broken: IncompleteRead")
+
+    instance = mock_class.return_value
+    instance.checkDbAndTable.return_value = (True, "")
+    instance.query.return_value = (['host', 'time'], rows())
+    result = CliRunner(env={"TD_API_KEY": "x"}).invoke(query_cli.main, ['sample_datasets', 'www_access', '-f', 'csv'])
+
+    assert result.exit_code == 1
+    assert "Error: Download failed: Connection broken: IncompleteRead" in result.output
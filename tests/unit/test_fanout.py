@@ -0,0 +1,83 @@
+import pytest
+from mock import patch, MagicMock
+from click.testing import CliRunner
+from armdata import query_cli
+from armdata.fanout import is_fanout, match_names
+from armdata.query_util import ArmQuery
+
+TABLES = {
+    'events_us': {'schema': [['host', 'string', 'host'], ['code', 'long', 'code']]},
+    'events_eu': {'schema': [['host', 'string', 'host'], ['region', 'string', 'region']]},
+    'users': {'schema': [['name', 'string', 'name']]},
+    'audit': {'schema': [['_source', 'string', '_source'], ['host', 'string', 'host']]},
+}
+
+RESULTS = {'events_us': [['a', 200, 1]], 'events_eu': [['b', 'eu-1', 2], ['c', 'eu-2', 3]]}
+
+
+def mock_catalog(client):
+    client.api.list_databases.return_value = {'logs': {}, 'logs_old': {}, 'sample_datasets': {}}
+    client.api.list_tables.return_value = TABLES
+
+    def query(db, statement, type):
+        table = [name for name in RESULTS if '"%s"' % name in statement][0]
+        selected = statement.split(" FROM ")[0].count('"') // 2
+        job = MagicMock(job_id=table)
+        job.finished.return_value = True
+        job.result.return_value = iter([row[:selected] for row in RESULTS[table]])
+        return job
+    client.query.side_effect = query
+
+
+def test_match_names():
+    assert is_fanout('logs', 'events_*') and is_fanout('logs,logs_old', 'users') and not is_fanout('logs', 'users')
+    assert match_names(['events_*', 'users'], ['users', 'events_us', 'events_eu']) == (
+        ['events_eu', 'events_us', 'users'], [])
+    assert match_names(['logs', 'missing'], ['logs']) == (['logs'], ['missing'])
+    assert match_names(['logs'], None) == (['logs'], [])
+
+
+@patch('armdata.query_util.tdclient.Client')
+def test_resolve_and_query_tables(mock_client):
+    client = mock_client.return_value
+    mock_catalog(client)
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com')
+
+    assert td.resolveTables('logs*', 'events_*') == (True, [('logs', 'events_eu'), ('logs', 'events_us'),
+                                                            ('logs_old', 'events_eu'), ('logs_old', 'events_us')])
+    client.api.list_databases.assert_called_once_with()
+    assert client.api.list_tables.call_count == 2
+    assert td.resolveTables('logs', 'events_us,accounts') == (False, "table")
+    assert td.resolveTables('nope_*', 'users') == (False, "database")
+
+    tables = [('logs', 'events_us'), ('logs', 'events_eu')]
+    columns, rows = td.queryTables(tables, None, None, None, None, 'presto', concurrency=2)
+    assert columns == ['_source', 'host', 'code', 'time', 'region']
+    assert list(rows) == [['logs.events_us', 'a', 200, 1, None],
+                          ['logs.events_eu', 'b', None, 2, 'eu-1'], ['logs.events_eu', 'c', None, 3, 'eu-2']]
+    assert td.tablesColumnTypes(tables, columns) == ['string', 'string', 'long', 'long', 'string']
+    # every table was resolved from the listings
+    assert client.api.list_tables.call_count == 3
+
+    with pytest.raises(ValueError, match="Column _source of the tables clashes"):
+        td.queryTables([('logs', 'events_us'), ('logs', 'audit')], None, None, None, None, 'presto')
+    columns, rows = td.queryTables([('logs', 'events_us'), ('logs', 'audit')], 'host', None, None, None, 'presto')
+    assert columns == ['_source', 'host']
+
+
+@patch('armdata.query_util.tdclient.Client')
+def test_cli_fanout(mock_client):
+    mock_catalog(mock_client.return_value)
+    runner = CliRunner(env={"TD_API_KEY": "x"})
+
+    result = runner.invoke(query_cli.main, ['logs', 'events_*', '-c', 'host', '-f', 'csv', '--metadata-ttl', '0'])
+    assert result.exit_code == 0, result.output
+    assert result.output == '_source,host\nlogs.events_eu,b\nlogs.events_eu,c\nlogs.events_us,a\n'
+    assert mock_client.return_value.api.list_tables.call_count == 1
+
+    result = runner.invoke(query_cli.main, ['logs', 'events_*', '-c', 'host,code', '--metadata-ttl', '0'])
+    assert result.exit_code == 2
+    assert "Column names not found in the tables: logs.events_eu ['code']" in result.output
+
+    result = runner.invoke(query_cli.main, ['logs', 'events_*', '--split-by', 'day', '-m', '1', '-M', '2'])
+    assert result.exit_code == 2
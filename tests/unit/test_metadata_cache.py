@@ -0,0 +1,61 @@
+import os
+from mock import patch
+from armdata.metadata_cache import MetadataCache
+from armdata.query_util import ArmQuery
+
+ENDPOINT = 'https://api.treasuredata.com'
+
+def test_metadata_cache_round_trip(tmp_path):
+    cache = MetadataCache(ENDPOINT, cache_dir=str(tmp_path))
+    assert cache.get("columns", "sample_datasets", "www_access") is None
+    
+    cache.set(["host", "path", "time"], "columns", "sample_datasets", "www_access")
+    
+    assert cache.get("columns", "sample_datasets", "www_access") == ["host", "path", "time"]
+    assert cache.get("columns", "sample_datasets", "other") is None
+    assert MetadataCache("http://localhost", cache_dir=str(tmp_path)).get(
+        "columns", "sample_datasets", "www_access") is None
+    
+def test_metadata_cache_expired(tmp_path):
+    cache = MetadataCache(ENDPOINT, cache_dir=str(tmp_path), ttl=60)
+    with patch('armdata.metadata_cache.time.time', return_value=1000):
+        cache.set(["sample_datasets"], "databases")
+    with patch('armdata.metadata_cache.time.time', return_value=1059):
+        assert cache.get("databases") == ["sample_datasets"]
+    with patch('armdata.metadata_cache.time.time', return_value=1061):
+        assert cache.get("databases") is None
+        
+def test_metadata_cache_refresh_and_invalidate(tmp_path):
+    MetadataCache(ENDPOINT, cache_dir=str(tmp_path)).set(["www_access"], "tables", "sample_datasets")
+    
+    assert MetadataCache(ENDPOINT, cache_dir=str(tmp_path), refresh=True).get("tables", "sample_datasets") is None
+    cache = MetadataCache(ENDPOINT, cache_dir=str(tmp_path))
+    assert cache.get("tables", "sample_datasets") == ["www_access"]
+    cache.invalidate("tables", "sample_datasets")
+    assert cache.get("tables", "sample_datasets") is None
+    
+def test_metadata_cache_corrupt_entry(tmp_path):
+    cache = MetadataCache(ENDPOINT, cache_dir=str(tmp_path))
+    cache.set(["sample_datasets"], "databases")
+    entry_dir = os.path.join(str(tmp_path), "metadata")
+    for name in os.listdir(entry_dir):
+        with open(os.path.join(entry_dir, name), "w") as f:
+            f.write('{"stored_at"')
+            
+    assert cache.get("databases") is None
+    
+@patch.object(ArmQuery, '_fetchTableSchema')
+def test_check_table_columns_cached(mock_fetch, tmp_path):
+    mock_fetch.return_value = [["host", "string"], ["path", "string"], ["time", "long"]]
+    cache = MetadataCache(ENDPOINT, cache_dir=str(tmp_path))
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", ENDPOINT, metadata_cache=cache)
+    
+    assert td.checkTableColumns("sample_datasets", "www_access", ["host"]) == (True, [])
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", ENDPOINT, metadata_cache=cache)
+    assert td.checkDbAndTable("sample_datasets", "www_access") == (True, "")
+    assert td.checkTableColumns("sample_datasets", "www_access", ["path", "time"]) == (True, [])
+    assert mock_fetch.call_count == 1
+    
+    #a missing column is looked up again before being reported
+    assert td.checkTableColumns("sample_datasets", "www_access", ["code"]) == (False, ["code"])
+    assert mock_fetch.call_count == 2
@@ -0,0 +1,84 @@
+import time
+import pytest
+from mock import patch, MagicMock
+from click.testing import CliRunner
+from armdata.partition import split_time_range, merge_shards
+from armdata.query_util import ArmQuery
+from armdata.query_cli import main
+
+def test_split_time_range_by_hour():
+    assert split_time_range(1412377100, 1412384400, "hour") == [
+        (1412377100, 1412377200), (1412377200, 1412380800), (1412380800, 1412384400)]
+    assert split_time_range(1412380800, 1412380900, "hour") == [(1412380800, 1412380900)]
+    
+def test_split_time_range_by_day():
+    ranges = split_time_range(1412377100, 1412377100 + 3 * 86400, "day")
+    assert len(ranges) == 4
+    assert ranges[0][0] == 1412377100 and ranges[-1][1] == 1412377100 + 3 * 86400
+    assert all(end % 86400 == 0 for _, end in ranges[:-1])
+    
+def _shard(rows, delay=0):
+    def run(stopped):
+        time.sleep(delay)
+        for row in rows:
+            yield row
+    return run
+
+@patch('armdata.partition.SHARD_BATCH_ROWS', 2)
+def test_merge_shards_in_order():
+    #later shards finish first, the merge still follows the shard order
+    shards = [_shard([[i, j] for j in range(5)], delay=0.05 * (3 - i)) for i in range(4)]
+    
+    rows = list(merge_shards(shards, concurrency=3))
+    
+    assert rows == [[i, j] for i in range(4) for j in range(5)]
+    
+@patch('armdata.partition.SHARD_BATCH_ROWS', 2)
+def test_merge_shards_limit_stops_shards():
+    stop_events = []
+    def endless(stopped):
+        stop_events.append(stopped)
+        i = 0
+        while True:
+            yield [i]
+            i += 1
+    
+    rows = list(merge_shards([endless, endless, endless], concurrency=2, limit=3))
+    
+    assert rows == [[0], [1], [2]]
+    assert all(stopped.is_set() for stopped in stop_events)
+    
+def test_merge_shards_error():
+    def failing(stopped):
+        raise ValueError("result is not ready")
+        yield
+    
+    with pytest.raises(ValueError):
+        list(merge_shards([_shard([[1]]), failing], concurrency=2))
+        
+@patch('armdata.query_util.tdclient.Client')
+def test_query_split_by_hour(mock_client):
+    client = mock_client.return_value
+    def query(db, sql, type):
+        job = MagicMock()
+        job.finished.return_value = True
+        job.result.return_value = iter([[sql]])
+        return job
+    client.query.side_effect = query
+    
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com')
+    columns, rows = td.query('sample_datasets', 'www_access', 'host', 1412377200, 1412384400, 10,
+                             'presto', split_by='hour', concurrency=2)
+    
+    assert rows == [['SELECT "host" FROM "www_access" WHERE TD_TIME_RANGE("time", 1412377200, 1412380800) LIMIT 10;'],
+                    ['SELECT "host" FROM "www_access" WHERE TD_TIME_RANGE("time", 1412380800, 1412384400) LIMIT 10;']]
+    
+@patch('armdata.query_util.ArmQuery')
+def test_cli_split_by_without_range(mock_class):
+    """Query fails when --split-by is given without both timestamps
+    """
+    runner = CliRunner()
+    result = runner.invoke(main, ["sample_datasets", "www_access", "--split-by", "day", "-m", "1412377100"])
+    
+    assert result.exit_code == 2
+    assert "--split-by needs both the min and max timestamps" in result.output
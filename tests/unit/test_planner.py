@@ -0,0 +1,94 @@
+import datetime
+from mock import patch
+from click.testing import CliRunner
+from armdata import query_cli
+from armdata import planner
+from armdata.planner import ScanEstimate, table_stats
+from armdata.query_util import ArmQuery
+
+DAY = 86400
+
+UTC = datetime.timezone.utc
+
+TABLES = {
+    'www_access': {
+        'schema': [['host', 'string', 'host'], ['path', 'string', 'path'], ['code', 'long', 'code']],
+        'count': 4000000000, 'estimated_storage_size': 400 * 1024 ** 3,
+        'created_at': datetime.datetime(2024, 1, 1, tzinfo=UTC),
+        'last_log_timestamp': datetime.datetime(2024, 1, 1, tzinfo=UTC) + datetime.timedelta(days=400),
+    },
+}
+
+START = int(datetime.datetime(2024, 1, 1, tzinfo=UTC).timestamp())
+
+
+def test_scan_estimate():
+    stats = table_stats(TABLES['www_access'])
+    assert stats == {"rows": 4000000000, "bytes": 400 * 1024 ** 3, "columns": 4,
+                     "first_time": START, "last_time": START + 400 * DAY}
+
+    estimate = ScanEstimate(stats, None, None, 4)
+    assert estimate.rows == 4000000000 and estimate.engine()[0] == "hive"
+
+    # one day of two columns out of four
+    estimate = ScanEstimate(stats, START + 399 * DAY, START + 400 * DAY, 2)
+    assert estimate.rows == 10000000
+    assert estimate.bytes == int(400 * 1024 ** 3 / 400.0 / 2)
+    assert estimate.engine() == ("presto", "estimated scan is below 20.0 GiB and 2,000,000,000 records")
+
+    # ranges outside of the table read nothing
+    assert ScanEstimate(stats, START - 10 * DAY, START - DAY, 2).rows == 0
+
+
+def test_scan_estimate_of_bulk_loaded_table():
+    """A table created after its last log does not tell the time range of its records"""
+    stats = table_stats({'schema': [['host', 'string', 'host']], 'count': 100000000,
+                         'estimated_storage_size': 93 * 1024 ** 3,
+                         'created_at': datetime.datetime(2024, 1, 10, tzinfo=UTC),
+                         'last_log_timestamp': datetime.datetime(2023, 12, 31, tzinfo=UTC)})
+    assert stats["first_time"] is None
+
+    # a year up to the last log
+    last = stats["last_time"]
+    estimate = ScanEstimate(stats, last - 365 * DAY, last - DAY, 2)
+    assert estimate.time_fraction == 1.0 and estimate.rows == 100000000
+    assert estimate.engine()[0] == "hive"
+    assert "time range of the records unknown" in estimate.note
+    assert ScanEstimate(stats, None, None, 2).note is None
+
+
+@patch('armdata.query_util.tdclient.Client')
+def test_auto_engine(mock_client):
+    client = mock_client.return_value
+    client.api.list_tables.return_value = TABLES
+    client.query.return_value.result.return_value = iter([['a', 1]])
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com')
+
+    td.query('sample_datasets', 'www_access', 'host,code', None, None, None, 'auto')
+    assert client.query.call_args[1]['type'] == 'hive'
+
+    td.query('sample_datasets', 'www_access', 'host,code', START + 399 * DAY, None, None, 'auto')
+    assert client.query.call_args[1]['type'] == 'presto'
+    client.api.list_tables.assert_called_once_with('sample_datasets')
+
+    plan = td.plan('sample_datasets', 'www_access', 'host', START, START + 2 * DAY, 10, 'hive', split_by='day')
+    assert plan.engine == 'hive' and plan.jobs == 2
+    assert plan.reason.startswith("requested, the estimate favours presto")
+    assert plan.statement == "SELECT `host` FROM `www_access` WHERE TD_TIME_RANGE(`time`, %d, %d) LIMIT 10;" % (
+        START, START + DAY)
+
+
+@patch('armdata.query_util.tdclient.Client')
+def test_cli_explain(mock_client):
+    client = mock_client.return_value
+    client.api.list_tables.return_value = TABLES
+    runner = CliRunner(env={"TD_API_KEY": "x"})
+    with patch.object(planner, "HIVE_SCAN_BYTES", 1024 ** 3):
+        result = runner.invoke(query_cli.main, ['sample_datasets', 'www_access', '-e', 'auto', '--explain',
+                                                '-c', 'host', '--where', 'code>=500', '--metadata-ttl', '0'])
+
+    assert result.exit_code == 0, result.output
+    assert "columns read       3 of 4" in result.output
+    assert "engine             hive (estimated scan of 300.0 GiB is at least 1.0 GiB)" in result.output
+    assert 'SELECT `host` FROM `www_access` WHERE TD_TIME_RANGE(`time`, NULL, NULL) AND `code` >= 500;' in result.output
+    assert not client.query.called
@@ -0,0 +1,69 @@
+import io
+import itertools
+import threading
+import pytest
+from mock import patch, MagicMock
+from click.testing import CliRunner
+from armdata import polling, query_cli
+from armdata.polling import JobPoller, JobTimeout, Progress
+
+
+def test_intervals_back_off_up_to_the_maximum():
+    poller = JobPoller(None, first_interval=1, backoff=2, max_interval=5, jitter=0)
+    assert list(itertools.islice(poller.intervals(), 6)) == [1, 2, 4, 5, 5, 5]
+
+    poller = JobPoller(None, first_interval=1)
+    assert all(0.8 <= interval <= 1.2 for interval in itertools.islice(poller.intervals(), 1))
+
+
+def test_wait_reports_statuses():
+    statuses = iter(["queued", "running", "success"])
+    progress = MagicMock()
+    job = MagicMock(job_id="1")
+    poller = JobPoller(lambda job: next(statuses), progress=progress, first_interval=0.001)
+
+    assert poller.wait(job)
+    assert [call[0] for call in progress.job.call_args_list] == [("1", "queued"), ("1", "running"), ("1", "success")]
+    job.update.assert_called_once_with()
+
+    stopped = threading.Event()
+    stopped.set()
+    assert not poller.wait(job, stopped)
+
+
+def test_timeout_kills_the_job():
+    job = MagicMock(job_id="1")
+    poller = JobPoller(lambda job: "running", timeout=0.05, first_interval=0.01, backoff=1)
+    with pytest.raises(JobTimeout):
+        poller.wait(job)
+    job.kill.assert_called_once_with()
+    assert not job.update.called
+
+
+def test_progress_line():
+    out = io.StringIO()
+    with Progress(out) as progress:
+        assert progress.line().startswith("submitting | 0s | 0 records")
+        progress.job("12", "queued")
+        assert progress.line() == "job 12 queued | 0s | 0 records"
+        progress.job("13", "running")
+        progress.job("14", "running")
+        assert list(progress.trackRows(range(1500))) == list(range(1500))
+        assert progress.line() == "jobs 1 queued, 2 running | 0s | 1,500 records"
+    assert out.getvalue().endswith("\r")
+
+
+@patch.object(polling, 'FIRST_INTERVAL', 0.01)
+@patch('armdata.query_util.tdclient.Client')
+def test_cli_timeout(mock_client):
+    client = mock_client.return_value
+    client.api.list_tables.return_value = {'www_access': {'schema': [['host', 'string', 'host']]}}
+    client.job_status.return_value = "running"
+    runner = CliRunner(env={"TD_API_KEY": "x"})
+
+    with patch.object(polling, 'MAX_INTERVAL', 0.01):
+        result = runner.invoke(query_cli.main, ['sample_datasets', 'www_access', '--timeout', '1',
+                                                '--metadata-ttl', '0', '--no-progress'])
+    assert result.exit_code == 1
+    assert "did not finish within 1 seconds and was killed" in result.output
+    client.query.return_value.kill.assert_called_once_with()
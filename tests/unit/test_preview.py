@@ -0,0 +1,129 @@
+import datetime
+import pytest
+from mock import patch, MagicMock
+from click.testing import CliRunner
+from armdata import query_cli
+from armdata.query_util import ArmQuery
+
+UTC = datetime.timezone.utc
+
+LAST = int(datetime.datetime(2024, 6, 1, tzinfo=UTC).timestamp())
+
+TABLES = {
+    'www_access': {
+        'schema': [['host', 'string', 'host'], ['code', 'long', 'code']],
+        'count': 1000, 'estimated_storage_size': 10000,
+        'created_at': datetime.datetime(2024, 1, 1, tzinfo=UTC),
+        'last_log_timestamp': datetime.datetime(2024, 6, 1, tzinfo=UTC),
+    },
+}
+
+
+def finished_job(job_id, rows):
+    job = MagicMock(job_id=job_id)
+    job.finished.return_value = True
+    job.result.return_value = iter(rows)
+    return job
+
+
+@patch('armdata.query_util.tdclient.Client')
+def test_preview_widens(mock_client):
+    client = mock_client.return_value
+    client.api.list_tables.return_value = TABLES
+    client.query.side_effect = [finished_job("1", [['a', 1], ['b', 2]]),
+                                finished_job("2", [['c', 3], ['d', 4], ['e', 5]])]
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com')
+
+    columns, batches = td.preview('sample_datasets', 'www_access', 'host,code', 5, 'presto')
+    assert columns == ['host', 'code']
+    assert list(batches) == [[['a', 1], ['b', 2]], [['c', 3], ['d', 4], ['e', 5]]]
+
+    statements = [call[0][1] for call in client.query.call_args_list]
+    assert statements == [
+        'SELECT "host", "code" FROM "www_access" WHERE TD_TIME_RANGE("time", %d, %d) LIMIT 5;' % (
+            LAST + 1 - 3600, LAST + 1),
+        'SELECT "host", "code" FROM "www_access" WHERE TD_TIME_RANGE("time", %d, %d) LIMIT 3;' % (
+            LAST + 1 - 86400, LAST + 1 - 3600),
+    ]
+
+
+@patch('armdata.query_util.tdclient.Client')
+def test_preview_stops_at_min_time(mock_client):
+    client = mock_client.return_value
+    client.api.list_tables.return_value = TABLES
+    client.query.side_effect = [finished_job("1", [])]
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com')
+
+    columns, batches = td.preview('sample_datasets', 'www_access', 'host', 5, 'presto', min_time=LAST - 60)
+    assert list(batches) == []
+    assert client.query.call_count == 1
+    assert 'TD_TIME_RANGE("time", %d, %d)' % (LAST - 60, LAST + 1) in client.query.call_args[0][1]
+
+
+@patch('armdata.query_util.tdclient.Client')
+def test_preview_of_bulk_loaded_table(mock_client):
+    """The table was created after its newest record, older slices are still read"""
+    client = mock_client.return_value
+    last = datetime.datetime(2023, 12, 31, tzinfo=UTC)
+    client.api.list_tables.return_value = {'www_access': dict(
+        TABLES['www_access'], created_at=datetime.datetime(2024, 1, 10, tzinfo=UTC), last_log_timestamp=last)}
+    client.query.side_effect = ([finished_job("1", [['a', 1], ['b', 2]])] +
+                                [finished_job(str(i), []) for i in range(2, 6)] + [finished_job("6", [['c', 3]])])
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com')
+
+    columns, batches = td.preview('sample_datasets', 'www_access', 'host,code', 20, 'presto')
+    assert list(batches) == [[['a', 1], ['b', 2]], [['c', 3]]]
+    # every window, then everything older
+    assert client.query.call_count == 6
+    assert 'WHERE TD_TIME_RANGE("time", NULL, %d)' % (int(last.timestamp()) + 1 - 365 * 86400) in (
+        client.query.call_args[0][1])
+
+
+@patch('armdata.query_util.time.time', return_value=LAST + 0.5)
+@patch('armdata.query_util.tdclient.Client')
+def test_preview_without_last_log_time(mock_client, mock_time):
+    """Slices end now rather than at the epoch"""
+    client = mock_client.return_value
+    client.api.list_tables.return_value = {'www_access': dict(TABLES['www_access'], last_log_timestamp=None)}
+    client.query.side_effect = [finished_job("1", [['a', 1]])]
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com')
+
+    columns, batches = td.preview('sample_datasets', 'www_access', 'host,code', 1, 'presto')
+    assert list(batches) == [[['a', 1]]]
+    assert 'TD_TIME_RANGE("time", %d, %d)' % (LAST + 1 - 3600, LAST + 1) in client.query.call_args[0][1]
+
+
+@patch('armdata.polling.time.sleep')
+@patch('armdata.query_util.tdclient.Client')
+def test_preview_interrupted_kills_job(mock_client, mock_sleep):
+    client = mock_client.return_value
+    client.api.list_tables.return_value = TABLES
+    job = MagicMock(job_id="1")
+    job.finished.return_value = False
+    client.query.return_value = job
+    mock_sleep.side_effect = KeyboardInterrupt
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com')
+
+    columns, batches = td.preview('sample_datasets', 'www_access', 'host', 5, 'presto')
+    with pytest.raises(KeyboardInterrupt):
+        list(batches)
+    job.kill.assert_called_once_with()
+
+
+@patch('armdata.query_util.ArmQuery')
+def test_cli_preview(mock_class):
+    instance = mock_class.return_value
+    instance.checkDbAndTable.return_value = (True, "")
+    instance.checkTableColumns.return_value = (True, [])
+    instance.preview.return_value = (['host', 'code'], iter([[['a', 200]], [['longer-host', None]]]))
+
+    runner = CliRunner()
+    result = runner.invoke(query_cli.main, ['sample_datasets', 'www_access', '--preview', '-c', 'host,code'])
+
+    assert result.exit_code == 0, result.output
+    assert result.output.split('\n') == ['host  code', '----  ----', 'a     200', 'longer-host', '']
+    assert instance.preview.call_args[0][3] == query_cli.PREVIEW_ROWS
+    assert not instance.query.called
+
+    result = runner.invoke(query_cli.main, ['sample_datasets', 'www_access', '--preview', '--agg', 'count'])
+    assert result.exit_code == 2
@@ -0,0 +1,68 @@
+import io
+import re
+import json
+import datetime
+import msgpack
+from mock import patch, MagicMock
+from armdata.profiling import Profiler, NULL_PROFILER
+from armdata.query_util import ArmQuery
+
+
+def test_profiler_spans_and_trace(tmp_path):
+    trace = tmp_path / "trace.jsonl"
+    with Profiler(str(trace)) as profiler:
+        with profiler.span("catalog", db="sample_datasets") as span:
+            span["source"] = "api"
+        with profiler.span("catalog", db="sample_datasets"):
+            pass
+        assert list(profiler.trackRows(iter([[1], [2], [3]]))) == [[1], [2], [3]]
+        profiler.count("bytes_downloaded", 42)
+
+        out = io.StringIO()
+        profiler.summary(out=out)
+
+    records = [json.loads(line) for line in trace.read_text().splitlines()]
+    assert [r["name"] for r in records] == ["catalog", "catalog", "download"]
+    assert records[0]["source"] == "api"
+    assert records[2]["rows"] == 3
+    summary = out.getvalue()
+    assert re.search(r"catalog\s+2\s", summary)
+    assert "download_rows: 3" in summary
+    assert "bytes_downloaded: 42" in summary
+
+
+def test_null_profiler():
+    rows = iter([[1]])
+    assert NULL_PROFILER.trackRows(rows) is rows
+    with NULL_PROFILER.span("catalog") as span:
+        span["source"] = "api"
+    assert NULL_PROFILER.phaseSeconds("catalog") == 0.0
+
+
+@patch('armdata.query_util.tdclient.Client')
+def test_query_profiled(mock_client):
+    client = mock_client.return_value
+    client.query.return_value.job_id = "123"
+    client.query.return_value.success.return_value = True
+    created = datetime.datetime(2020, 1, 1, 0, 0, 0)
+    client.api.show_job.return_value = {
+        "status": "success", "num_records": 2, "created_at": created,
+        "start_at": created + datetime.timedelta(seconds=3),
+        "end_at": created + datetime.timedelta(seconds=10),
+    }
+    payload = msgpack.packb(['a', 1]) + msgpack.packb(['b', 2])
+    response = MagicMock(status=200)
+    response.stream.return_value = iter([payload])
+    client.api.get.return_value.__enter__.return_value = response
+
+    profiler = Profiler()
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com', profiler=profiler)
+    columns, rows = td.query('sample_datasets', 'www_access', 'host,code', None, None, 2, 'presto')
+
+    assert rows == [['a', 1], ['b', 2]]
+    client.api.get.assert_called_once_with("/v3/job/result/123?format=msgpack")
+    out = io.StringIO()
+    profiler.summary(out=out)
+    summary = out.getvalue()
+    assert "bytes_downloaded: %d" % len(payload) in summary
+    assert re.search(r"123\s+presto\s+success\s+3\s+7\s+2", summary)
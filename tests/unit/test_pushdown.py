@@ -0,0 +1,73 @@
+import pytest
+from mock import patch
+from click.testing import CliRunner
+from armdata import query_cli
+from armdata.pushdown import Pushdown, parse_condition
+from armdata.query_util import ArmQuery
+
+SCHEMA = [['host', 'string'], ['code', 'long'], ['size', 'long'], ['agent', 'string'], ['time', 'long']]
+
+
+def test_parse_condition():
+    assert parse_condition("code>=500") == ("code", ">=", "500")
+    assert parse_condition("host <> 'a b'") == ("host", "!=", "'a b'")
+    assert parse_condition("path not like '/api%'") == ("path", "NOT LIKE", "'/api%'")
+    assert parse_condition("agent is null") == ("agent", "IS NULL", None)
+    with pytest.raises(ValueError):
+        parse_condition("code")
+
+
+def test_validate():
+    pushdown = Pushdown(where=["code>=500", "host='x'", "agent like '\"%bot%\"'"])
+    validated = pushdown.validate(SCHEMA, ['host', 'code'])
+    assert validated.conditions == [("code", ">=", 500), ("host", "=", "x"), ("agent", "LIKE", '"%bot%"')]
+    # the parsed values are kept, validating again gives the same values
+    assert pushdown.conditions[0] == ("code", ">=", "500")
+    assert pushdown.validate(SCHEMA, ['host', 'code']).conditions == validated.conditions
+
+    with pytest.raises(ValueError, match="Column names not found"):
+        Pushdown(where=["status=1"]).validate(SCHEMA, ['host'])
+    with pytest.raises(ValueError, match="holds long values"):
+        Pushdown(where=["code=abc"]).validate(SCHEMA, ['host'])
+    with pytest.raises(ValueError, match="holds double values, got 'nan'"):
+        Pushdown(where=["ratio>nan"]).validate(SCHEMA + [['ratio', 'double']], ['host'])
+    with pytest.raises(ValueError, match="numeric column"):
+        Pushdown(aggregates=["sum:host"]).validate(SCHEMA, ['host'])
+    with pytest.raises(ValueError, match="not in the result"):
+        Pushdown(group_by=["host"], order_by=["code"]).validate(SCHEMA, ['host'])
+
+
+@patch('armdata.query_util.tdclient.Client')
+def test_query_sql(mock_client):
+    client = mock_client.return_value
+    client.api.list_tables.return_value = {'www_access': {'schema': [[n, t, n] for n, t in SCHEMA[:-1]]}}
+    client.query.return_value.result.return_value = iter([['a', 2, 10.5]])
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com')
+
+    pushdown = Pushdown(where=["code>=500", "agent like '%bot%'"], group_by=["host"],
+                        aggregates=["count", "avg:size"], order_by=["count:desc"])
+    columns, rows = td.query('sample_datasets', 'www_access', None, 1412377100, 1412380800, 10,
+                             'presto', pushdown=pushdown)
+
+    assert columns == ['host', 'count', 'avg_size']
+    assert client.query.call_args[0][1] == (
+        'SELECT "host", COUNT(*) AS "count", AVG("size") AS "avg_size" FROM "www_access" '
+        'WHERE TD_TIME_RANGE("time", 1412377100, 1412380800) AND "code" >= 500 AND "agent" LIKE \'%bot%\' '
+        'GROUP BY "host" ORDER BY "count" DESC LIMIT 10;')
+    assert td.columnTypes('sample_datasets', 'www_access', columns, pushdown=pushdown) == ['string', 'long', 'double']
+
+    td.query('sample_datasets', 'www_access', 'host', None, None, None, 'hive',
+             pushdown=Pushdown(where=["host='a'"]))
+    assert client.query.call_args[0][1] == (
+        "SELECT `host` FROM `www_access` WHERE TD_TIME_RANGE(`time`, NULL, NULL) AND `host` = 'a';")
+
+
+def test_cli_conflicts():
+    runner = CliRunner()
+    result = runner.invoke(query_cli.main, ['sample_datasets', 'www_access', '-c', 'host', '--agg', 'count'])
+    assert result.exit_code == 2
+    assert "--column cannot be combined with --group-by or --agg" in result.output
+
+    result = runner.invoke(query_cli.main, ['sample_datasets', 'www_access', '--agg', 'median:size'])
+    assert result.exit_code == 2
+    assert "Unknown aggregate median" in result.output
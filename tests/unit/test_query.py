@@ -1,4 +1,4 @@
-import pytest
+import datetime
 import tdclient
 from mock import patch
 from armdata import query_util
@@ -37,3 +37,86 @@ def test_check_db_and_table_class_exception(mock_class):
         ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com').checkDbAndTable('sample_datasets', "www_acc")
     except tdclient.errors.AuthError as e:
         assert str(e) == 'List databases failed: {"error":"Failed to Login"}'
+        
+
+@patch('armdata.query_util.tdclient.Client')
+def test_query_stream(mock_client):
+    client = mock_client.return_value
+    job = client.query.return_value
+    job.result.return_value = iter([['a', 1], ['b', 2]])
+    
+    with ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com') as td:
+        columns, rows = td.query('sample_datasets', 'www_access', 'host,code', None, None, 2, 'presto', stream=True)
+        
+        assert columns == ['host', 'code']
+        assert client.job_status.called and job.update.called
+        assert list(rows) == [['a', 1], ['b', 2]]
+        assert not client.close.called
+    assert client.close.called
+    
+
+@patch('armdata.query_util.tdclient.Client')
+def test_shared_client(mock_client):
+    client = mock_client.return_value
+    client.api.list_tables.return_value = {'www_access': {'schema': [['host', 'string', 'host']]}}
+    client.query.return_value.result.return_value = iter([['a']])
+    
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com', pool_size=4)
+    assert td.checkDbAndTable('sample_datasets', 'www_access') == (True, "")
+    assert td.query('sample_datasets', 'www_access', None, None, None, 1, 'presto') == (['host', 'time'], [['a']])
+    td.close()
+    
+    assert mock_client.call_count == 1
+    assert mock_client.call_args[1]['maxsize'] == 4
+    client.close.assert_called_once_with()
+    
+    
+@patch('armdata.query_util.tdclient.Client')
+def test_resolve_table_single_lookup(mock_client):
+    api = mock_client.return_value.api
+    api.list_tables.return_value = {
+        'www_access': {'schema': [['host', 'string', 'host'], ['code', 'long', 'code']]},
+    }
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com')
+    
+    assert td.checkDbAndTable('sample_datasets', 'www_access') == (True, "")
+    assert td.checkTableColumns('sample_datasets', 'www_access', ['host', 'time']) == (True, [])
+    assert td.resolveTable('sample_datasets', 'www_access') == (True, [['host', 'string'], ['code', 'long'], ['time', 'long']])
+    api.list_tables.assert_called_once_with('sample_datasets')
+    assert not mock_client.return_value.databases.called
+    
+    
+@patch('armdata.query_util.tdclient.Client')
+def test_resolve_table_not_found(mock_client):
+    api = mock_client.return_value.api
+    api.list_tables.return_value = {'www_access': {'schema': []}}
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com')
+    
+    assert td.checkDbAndTable('sample_datasets', 'www_acc') == (False, "table")
+    
+    api.list_tables.side_effect = tdclient.errors.NotFoundError('List tables failed: {"error":"Database not found"}')
+    assert td.checkDbAndTable('sample_datasets2', 'www_access') == (False, "database")
+    
+    
+@patch('armdata.query_util.tdclient.Client')
+def test_reuse_recent_job(mock_client):
+    client = mock_client.return_value
+    now = datetime.datetime.now(datetime.timezone.utc)
+    statement = 'SELECT "host" FROM "www_access" WHERE TD_TIME_RANGE("time", NULL, NULL) LIMIT 1;'
+    client.api.list_jobs.return_value = [
+        {"job_id": "3", "type": "hive", "database": "sample_datasets", "query": statement, "start_at": now},
+        {"job_id": "2", "type": "presto", "database": "sample_datasets", "query": statement.replace(" ", "  "),
+         "start_at": now - datetime.timedelta(seconds=60)},
+        {"job_id": "1", "type": "presto", "database": "sample_datasets", "query": statement,
+         "start_at": now - datetime.timedelta(seconds=7200)},
+    ]
+    client.job.return_value.result.return_value = iter([['a']])
+    
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com', reuse_jobs_within=600)
+    assert td.query('sample_datasets', 'www_access', 'host', None, None, 1, 'presto') == (['host'], [['a']])
+    client.job.assert_called_once_with("2")
+    assert not client.query.called
+    
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", 'https://api.treasuredata.com', reuse_jobs_within=30)
+    td.query('sample_datasets', 'www_access', 'host', None, None, 1, 'presto')
+    assert client.query.called
@@ -0,0 +1,44 @@
+import pytest
+from armdata import query_builder
+from armdata.query_builder import quote_identifier, quote_literal, normalize, select_statement
+
+
+def test_quote():
+    assert quote_identifier('select', "presto") == '"select"'
+    assert quote_identifier('a"b', "presto") == '"a""b"'
+    assert quote_identifier('a`b', "hive") == '`a``b`'
+    assert quote_literal("it's", "presto") == "'it''s'"
+    assert quote_literal("it's \\", "hive") == "'it\\'s \\\\'"
+    assert quote_literal(5, "presto") == "5"
+    assert quote_literal(None, "hive") == "NULL"
+    assert quote_literal(1.5, "presto") == "1.5"
+    for value in (float("nan"), float("inf"), float("-inf")):
+        with pytest.raises(ValueError, match="no SQL literal"):
+            quote_literal(value, "presto")
+
+
+def test_normalize_keeps_literals():
+    assert normalize("SELECT  host\n FROM t WHERE host = 'a  b'") == "SELECT host FROM t WHERE host = 'a  b'"
+    assert normalize("SELECT 'it''s  x'  FROM t") == "SELECT 'it''s  x' FROM t"
+    assert normalize("SELECT 'it\\'s  x'  FROM t", "hive") == "SELECT 'it\\'s  x' FROM t"
+    assert normalize('SELECT "a  b"   FROM t') == 'SELECT "a  b" FROM t'
+
+
+def test_select_statement():
+    assert select_statement("presto", "www_access", ["host", "select"], 1412377200, None, 10) == (
+        'SELECT "host", "select" FROM "www_access" WHERE TD_TIME_RANGE("time", 1412377200, NULL) LIMIT 10;')
+    assert select_statement("hive", "www_access", ["host"], conditions=[("code", ">=", 500), ("agent", "IS NULL", None)],
+                            order_by=[("host", "DESC")]) == (
+        "SELECT `host` FROM `www_access` WHERE TD_TIME_RANGE(`time`, NULL, NULL) AND `code` >= 500 "
+        "AND `agent` IS NULL ORDER BY `host` DESC;")
+    # braces in identifiers do not confuse the template
+    assert select_statement("presto", "t", ["{0}"], conditions=[("x", "=", "{1}")]) == (
+        'SELECT "{0}" FROM "t" WHERE TD_TIME_RANGE("time", NULL, NULL) AND "x" = \'{1}\';')
+
+
+def test_template_reused():
+    query_builder.compile_select.cache_clear()
+    for min_time in range(1412377200, 1412377200 + 5 * 3600, 3600):
+        select_statement("presto", "www_access", ["host"], min_time, min_time + 3600, 10)
+    info = query_builder.compile_select.cache_info()
+    assert (info.misses, info.hits) == (1, 4)
@@ -0,0 +1,74 @@
+import os
+from mock import patch
+from armdata.result_cache import ResultCache, normalize_query
+from armdata.query_util import ArmQuery
+
+ENDPOINT = 'https://api.treasuredata.com'
+
+def test_normalize_query():
+    assert normalize_query("SELECT host\n  FROM www_access ;") == "SELECT host FROM www_access ;"
+    cache = ResultCache(ENDPOINT)
+    assert cache.key("db", "SELECT  host FROM t;", "presto") == cache.key("db", "SELECT host\nFROM t;", "presto")
+    assert cache.key("db", "SELECT host FROM t;", "presto") != cache.key("db", "SELECT host FROM t;", "hive")
+    
+def test_result_cache_round_trip(tmp_path):
+    cache = ResultCache(ENDPOINT, cache_dir=str(tmp_path))
+    key = cache.key("sample_datasets", "SELECT host, code FROM www_access;", "presto")
+    assert cache.get(key) is None
+    
+    rows = cache.put(key, ["host", "code"], iter([["a", 1], ["b", None]]))
+    assert list(rows) == [["a", 1], ["b", None]]
+    
+    columns, rows = cache.get(key)
+    assert columns == ["host", "code"]
+    assert list(rows) == [["a", 1], ["b", None]]
+    
+def test_result_cache_abandoned_put(tmp_path):
+    cache = ResultCache(ENDPOINT, cache_dir=str(tmp_path))
+    key = cache.key("sample_datasets", "SELECT host FROM www_access;", "presto")
+    
+    rows = cache.put(key, ["host"], iter([["a"], ["b"]]))
+    next(rows)
+    rows.close()
+    
+    assert cache.get(key) is None
+    assert os.listdir(os.path.join(str(tmp_path), "results")) == []
+    
+def test_result_cache_ttl(tmp_path):
+    cache = ResultCache(ENDPOINT, cache_dir=str(tmp_path), open_ttl=60)
+    with patch('armdata.result_cache.time.time', return_value=1412377200):
+        assert cache.windowTtl(1412377100) is None
+        assert cache.windowTtl(1412377300) == 60
+        assert cache.windowTtl(None) == 60
+        list(cache.put("open", ["host"], iter([["a"]]), ttl=60))
+    with patch('armdata.result_cache.time.time', return_value=1412377261):
+        assert cache.get("open") is None
+        
+def test_result_cache_lru_eviction(tmp_path):
+    cache = ResultCache(ENDPOINT, cache_dir=str(tmp_path), max_bytes=3500)
+    for i, key in enumerate(["a", "b", "c"]):
+        list(cache.put(key, ["host"], iter([["x" * 1000]])))
+        os.utime(os.path.join(str(tmp_path), "results", key + ".msgpack"), (i, i))
+    #reading "a" makes "b" the least recently used entry
+    list(cache.get("a")[1])
+    list(cache.put("d", ["host"], iter([["x" * 1000]])))
+    
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    
+@patch('armdata.query_util.tdclient.Client')
+def test_query_served_from_result_cache(mock_client, tmp_path):
+    client = mock_client.return_value
+    client.query.return_value.result.side_effect = lambda: iter([['a', 1]])
+    td = ArmQuery("10574/8fe2c7251368da13d33683b37fa382c87f8eb", ENDPOINT,
+                  result_cache=ResultCache(ENDPOINT, cache_dir=str(tmp_path)))
+    
+    for _ in range(2):
+        assert td.query('sample_datasets', 'www_access', 'host,code', 1412377100, 1412380800, None,
+                        'presto') == (['host', 'code'], [['a', 1]])
+    assert client.query.call_count == 1
+    
+    #open ended windows are cached for a short while only
+    td.query('sample_datasets', 'www_access', 'host,code', 1412377100, None, None, 'presto')
+    assert client.query.call_count == 2
@@ -0,0 +1,121 @@
+import time
+import sqlite3
+import pytest
+from mock import patch
+from click.testing import CliRunner
+from armdata import partition, query_cli, sinks
+from armdata.sinks import FileSink, RotatingFileSink, SQLiteSink, open_sink, part_path, prefetch
+
+COLUMNS = ['host', 'code', 'size', 'tags', 'time']
+
+TYPES = ['string', 'long', 'double', 'array<string>', 'long']
+
+ROWS = [['a', 200, 0.5, ['x'], 1412377100], ['b', None, 1.5, None, 1412377101], ['c', 404, None, [], 1412377102]]
+
+
+def test_part_path():
+    assert part_path('out.csv', 2) == 'out-00002.csv'
+    assert part_path('/tmp/events.csv.gz', 0) == '/tmp/events-00000.csv.gz'
+    assert part_path('events', 1) == 'events-00001'
+
+
+def test_file_and_rotating_sinks(tmp_path):
+    path = str(tmp_path / 'out.csv')
+    assert FileSink('csv', path).write(COLUMNS[:2], None, iter(row[:2] for row in ROWS)) == 3
+    assert open(path).read() == 'host,code\na,200\nb,\nc,404\n'
+
+    sink = RotatingFileSink('csv', path, 2)
+    assert sink.write(COLUMNS[:2], None, iter(row[:2] for row in ROWS)) == 3
+    assert sink.parts == [str(tmp_path / 'out-00000.csv'), str(tmp_path / 'out-00001.csv')]
+    assert open(sink.parts[1]).read() == 'host,code\nc,404\n'
+
+    empty = RotatingFileSink('csv', str(tmp_path / 'empty.csv'), 2)
+    assert empty.write(COLUMNS[:2], None, iter([])) == 0
+    assert open(empty.parts[0]).read() == 'host,code\n'
+
+
+def test_sqlite_sink(tmp_path):
+    path = str(tmp_path / 'out.db')
+    with patch.object(sinks, 'SQLITE_BATCH_ROWS', 2):
+        assert SQLiteSink(path, 'www_access').write(COLUMNS, TYPES, iter(ROWS)) == 3
+        # a second run appends
+        assert open_sink('sqlite', path, table='www_access').write(COLUMNS, TYPES, iter(ROWS[:1])) == 1
+
+    connection = sqlite3.connect(path)
+    assert connection.execute('SELECT * FROM www_access ORDER BY rowid').fetchall() == [
+        ('a', 200, 0.5, '["x"]', 1412377100), ('b', None, 1.5, None, 1412377101),
+        ('c', 404, None, '[]', 1412377102), ('a', 200, 0.5, '["x"]', 1412377100)]
+    assert [column[2] for column in connection.execute('PRAGMA table_info(www_access)')] == [
+        'TEXT', 'INTEGER', 'REAL', 'TEXT', 'INTEGER']
+    connection.close()
+
+    with pytest.raises(ValueError) as e:
+        SQLiteSink(path, 'www_access').write(['missing'], ['string'], iter([['a']]))
+    assert 'Cannot write to the SQLite table www_access' in str(e.value)
+
+
+def test_prefetch_backpressure():
+    downloaded = []
+
+    def download():
+        for i in range(100):
+            downloaded.append(i)
+            yield [i]
+        raise ValueError("connection reset")
+
+    with patch.object(partition, 'SHARD_BATCH_ROWS', 2), patch.object(partition, 'SHARD_QUEUE_BATCHES', 3):
+        rows = prefetch(download())
+        assert next(rows) == [0]
+        time.sleep(0.2)
+        # the download ran ahead of the writer, by no more than the queue
+        assert 4 <= len(downloaded) <= 2 * (3 + 2)
+        with pytest.raises(ValueError):
+            list(rows)
+    assert len(downloaded) == 100
+
+
+@patch('armdata.query_util.ArmQuery')
+def test_cli_sqlite_and_parts(mock_class, tmp_path):
+    instance = mock_class.return_value
+    instance.checkDbAndTable.return_value = (True, "")
+    instance.checkTableColumns.return_value = (True, [])
+    instance.columnTypes.return_value = ['string', 'long']
+    instance.query.side_effect = lambda *args, **kwargs: (['host', 'code'], iter([['a', 200], ['b', 404]]))
+    runner = CliRunner(env={"TD_API_KEY": "x"})
+
+    path = str(tmp_path / 'out.db')
+    result = runner.invoke(query_cli.main, ['sample_datasets', 'www_access', '-f', 'sqlite', '-o', path])
+    assert result.exit_code == 0, result.output
+    connection = sqlite3.connect(path)
+    assert connection.execute('SELECT host, code FROM www_access').fetchall() == [('a', 200), ('b', 404)]
+    connection.close()
+
+    result = runner.invoke(query_cli.main, ['sample_datasets', 'www_access', '-f', 'csv', '--part-rows', '1',
+                                            '-o', str(tmp_path / 'out.csv')])
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / 'out-00001.csv').read_text() == 'host,code\nb,404\n'
+
+    result = runner.invoke(query_cli.main, ['sample_datasets', 'www_access', '-f', 'sqlite'])
+    assert result.exit_code == 2
+    assert 'sqlite output needs the database file' in result.output
+
+
+def test_prefetched_shards_stop_promptly():
+    killed = []
+
+    def shard(stopped):
+        try:
+            yield ['first']
+            # a job still running until the merge stops
+            stopped.wait(20)
+        finally:
+            if stopped.is_set():
+                killed.append(True)
+
+    with patch.object(partition, 'SHARD_BATCH_ROWS', 1):
+        rows = prefetch(partition.merge_shards([shard, shard], 2))
+        assert next(rows) == ['first']
+        started = time.monotonic()
+        rows.close()
+    assert time.monotonic() - started < 2
+    assert killed == [True, True]
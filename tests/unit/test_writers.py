@@ -0,0 +1,139 @@
+import io
+import msgpack
+import pytest
+from mock import patch
+from click.testing import CliRunner
+from armdata import writers
+from armdata.writers import write_columnar, iter_batches
+from armdata.query_cli import main
+
+COLUMNS = ['host', 'code', 'ratio', 'tags', 'time']
+TYPES = ['string', 'long', 'double', 'array<string>', 'long']
+ROWS = [['10.0.0.1', 200, 0.5, ['a', 'b'], 1412377100],
+        ['10.0.0.2', None, 1.5, None, 1412377101],
+        [None, 404, None, [], 1412377102]]
+
+def test_iter_batches():
+    assert list(iter_batches(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(iter_batches(iter([]), 2)) == []
+    
+@patch('armdata.writers.BATCH_ROWS', 2)
+def test_write_msgpack():
+    out = io.BytesIO()
+    
+    assert write_columnar("msgpack", out, COLUMNS, TYPES, iter(ROWS)) == 3
+    
+    unpacker = msgpack.Unpacker(io.BytesIO(out.getvalue()), raw=False)
+    assert next(unpacker) == {"columns": COLUMNS, "types": TYPES}
+    assert next(unpacker)["host"] == ['10.0.0.1', '10.0.0.2']
+    assert next(unpacker) == {'host': [None], 'code': [404], 'ratio': [None], 'tags': [[]], 'time': [1412377102]}
+    
+@patch('armdata.writers.BATCH_ROWS', 2)
+def test_write_parquet():
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+    out = io.BytesIO()
+    
+    assert write_columnar("parquet", out, COLUMNS, TYPES, iter(ROWS)) == 3
+    
+    parquet_file = pa.parquet.ParquetFile(io.BytesIO(out.getvalue()))
+    assert parquet_file.num_row_groups == 2
+    table = parquet_file.read()
+    assert table.schema.field('code').type == pa.int64()
+    assert table.column('code').to_pylist() == [200, None, 404]
+    assert table.column('tags').to_pylist() == ['["a", "b"]', None, '[]']
+    
+def test_write_arrow():
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+    out = io.BytesIO()
+    
+    write_columnar("arrow", out, COLUMNS, TYPES, iter(ROWS))
+    
+    table = pa.ipc.open_file(io.BytesIO(out.getvalue())).read_all()
+    assert table.column_names == COLUMNS
+    assert table.column('ratio').to_pylist() == [0.5, 1.5, None]
+    
+def test_write_arrow_type_mismatch():
+    pytest.importorskip("pyarrow")
+    
+    with pytest.raises(ValueError) as e:
+        write_columnar("arrow", io.BytesIO(), ['code'], ['long'], iter([['OK']]))
+    assert "Column code does not hold long values" in str(e.value)
+    
+@patch('armdata.query_util.ArmQuery')
+def test_cli_with_msgpack_output_file(mock_class, tmp_path):
+    """Query writes msgpack batches to the output file with column types
+       from the table schema
+    """
+    instance = mock_class.return_value
+    instance.checkDbAndTable.return_value = (True, "")
+    instance.checkTableColumns.return_value = (True, [])
+    instance.columnTypes.return_value = ['string', 'long']
+    instance.query.return_value = (['host', 'code'], iter([['a', 200], ['b', 404]]))
+    path = str(tmp_path / "out.msgpack")
+    
+    runner = CliRunner()
+    result = runner.invoke(main, ["sample_datasets", "www_access", "-f", "msgpack", "-o", path, "-c", "host,code"])
+    
+    assert result.exit_code == 0
+    unpacker = msgpack.Unpacker(open(path, "rb"), raw=False)
+    assert next(unpacker) == {"columns": ['host', 'code'], "types": ['string', 'long']}
+    assert next(unpacker) == {"host": ['a', 'b'], "code": [200, 404]}
+    
+def test_write_csv_quoting():
+    out = io.BytesIO()
+    rows = [['a,b', 'say "hi"', 'two\nlines', None, 0, False],
+            ['plain', '', 'é', 1.5, 200, True]]
+    
+    assert writers.write_csv(out, ['c1', 'c2', 'c3', 'c4', 'c5', 'c6'], iter(rows)) == 2
+    
+    assert out.getvalue().decode("utf-8") == (
+        'c1,c2,c3,c4,c5,c6\n'
+        '"a,b","say ""hi""","two\nlines",,0,False\n'
+        'plain,,é,1.5,200,True\n')
+    
+@patch('armdata.writers.CSV_BATCH_ROWS', 2)
+def test_write_csv_batches_without_header():
+    out = io.BytesIO()
+    
+    writers.write_csv(out, ['n'], iter([[i] for i in range(5)]), header=False)
+    
+    assert out.getvalue() == b'0\n1\n2\n3\n4\n'
+    
+def test_open_output_gzip_by_suffix(tmp_path):
+    import gzip
+    path = str(tmp_path / "out.csv.gz")
+    for rows in ([[1]], [[2]]):
+        with writers.open_output(path, append=rows[0][0] == 2) as out:
+            writers.write_csv(out, ['n'], iter(rows), header=rows[0][0] == 1)
+    
+    assert gzip.open(path).read() == b'n\n1\n2\n'
+    
+def test_open_output_zstd(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    path = str(tmp_path / "out.csv")
+    with writers.open_output(path, compression="zstd") as out:
+        writers.write_csv(out, ['n'], iter([[1]]))
+    
+    with open(path, "rb") as f:
+        assert zstandard.ZstdDecompressor().stream_reader(f).read() == b'n\n1\n'
+        
+@patch('armdata.query_util.ArmQuery')
+def test_cli_with_gzip_csv_output_file(mock_class, tmp_path):
+    """Query writes gzip compressed csv to the output file
+    """
+    import gzip
+    instance = mock_class.return_value
+    instance.checkDbAndTable.return_value = (True, "")
+    instance.checkTableColumns.return_value = (True, [])
+    instance.query.return_value = (['host', 'path'], iter([['a', '/x,y'], ['b', None]]))
+    path = str(tmp_path / "out.csv")
+    
+    runner = CliRunner()
+    result = runner.invoke(main, ["sample_datasets", "www_access", "-f", "csv", "-o", path,
+                                  "--compress", "gzip", "-c", "host,path"])
+    
+    assert result.exit_code == 0
+    assert result.output == ""
+    assert gzip.open(path).read() == b'host,path\na,"/x,y"\nb,\n'